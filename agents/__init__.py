@@ -7,6 +7,8 @@ Multi-Agent Stock Analysis System
 - TechnicalAgent: 技术分析Agent
 - ValuationAgent: 估值分析Agent
 - SummaryAgent: 汇总分析Agent
+- AgentResultCache: 专业Agent结果缓存（按有效窗口失效）
+- ContextCompactor: 下游提示词的上下文压缩（按token预算）
 """
 
 from .base_agent import BaseAgent
@@ -15,6 +17,8 @@ from .technical_agent import TechnicalAgent
 from .valuation_agent import ValuationAgent
 from .summary_agent import SummaryAgent
 from .investment_agent import InvestmentAgent
+from .result_cache import AgentResultCache, get_shared_result_cache
+from .context_compactor import ContextCompactor
 
 __all__ = [
     'BaseAgent',
@@ -22,5 +26,8 @@ __all__ = [
     'TechnicalAgent',
     'ValuationAgent',
     'SummaryAgent',
-    'InvestmentAgent'
+    'InvestmentAgent',
+    'AgentResultCache',
+    'get_shared_result_cache',
+    'ContextCompactor'
 ] 
\ No newline at end of file
@@ -7,7 +7,8 @@
 from abc import ABC, abstractmethod
 from typing import Any, Dict, Optional
 from langchain_core.messages import HumanMessage
-from langgraph.prebuilt import create_react_agent
+from tracing import get_tracing_callbacks
+from report_artifacts import send_artifact
 import datetime
 
 
@@ -33,6 +34,8 @@ class BaseAgent(ABC):
         self.llm = None
         self.tools = None
         self.websocket = None
+        self.result_cache = None
+        self.compactor = None
         
     def set_llm(self, llm):
         """设置语言模型"""
@@ -45,6 +48,42 @@ class BaseAgent(ABC):
     def set_websocket(self, websocket):
         """设置WebSocket连接用于日志发送"""
         self.websocket = websocket
+        
+    def set_result_cache(self, result_cache):
+        """设置结果缓存"""
+        self.result_cache = result_cache
+    
+    def get_run_config(self) -> Dict[str, Any]:
+        """执行配置：追踪回调通过 metadata 中的 agent 区分各Agent的LLM耗时和token数"""
+        return {
+            "configurable": {"thread_id": "1"},
+            "callbacks": get_tracing_callbacks(),
+            "metadata": {"agent": self.name},
+        }
+    
+    def get_cache_window(self, state: Dict[str, Any]) -> Optional[str]:
+        """
+        获取分析结果的有效窗口
+        
+        窗口不变时分析结果可以复用，默认按交易日失效。
+        子类可以覆盖此方法声明更长的窗口，返回None表示不缓存
+        
+        Args:
+            state: 状态字典
+            
+        Returns:
+            有效窗口标识，如 "2024-06-28" 或 "2024Q2"
+        """
+        return state.get('current_date') or None
+    
+    def get_cache_key(self, state: Dict[str, Any]):
+        """获取结果缓存键，不可缓存时返回None"""
+        if self.result_cache is None or not state.get('stock_code'):
+            return None
+        window = self.get_cache_window(state)
+        if not window:
+            return None
+        return self.result_cache.make_key(self.name, state['stock_code'], window)
     
     async def send_log(self, message: str, log_type: str = "info"):
         """发送日志消息"""
@@ -61,6 +100,20 @@ class BaseAgent(ABC):
             if self.verbose:
                 print(f"[{self.name}] [{log_type.upper()}] {message}")
     
+    async def send_result_artifact(self, result: str):
+        """把分析结果作为报告产物分块发送到前端"""
+        if self.websocket:
+            await send_artifact(self.websocket, self.get_result_key(), result)
+    
+    async def log_prompt_size(self, prompt: str):
+        """记录上下文压缩前后的大小和最终提示词的token数"""
+        from .context_compactor import count_tokens
+        
+        if self.compactor and self.compactor.stats:
+            for line in self.compactor.summary_lines():
+                await self.send_log(f"📉 上下文压缩 - {line}", "info")
+        await self.send_log(f"📏 提示词大小: {count_tokens(prompt)} tokens", "info")
+    
     def verbose_print(self, message: str):
         """根据verbose参数决定是否打印消息"""
         if self.verbose:
@@ -103,6 +156,17 @@ class BaseAgent(ABC):
         """
         pass
     
+    async def prepare_context(self, state: Dict[str, Any]):
+        """
+        在生成提示词之前准备本地预计算的数据，命中结果缓存时不会调用
+        
+        子类可以覆盖此方法，把预计算结果写入状态；默认不做任何事
+        
+        Args:
+            state: 状态字典
+        """
+        pass
+    
     async def analyze(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """
         执行分析任务，显示优化的React中间过程
@@ -113,18 +177,33 @@ class BaseAgent(ABC):
         Returns:
             更新后的状态字典
         """
+        # 有效窗口内命中缓存时直接复用结果
+        cache_key = self.get_cache_key(state)
+        if cache_key:
+            cached_result = self.result_cache.get(cache_key)
+            if cached_result is not None:
+                state[self.get_result_key()] = cached_result
+                await self.send_log(f"💾 命中缓存（有效窗口 {cache_key[2]}），复用{self.description}结果", "success")
+                await self.send_result_artifact(cached_result)
+                return state
+        
         await self.send_log(f"🚀 开始{self.description}...", "info")
         
+        # 本地预计算的数据（指标、财务快照等）写入状态，供提示词使用
+        await self.prepare_context(state)
+        
         try:
             # 创建提示词
             prompt = self.create_prompt(state)
             
             # 创建agent executor
+            from langgraph.prebuilt import create_react_agent
             agent_executor = create_react_agent(self.llm, self.tools)
             
             # 准备初始消息
             initial_messages = [HumanMessage(content=prompt)]
-            config = {"configurable": {"thread_id": "1"}}
+            # 回调按Agent记录LLM调用和工具调用的耗时及token数
+            config = self.get_run_config()
             
             # 初始化思考内容累积器
             thinking_buffer = ""
@@ -213,7 +292,7 @@ class BaseAgent(ABC):
             
             # 获取最终结果
             await self.send_log("📋 正在整理分析结果...", "info")
-            final_response = await agent_executor.ainvoke({"messages": initial_messages})
+            final_response = await agent_executor.ainvoke({"messages": initial_messages}, config=config)
             
             # 提取结果
             if final_response and "messages" in final_response:
@@ -232,6 +311,8 @@ class BaseAgent(ABC):
             # 存储结果
             result_key = self.get_result_key()
             state[result_key] = result
+            if cache_key:
+                self.result_cache.set(cache_key, result)
             
             # 显示分析摘要
             # 确保result是字符串
@@ -242,8 +323,8 @@ class BaseAgent(ABC):
             word_count = len(result.split())
             await self.send_log(f"📊 **分析完成**: 生成 {result_length} 字符，约 {word_count} 词", "success")
             
-            # 显示完整结果
-            await self.send_log(f"📄 **完整分析结果**\n{result}", "success")
+            # 完整结果作为产物发送一次，最终报告只引用其ID
+            await self.send_result_artifact(result)
             
             await self.send_log(f"🎉 **{self.description}** 执行完成！", "success")
             
@@ -251,6 +332,7 @@ class BaseAgent(ABC):
             await self.send_log(f"❌ **{self.description}失败**: {str(e)}", "error")
             result_key = self.get_result_key()
             state[result_key] = f"{self.description}执行失败: {e}"
+            await self.send_result_artifact(state[result_key])
         
         return state
     
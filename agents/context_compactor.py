@@ -0,0 +1,173 @@
+"""
+上下文压缩
+
+汇总Agent和投资决策Agent的提示词会拼接上游分析的全文和历史价格，长度不受控制。
+这里用 tiktoken 计量各段落的token数，超出预算时抽取标题、结论、评级、
+目标价、风险等关键行，保证下游提示词大小稳定
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+# 各段落的默认token预算，可通过环境变量调整
+DEFAULT_BUDGETS = {
+    "specialist_analysis": int(os.getenv("CONTEXT_BUDGET_SPECIALIST", "800")),
+    "summary_analysis": int(os.getenv("CONTEXT_BUDGET_SUMMARY", "1200")),
+}
+
+# 历史价格最多保留的最近价格点数
+MAX_PRICE_POINTS = int(os.getenv("CONTEXT_MAX_PRICE_POINTS", "10"))
+
+# 关键结论行的标记
+KEY_MARKERS = [
+    "投资建议", "评级", "结论", "建议", "目标价", "止损", "风险", "总结", "综合",
+    "评分", "估值", "趋势", "支撑", "阻力", "买入", "卖出", "持有",
+]
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """加载tiktoken编码，失败（如离线无法下载词表）时返回None并改用估算"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base"))
+        except Exception as e:
+            _encoding_failed = True
+            print(f"⚠️ tiktoken编码加载失败，改用字符数估算token: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """计算文本的token数"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # 估算：中文约每字1个token，其余约每4个字符1个token
+    cjk = len(re.findall(r'[\u4e00-\u9fff]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _line_priority(line: str) -> int:
+    """行的保留优先级，数值越小越优先"""
+    stripped = line.strip()
+    if stripped.startswith('#'):
+        return 0
+    if any(marker in stripped for marker in KEY_MARKERS):
+        return 1 if '**' in stripped else 2
+    if '**' in stripped:
+        return 3
+    if stripped.startswith(('-', '*', '•')) or re.match(r'^\d+[\.、]', stripped):
+        return 4
+    return 5
+
+
+def _truncate(text: str, budget: int) -> str:
+    """按token预算截断文本"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:budget])
+    while text and count_tokens(text) > budget:
+        text = text[:int(len(text) * 0.9)]
+    return text
+
+
+def extract_key_conclusions(text: str, budget: int) -> str:
+    """
+    从分析全文中抽取关键结论，结果不超过token预算
+
+    预算内的文本原样返回；超出时按优先级（标题 > 含结论关键词的加粗行 >
+    含结论关键词的行 > 加粗行 > 列表项 > 正文）选取行，保持原有顺序
+
+    Args:
+        text: 分析全文
+        budget: token预算
+
+    Returns:
+        压缩后的文本
+    """
+    if count_tokens(text) <= budget:
+        return text
+
+    lines = [line for line in text.split('\n') if line.strip()]
+    ranked = sorted(range(len(lines)), key=lambda i: (_line_priority(lines[i]), i))
+
+    selected = set()
+    used = 0
+    for index in ranked:
+        cost = count_tokens(lines[index]) + 1
+        if used + cost > budget:
+            continue
+        selected.add(index)
+        used += cost
+
+    if not selected:
+        return _truncate(text, budget)
+    return '\n'.join(lines[i] for i in sorted(selected))
+
+
+def compact_prices(prices: List[float], max_points: int = MAX_PRICE_POINTS) -> str:
+    """将历史价格列表压缩为区间统计加最近的价格点"""
+    if not prices:
+        return "无"
+    if len(prices) <= max_points:
+        return ", ".join(f"{p:.2f}" for p in prices)
+    recent = ", ".join(f"{p:.2f}" for p in prices[-max_points:])
+    return (f"共{len(prices)}个交易日，区间最高 {max(prices):.2f}，最低 {min(prices):.2f}，"
+            f"均价 {sum(prices) / len(prices):.2f}，首日 {prices[0]:.2f}；最近{max_points}日: {recent}")
+
+
+class ContextCompactor:
+    """按段落token预算压缩提示词上下文，并记录压缩前后的大小"""
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None):
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+        self.stats: List[Dict[str, Any]] = []
+
+    def reset(self):
+        self.stats = []
+
+    def compact(self, name: str, text: Any, kind: str) -> str:
+        """
+        按预算压缩一个段落
+
+        Args:
+            name: 段落名称（用于日志）
+            text: 段落原文
+            kind: 预算类型，见 DEFAULT_BUDGETS
+        """
+        text = text if isinstance(text, str) else str(text)
+        budget = self.budgets[kind]
+        compacted = extract_key_conclusions(text, budget)
+        self.stats.append({
+            "name": name,
+            "budget": budget,
+            "before": count_tokens(text),
+            "after": count_tokens(compacted),
+        })
+        return compacted
+
+    def compact_prices(self, name: str, prices: List[float]) -> str:
+        raw = str(prices)
+        compacted = compact_prices(prices)
+        self.stats.append({
+            "name": name,
+            "budget": None,
+            "before": count_tokens(raw),
+            "after": count_tokens(compacted),
+        })
+        return compacted
+
+    def summary_lines(self) -> List[str]:
+        """压缩统计的日志行"""
+        return [
+            f"{item['name']}: {item['before']} → {item['after']} tokens"
+            + (f"（预算 {item['budget']}）" if item['budget'] else "")
+            for item in self.stats
+        ]
@@ -4,7 +4,8 @@
 专门负责公司基本面分析，包括财务报表分析、盈利能力、成长性等
 """
 
-from typing import Any, Dict
+import asyncio
+from typing import Any, Dict, Optional
 from .base_agent import BaseAgent
 
 
@@ -17,18 +18,99 @@ class FundamentalAgent(BaseAgent):
             description="基本面分析",
             verbose=verbose
         )
+        self.snapshot_engine = None
+        self._report_window: Optional[str] = None
+    
+    def set_snapshot_engine(self, snapshot_engine):
+        """设置基本面时点快照引擎"""
+        self.snapshot_engine = snapshot_engine
     
     def get_result_key(self) -> str:
         """返回基本面分析结果的键名"""
         return "fundamental_analysis"
     
+    def get_cache_window(self, state: Dict[str, Any]) -> Optional[str]:
+        """
+        基本面随财报发布变化，按截至分析日期最新发布的报告失效
+        
+        同一报告期内新报告发布（如4月底年报与一季报相继发布）时立即失效，
+        跨日历季度但没有新报告时继续复用。没有快照引擎或时点表加载失败时按日历季度失效
+        """
+        if self._report_window:
+            return self._report_window
+        current_date = state.get('current_date')
+        if not current_date:
+            return None
+        year, month = int(current_date[:4]), int(current_date[5:7])
+        return f"{year}Q{(month - 1) // 3 + 1}"
+    
+    async def analyze(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """先确定最新已发布的报告作为缓存窗口，再按基类流程分析"""
+        self._report_window = await self.resolve_report_window(state)
+        return await super().analyze(state)
+    
+    async def resolve_report_window(self, state: Dict[str, Any]) -> Optional[str]:
+        """截至分析日期最新发布的报告，如 "report:2024-03-31@2024-04-27"，无法确定时返回None"""
+        as_of = state.get('current_date')
+        if self.snapshot_engine is None or not as_of or not state.get('stock_code'):
+            return None
+        try:
+            # 时点表与 prepare_context 共用，首次加载可能从baostock批量同步
+            report = await asyncio.to_thread(self.snapshot_engine.latest_report, state['stock_code'], as_of)
+        except Exception:
+            return None
+        if report is None:
+            return None
+        stat_date, pub_date = report
+        return f"report:{stat_date}@{pub_date}"
+    
+    async def prepare_context(self, state: Dict[str, Any]):
+        """取出截至分析日期已发布的季度财务数据，快照注入提示词"""
+        if self.snapshot_engine is not None and not state.get('fundamental_snapshot'):
+            state['fundamental_snapshot'] = await self.load_fundamental_snapshot(state)
+    
+    async def load_fundamental_snapshot(self, state: Dict[str, Any]) -> str:
+        """
+        获取截至分析日期的财务快照，失败时返回空字符串（回退到工具获取财务数据）
+        
+        Args:
+            state: 状态字典
+            
+        Returns:
+            财务快照文本
+        """
+        as_of = state.get('current_date')
+        if not as_of or not state.get('stock_code'):
+            return ""
+        try:
+            # 首次加载可能从baostock批量同步，放到线程中执行
+            snapshot = await asyncio.to_thread(self.snapshot_engine.get_summary, state['stock_code'], as_of)
+        except Exception as e:
+            await self.send_log(f"⚠️ 季度财务数据批量加载失败，改用工具获取: {e}", "warning")
+            return ""
+        if snapshot:
+            await self.send_log("📑 已批量加载盈利、营运、成长、偿债、现金流、杜邦季度数据", "info")
+        return snapshot or ""
+    
     def get_analysis_prompt(self, state: Dict[str, Any]) -> str:
         """生成基本面分析的提示词"""
         context = self.get_common_context(state)
         
+        snapshot = state.get('fundamental_snapshot')
+        if snapshot:
+            snapshot_section = f"""
+{snapshot}
+
+以上季度财务数据已按发布日期整理，只包含分析日期前已经发布的报告，请直接使用，
+不要再调用 get_profit_data、get_operation_data、get_growth_data、get_balance_data、get_cash_flow_data、get_dupont_data；
+公司基本信息、行业和分红数据仍通过工具获取。
+"""
+        else:
+            snapshot_section = ""
+        
         return f"""请分析{state['company_name']}（股票代码：{state['stock_code']}）的基本面情况。
 {context}
-
+{snapshot_section}
 请进行以下基本面分析：
 
 ## 分析任务
@@ -4,10 +4,11 @@
 基于综合分析报告和市场数据生成具体的投资决策
 """
 
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from .base_agent import BaseAgent
+from .context_compactor import ContextCompactor
 from langchain_core.messages import HumanMessage
-from langgraph.prebuilt import create_react_agent
+from streaming_indicators import format_indicator_snapshot
 import json
 import re
 
@@ -21,11 +22,16 @@ class InvestmentAgent(BaseAgent):
             description="智能投资决策生成",
             verbose=verbose
         )
+        self.compactor = ContextCompactor()
     
     def get_result_key(self) -> str:
         """返回投资决策结果的键名"""
         return "investment_decision"
     
+    def get_cache_window(self, state: Dict[str, Any]) -> Optional[str]:
+        """投资决策依赖持仓状态，不缓存"""
+        return None
+    
     async def analyze(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """
         执行投资决策任务，生成JSON格式的投资决策
@@ -41,18 +47,21 @@ class InvestmentAgent(BaseAgent):
         try:
             # 创建提示词
             prompt = self.create_prompt(state)
+            await self.log_prompt_size(prompt)
             
             await self.send_log(f"📝 正在基于综合分析和市场数据生成投资决策...", "info")
             
             # 创建一个不带工具的agent executor
+            from langgraph.prebuilt import create_react_agent
             agent_executor = create_react_agent(self.llm, [])
             
             # 准备初始消息
             initial_messages = [HumanMessage(content=prompt)]
-            config = {"configurable": {"thread_id": "1"}}
+            # 回调按Agent记录LLM调用和工具调用的耗时及token数
+            config = self.get_run_config()
             
             # 获取AI响应
-            final_response = await agent_executor.ainvoke({"messages": initial_messages})
+            final_response = await agent_executor.ainvoke({"messages": initial_messages}, config=config)
             
             # 提取结果
             if final_response and "messages" in final_response:
@@ -282,12 +291,36 @@ class InvestmentAgent(BaseAgent):
             "current_price": None
         }
     
+    def get_specialist_digest(self, state: Dict[str, Any]) -> str:
+        """
+        拼接已完成的专业分析（各自按预算压缩），用于没有综合分析报告的回测流程
+    
+        Args:
+            state: 状态字典
+    
+        Returns:
+            专业分析摘要，全部未运行时返回提示文本
+        """
+        sections = []
+        for key, title in [("fundamental_analysis", "基本面分析"),
+                           ("technical_analysis", "技术分析"),
+                           ("valuation_analysis", "估值分析")]:
+            if state.get(key):
+                sections.append(f"### {title}\n{self.compactor.compact(title, state[key], 'specialist_analysis')}")
+        return "\n\n".join(sections) if sections else "综合分析暂未完成"
+    
     def get_analysis_prompt(self, state: Dict[str, Any]) -> str:
         """生成投资决策的提示词"""
         context = self.get_common_context(state)
         
-        # 获取综合分析结果
-        summary_analysis = state.get('summary_analysis', '综合分析暂未完成')
+        # 获取综合分析结果，超出预算时只保留关键结论
+        self.compactor.reset()
+        if state.get('summary_analysis'):
+            summary_analysis = self.compactor.compact(
+                "综合分析", state['summary_analysis'], "summary_analysis")
+        else:
+            # 回测流程不经过汇总节点，直接使用本次运行的专业分析结果
+            summary_analysis = self.get_specialist_digest(state)
         
         # 获取市场数据
         current_price = state.get('current_price', '未知')
@@ -305,6 +338,16 @@ class InvestmentAgent(BaseAgent):
             else:
                 price_trend = f"价格相对稳定 ({recent_change:.1f}%)"
         
+        # 历史价格压缩为区间统计和最近的价格点
+        price_history = self.compactor.compact_prices("历史价格", historical_prices)
+        
+        # 回测逐日推进时维护的流式指标
+        indicator_line = ""
+        if state.get('indicator_snapshot'):
+            indicators = format_indicator_snapshot(state['indicator_snapshot'])
+            if indicators:
+                indicator_line = f"\n- **技术指标**: {indicators}"
+        
         # 构建投资组合状态信息
         portfolio_info = ""
         if portfolio_state:
@@ -328,7 +371,7 @@ class InvestmentAgent(BaseAgent):
 ## 市场数据信息：
 - **当前价格**: {current_price}元
 - **价格趋势**: {price_trend}
-- **历史价格**: {historical_prices}
+- **历史价格**: {price_history}{indicator_line}
 
 ## 投资组合状态：
 {portfolio_info}
@@ -0,0 +1,72 @@
+"""
+Agent结果缓存
+
+按 (Agent, 股票代码, 有效窗口) 缓存专业Agent的分析结果。
+有效窗口由各Agent自行声明，例如基本面按财报季度、估值和技术面按交易日，
+窗口不变时直接复用结果，避免重复运行完整的ReAct分析
+"""
+
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from shared_cache import MemoryBackend, SharedCache, get_shared_cache
+
+
+CacheKey = Tuple[str, str, str]
+
+
+class AgentResultCache:
+    """专业Agent结果缓存（进程内LRU，CACHE_BACKEND=sqlite 时为多worker共享的SQLite）"""
+
+    def __init__(self, maxsize: Optional[int] = None, store: Optional[SharedCache] = None):
+        """
+        初始化结果缓存
+
+        Args:
+            maxsize: 最大缓存条目数，默认读取 AGENT_CACHE_SIZE 环境变量
+            store: 底层缓存，默认为独立的进程内LRU
+        """
+        self.maxsize = maxsize or int(os.getenv("AGENT_CACHE_SIZE", "1000"))
+        self._store = store or SharedCache("agent_result", MemoryBackend(), self.maxsize)
+
+    @staticmethod
+    def make_key(agent_name: str, stock_code: str, window: str) -> CacheKey:
+        return (agent_name, stock_code, window)
+
+    @property
+    def hits(self) -> int:
+        return self._store.hits
+
+    @property
+    def misses(self) -> int:
+        return self._store.misses
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        """读取缓存，未命中返回None"""
+        return self._store.get("|".join(key))
+
+    def set(self, key: CacheKey, value: Any):
+        """写入缓存"""
+        self._store.set("|".join(key), value)
+
+    def clear(self):
+        """清空缓存"""
+        self._store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计（本worker）"""
+        return self._store.stats()
+
+
+_shared_cache: Optional[AgentResultCache] = None
+
+
+def get_shared_result_cache() -> Optional[AgentResultCache]:
+    """获取共享的结果缓存（多worker部署时跨进程共享），AGENT_CACHE_ENABLED=0 时返回None"""
+    global _shared_cache
+    if os.getenv("AGENT_CACHE_ENABLED", "1") == "0":
+        return None
+    if _shared_cache is None:
+        maxsize = int(os.getenv("AGENT_CACHE_SIZE", "1000"))
+        _shared_cache = AgentResultCache(maxsize, store=get_shared_cache("agent_result", maxsize))
+    return _shared_cache
@@ -1,13 +1,29 @@
 """
 汇总分析Agent
 
-专门负责整合三个专业Agent的分析结果，生成综合投资报告
+专门负责整合三个专业Agent的分析结果，生成综合投资报告。
+
+汇总按map-reduce增量进行：某个专业Agent完成时，立即由 summarize_section 提炼为要点（map），
+与其他仍在运行的Agent并行；最后完成的Agent不再单独提炼。有要点时汇总节点使用简短的合并提示词，
+只把各要点和最后一个结果的关键结论合并为报告（reduce），不再重复完整的综合分析任务说明
 """
 
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from .base_agent import BaseAgent
+from .context_compactor import ContextCompactor, count_tokens
 from langchain_core.messages import HumanMessage
-from langgraph.prebuilt import create_react_agent
+from report_artifacts import artifact_id
+from tracing import span
+
+# 汇总的专业分析结果及标题，按报告中的顺序排列
+SPECIALIST_SECTIONS = [
+    ("fundamental_analysis", "基本面分析"),
+    ("technical_analysis", "技术分析"),
+    ("valuation_analysis", "估值分析"),
+]
+
+# 不超过该token数的专业分析结果（如失败信息）本身就是要点，不再调用模型提炼
+SECTION_VERBATIM_TOKENS = 200
 
 
 class SummaryAgent(BaseAgent):
@@ -19,11 +35,21 @@ class SummaryAgent(BaseAgent):
             description="综合分析汇总",
             verbose=verbose
         )
+        self.compactor = ContextCompactor()
+        self.partial_cache = None
+    
+    def set_partial_cache(self, partial_cache):
+        """设置要点摘要缓存（专业分析结果相同时复用）"""
+        self.partial_cache = partial_cache
     
     def get_result_key(self) -> str:
         """返回汇总分析结果的键名"""
         return "summary_analysis"
     
+    def get_cache_window(self, state: Dict[str, Any]) -> Optional[str]:
+        """汇总结果依赖三个专业分析，不单独缓存"""
+        return None
+    
     async def analyze(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """
         执行汇总分析任务 - 优化的日志显示
@@ -39,16 +65,19 @@ class SummaryAgent(BaseAgent):
         try:
             # 创建提示词
             prompt = self.create_prompt(state)
+            await self.log_prompt_size(prompt)
             
             # 汇总agent不需要工具，直接使用LLM
             await self.send_log(f"📝 正在整合三个专业分析结果，生成综合报告...", "info")
             
             # 创建一个不带工具的agent executor用于汇总
+            from langgraph.prebuilt import create_react_agent
             agent_executor = create_react_agent(self.llm, [])  # 空工具列表
             
             # 准备初始消息
             initial_messages = [HumanMessage(content=prompt)]
-            config = {"configurable": {"thread_id": "1"}}
+            # 回调按Agent记录LLM调用和工具调用的耗时及token数
+            config = self.get_run_config()
             
             # 初始化思考内容累积器
             thinking_buffer = ""
@@ -108,7 +137,7 @@ class SummaryAgent(BaseAgent):
             
             # 获取最终结果
             await self.send_log("📋 正在整理综合报告...", "info")
-            final_response = await agent_executor.ainvoke({"messages": initial_messages})
+            final_response = await agent_executor.ainvoke({"messages": initial_messages}, config=config)
             
             # 提取结果
             if final_response and "messages" in final_response:
@@ -153,28 +182,114 @@ class SummaryAgent(BaseAgent):
         
         return state
     
+    def get_section_prompt(self, state: Dict[str, Any], title: str, text: str) -> str:
+        """生成单个专业分析的要点提炼提示词（map阶段）"""
+        return f"""请将以下{state['company_name']}（{state['stock_code']}）的{title}结果提炼为要点摘要，供后续综合报告使用。
+
+## {title}结果
+{text}
+
+## 输出要求
+- 保留核心结论、评级或操作建议、目标价/支撑阻力等关键数值和主要风险
+- 使用Markdown列表，不超过10条，不要添加原文没有的判断
+- 直接输出要点，不需要标题和开场白"""
+    
+    async def summarize_section(self, state: Dict[str, Any], result_key: str) -> Optional[str]:
+        """
+        提炼单个专业分析结果的要点（map阶段），写入 state["partial_summaries"]
+        
+        结果很短时直接作为要点；提炼失败时汇总节点改用压缩后的原文
+        
+        Args:
+            state: 状态字典
+            result_key: 专业分析结果的键名
+            
+        Returns:
+            要点摘要，没有结果或提炼失败时为None
+        """
+        title = dict(SPECIALIST_SECTIONS)[result_key]
+        text = state.get(result_key)
+        if not isinstance(text, str) or not text.strip():
+            return None
+        if count_tokens(text) <= SECTION_VERBATIM_TOKENS:
+            state.setdefault("partial_summaries", {})[result_key] = text
+            return text
+        
+        cache_key = artifact_id(result_key, text)
+        partial = self.partial_cache.get(cache_key) if self.partial_cache is not None else None
+        if partial is None:
+            try:
+                with span("agent", f"{self.name}:{title}"):
+                    response = await self.llm.ainvoke(
+                        [HumanMessage(content=self.get_section_prompt(state, title, text))],
+                        config=self.get_run_config())
+            except Exception as e:
+                await self.send_log(f"⚠️ {title}要点提炼失败，汇总时使用压缩后的原文: {e}", "warning")
+                return None
+            partial = response.content if isinstance(response.content, str) else str(response.content)
+            if self.partial_cache is not None:
+                self.partial_cache.set(cache_key, partial)
+        
+        state.setdefault("partial_summaries", {})[result_key] = partial
+        await self.send_log(f"🧩 {title}要点已提炼（{count_tokens(text)} → {count_tokens(partial)} tokens）", "info")
+        return partial
+    
+    def get_specialist_results(self, state: Dict[str, Any]) -> str:
+        """各专业分析的输入：已提炼的使用要点摘要，其余超出预算时只保留关键结论"""
+        self.compactor.reset()
+        partials = state.get("partial_summaries") or {}
+        sections = []
+        for result_key, title in SPECIALIST_SECTIONS:
+            if partials.get(result_key):
+                content = self.compactor.compact(f"{title}（要点）", partials[result_key], "specialist_analysis")
+                sections.append(f"### {title}结果（要点摘要）：\n{content}")
+            else:
+                content = self.compactor.compact(
+                    title, state.get(result_key, f'{title}暂未完成'), "specialist_analysis")
+                sections.append(f"### {title}结果：\n{content}")
+        return "\n\n".join(sections)
+    
+    def get_merge_prompt(self, state: Dict[str, Any]) -> str:
+        """生成合并要点的简短提示词（reduce阶段，已有要点摘要时使用）"""
+        return f"""请将以下{state['company_name']}（{state['stock_code']}）三个专业分析的要点合并为一份投资研究报告。
+{self.get_common_context(state)}
+
+## 专业分析要点
+
+{self.get_specialist_results(state)}
+
+## 输出要求
+只依据以上要点，指出各维度的一致与分歧，给出明确的投资建议。按以下章节输出Markdown：
+
+# {state['company_name']}（{state['stock_code']}）投资分析报告
+## 📊 执行摘要
+## 📈 基本面分析要点
+## 📉 技术分析要点
+## 💰 估值分析要点
+## ⚖️ 综合投资评级（投资建议：买入/增持/持有/减持/卖出，目标价格，投资期限，风险级别）
+## 🎯 投资亮点
+## ⚠️ 主要风险
+## 🚀 操作策略（进场、持仓管理、止盈止损）
+## 📅 关键节点关注
+## 🔍 后续跟踪要点
+
+---
+*报告生成时间：{state.get('current_time_info', '')}*
+*数据截止时间：{state.get('current_date', '')}*"""
+    
     def get_analysis_prompt(self, state: Dict[str, Any]) -> str:
-        """生成汇总分析的提示词"""
+        """生成汇总分析的提示词，已有要点摘要时只做合并"""
+        if state.get("partial_summaries"):
+            return self.get_merge_prompt(state)
         context = self.get_common_context(state)
-        
-        # 获取三个专业分析的结果
-        fundamental_analysis = state.get('fundamental_analysis', '基本面分析暂未完成')
-        technical_analysis = state.get('technical_analysis', '技术分析暂未完成')
-        valuation_analysis = state.get('valuation_analysis', '估值分析暂未完成')
+        specialist_results = self.get_specialist_results(state)
         
         return f"""请基于以下三个专业分析的结果，对{state['company_name']}（股票代码：{state['stock_code']}）进行综合分析并生成投资研究报告。
 {context}
 
 ## 专业分析结果
 
-### 基本面分析结果：
-{fundamental_analysis}
-
-### 技术分析结果：
-{technical_analysis}
-
-### 估值分析结果：
-{valuation_analysis}
+{specialist_results}
 
 ## 综合分析任务
 请基于以上三个专业分析，进行以下综合分析：
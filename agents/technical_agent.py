@@ -4,6 +4,7 @@
 专门负责股票技术分析，包括价格趋势、技术指标、图表形态等
 """
 
+import asyncio
 from typing import Any, Dict
 from .base_agent import BaseAgent
 
@@ -17,18 +18,62 @@ class TechnicalAgent(BaseAgent):
             description="技术分析",
             verbose=verbose
         )
+        self.indicator_engine = None
+    
+    def set_indicator_engine(self, indicator_engine):
+        """设置本地技术指标引擎"""
+        self.indicator_engine = indicator_engine
     
     def get_result_key(self) -> str:
         """返回技术分析结果的键名"""
         return "technical_analysis"
     
+    async def prepare_context(self, state: Dict[str, Any]):
+        """在本地计算技术指标，指标摘要注入提示词"""
+        if self.indicator_engine is not None and not state.get('technical_indicators'):
+            state['technical_indicators'] = await self.load_indicator_summary(state)
+    
+    async def load_indicator_summary(self, state: Dict[str, Any]) -> str:
+        """
+        获取截至分析日期的本地指标摘要，失败时返回空字符串（回退到工具获取指标）
+        
+        Args:
+            state: 状态字典
+            
+        Returns:
+            指标摘要文本
+        """
+        as_of = state.get('current_date')
+        if not as_of or not state.get('stock_code'):
+            return ""
+        try:
+            # K线加载可能访问本地数据库或网络，放到线程中执行
+            summary = await asyncio.to_thread(self.indicator_engine.get_summary, state['stock_code'], as_of)
+        except Exception as e:
+            await self.send_log(f"⚠️ 本地技术指标计算失败，改用工具获取: {e}", "warning")
+            return ""
+        if summary:
+            await self.send_log("📐 已在本地计算MA、MACD、RSI、KDJ、布林带指标", "info")
+        return summary or ""
+    
     def get_analysis_prompt(self, state: Dict[str, Any]) -> str:
         """生成技术分析的提示词"""
         context = self.get_common_context(state)
         
+        indicators = state.get('technical_indicators')
+        if indicators:
+            indicator_section = f"""
+{indicators}
+
+以上指标已根据日K线在本地计算完成，请直接使用，不要再调用 get_technical_indicators、get_moving_averages 等指标工具；
+只在需要补充信息（如基本信息、形态判断所需的K线细节）时再调用数据工具。
+"""
+        else:
+            indicator_section = ""
+        
         return f"""请分析{state['company_name']}（股票代码：{state['stock_code']}）的技术指标。
 {context}
-
+{indicator_section}
 请进行以下技术分析：
 
 ## 分析任务
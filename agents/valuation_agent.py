@@ -4,6 +4,7 @@
 专门负责股票估值分析，包括估值指标、相对估值、绝对估值等
 """
 
+import asyncio
 from typing import Any, Dict
 from .base_agent import BaseAgent
 
@@ -17,18 +18,62 @@ class ValuationAgent(BaseAgent):
             description="估值分析",
             verbose=verbose
         )
+        self.valuation_engine = None
+    
+    def set_valuation_engine(self, valuation_engine):
+        """设置估值历史预计算引擎"""
+        self.valuation_engine = valuation_engine
     
     def get_result_key(self) -> str:
         """返回估值分析结果的键名"""
         return "valuation_analysis"
     
+    async def prepare_context(self, state: Dict[str, Any]):
+        """取出预计算的估值历史分位和行业分位，快照注入提示词"""
+        if self.valuation_engine is not None and not state.get('valuation_snapshot'):
+            state['valuation_snapshot'] = await self.load_valuation_snapshot(state)
+    
+    async def load_valuation_snapshot(self, state: Dict[str, Any]) -> str:
+        """
+        获取截至分析日期的估值快照，失败时返回空字符串（回退到工具获取估值历史）
+        
+        Args:
+            state: 状态字典
+            
+        Returns:
+            估值快照文本
+        """
+        as_of = state.get('current_date')
+        if not as_of or not state.get('stock_code'):
+            return ""
+        try:
+            # 首次加载需要读取完整估值历史，放到线程中执行
+            snapshot = await asyncio.to_thread(self.valuation_engine.get_summary, state['stock_code'], as_of)
+        except Exception as e:
+            await self.send_log(f"⚠️ 估值历史预计算失败，改用工具获取: {e}", "warning")
+            return ""
+        if snapshot:
+            await self.send_log("📊 已取出PE/PB/PS/PCF历史分位和分位带", "info")
+        return snapshot or ""
+    
     def get_analysis_prompt(self, state: Dict[str, Any]) -> str:
         """生成估值分析的提示词"""
         context = self.get_common_context(state)
         
+        snapshot = state.get('valuation_snapshot')
+        if snapshot:
+            snapshot_section = f"""
+{snapshot}
+
+以上估值历史分位、分位带和行业分位已根据完整估值历史预先计算，请直接使用，
+不要再调用 get_valuation_metrics 获取历史估值区间；公司基本信息、财务和分红数据仍通过工具获取。
+"""
+        else:
+            snapshot_section = ""
+        
         return f"""请分析{state['company_name']}（股票代码：{state['stock_code']}）的估值情况。
 {context}
-
+{snapshot_section}
 请进行以下估值分析：
 
 ## 分析任务
@@ -0,0 +1,195 @@
+"""
+分析请求合并（single-flight）
+
+同一股票、同一截止日期的并发分析请求只运行一次完整的多Agent工作流：
+后到的请求挂到正在进行的分析上，先从头回放已产生的事件流，再实时接收后续事件，
+最终共享同一个结果状态。LLM调用和MCP负载随不同股票数增长，而不是随观看人数增长。
+所有观看者都取消（或断开）且没有后台任务等待时，分析随之取消，不再消耗LLM额度
+"""
+
+import asyncio
+import datetime
+import json
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+from ws_broadcast import BROADCAST_QUEUE_SIZE, SLOW_CONSUMER_CLOSE_CODE, ClientConnection
+
+# 观看者取消订阅前等待剩余事件发送完毕的最长时间（秒）
+DRAIN_SECONDS = 10.0
+
+# 分析事件流（日志、报告产物分片、报告）缺一条都无法还原，观看者队列写满时断开而不是丢弃，
+# 不使用广播的 WS_SLOW_CONSUMER_POLICY
+ANALYSIS_STREAM_POLICY = "disconnect"
+
+FlightKey = Tuple[str, str]
+
+
+class AnalysisBroadcast:
+    """
+    事件广播通道
+
+    实现 send_text 接口，可以直接作为工作流和Agent的 websocket 使用。
+    记录全部事件，新订阅者先回放历史事件再接收实时事件。
+
+    每个订阅者有独立的有界发送队列和写任务（ws_broadcast.ClientConnection），
+    send_text 只记录事件并放入各队列，不等待任何观看者的网络发送，
+    慢观看者不会拖慢分析本身和其他观看者。事件从不丢弃：队列写满时以关闭码1008断开该观看者，
+    重新连接后从头回放完整的事件流
+    """
+
+    def __init__(self, queue_size: Optional[int] = None):
+        self.history: List[str] = []
+        self.queue_size = queue_size or BROADCAST_QUEUE_SIZE
+        self.policy = ANALYSIS_STREAM_POLICY
+        self.subscribers: Dict[int, ClientConnection] = {}
+
+    async def send_text(self, text: str):
+        self.history.append(text)
+        for connection in list(self.subscribers.values()):
+            if connection.offer(text) == "overflow":
+                print(f"[合并分析] 观看者发送队列已满（{connection.queue.maxsize}），断开慢观看者")
+                connection.close_code = SLOW_CONSUMER_CLOSE_CODE
+                self.unsubscribe(connection.websocket)
+
+    async def subscribe(self, websocket: WebSocket):
+        """订阅通道，按顺序回放已产生的事件（回放部分不计入队列上限）"""
+        connection = ClientConnection(websocket, self.queue_size + len(self.history), self.policy)
+        for text in self.history:
+            connection.offer(text)
+        self.subscribers[id(websocket)] = connection
+        connection.writer = asyncio.create_task(connection.run(self._on_writer_exit))
+
+    def unsubscribe(self, websocket: WebSocket):
+        connection = self.subscribers.pop(id(websocket), None)
+        if connection is not None and connection.writer:
+            connection.writer.cancel()
+
+    async def detach(self, websocket: WebSocket, drain: bool = True):
+        """
+        取消订阅
+
+        Args:
+            drain: 先等待已入队的事件发送完毕（最多 DRAIN_SECONDS 秒），
+                保证观看者随后收到的消息不会越过分析事件
+        """
+        connection = self.subscribers.get(id(websocket))
+        if connection is not None and drain and not await connection.drain(DRAIN_SECONDS):
+            print(f"[合并分析] 观看者 {DRAIN_SECONDS:g} 秒内未接收完剩余 {len(connection.queue)} 条事件，已放弃")
+        self.unsubscribe(websocket)
+
+    def _on_writer_exit(self, connection: ClientConnection):
+        # 观看者断开（发送失败）不影响分析本身和其他观看者
+        if self.subscribers.get(id(connection.websocket)) is connection:
+            del self.subscribers[id(connection.websocket)]
+
+
+class AnalysisFlight:
+    """一次正在进行的分析"""
+
+    def __init__(self, key: FlightKey):
+        self.key = key
+        self.channel = AnalysisBroadcast()
+        self.task: Optional[asyncio.Task] = None
+        self.viewers = 0
+        self.waiters = 0
+
+
+class AnalysisCoalescer:
+    """按 (股票代码, 截止日期) 合并并发的分析请求"""
+
+    def __init__(self):
+        self.flights: Dict[FlightKey, AnalysisFlight] = {}
+
+    @staticmethod
+    def make_key(stock_code: str, as_of_date: Optional[str] = None) -> FlightKey:
+        as_of_date = as_of_date or datetime.datetime.now().strftime("%Y-%m-%d")
+        return (stock_code.strip().lower(), as_of_date)
+
+    async def run(self, key: FlightKey, websocket: Optional[WebSocket],
+                  runner: Callable[[AnalysisBroadcast], Awaitable[Any]]) -> Any:
+        """
+        执行或加入一次分析
+
+        Args:
+            key: 合并键，见 make_key
+            websocket: 当前观看者的WebSocket连接，后台任务（如批量分析）传None只等待结果
+            runner: 实际执行分析的协程函数，接收广播通道作为日志输出
+
+        Returns:
+            分析结果（所有观看者共享）
+        """
+        flight = self.flights.get(key)
+        joined = flight is not None
+        if not joined:
+            flight = AnalysisFlight(key)
+            flight.task = asyncio.create_task(runner(flight.channel))
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._finish(flight))
+            print(f"[合并分析] 启动新分析: {key[0]} @ {key[1]}")
+        else:
+            print(f"[合并分析] 加入进行中的分析: {key[0]} @ {key[1]} (观看者 {flight.viewers + 1})")
+
+        if websocket is None:
+            flight.waiters += 1
+            try:
+                return await asyncio.shield(flight.task)
+            except asyncio.CancelledError:
+                # 批量作业或预热取消时同样适用：最后一个等待者离开后停止分析
+                self._cancel_if_abandoned(flight, leaving_waiter=True)
+                raise
+            finally:
+                flight.waiters -= 1
+
+        if joined:
+            await websocket.send_text(json.dumps({
+                "message": f"🔗 {key[0]} 的分析正在进行中，已加入并回放此前的分析过程",
+                "type": "info",
+                "timestamp": datetime.datetime.now().strftime("%H:%M:%S")
+            }))
+
+        flight.viewers += 1
+        cancelled = False
+        try:
+            await flight.channel.subscribe(websocket)
+            # 观看者取消时不影响其他观看者，最后一个等待者取消后才停止分析
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            cancelled = True
+            self._cancel_if_abandoned(flight, leaving_waiter=False)
+            raise
+        finally:
+            flight.viewers -= 1
+            if cancelled:
+                flight.channel.unsubscribe(websocket)
+            else:
+                # 报告和完成信号已在队列中，发送完毕后再返回
+                await flight.channel.detach(websocket)
+
+    @staticmethod
+    def _cancel_if_abandoned(flight: AnalysisFlight, leaving_waiter: bool):
+        """正在离开的观看者或等待者是最后一个时取消分析"""
+        viewers = flight.viewers - (0 if leaving_waiter else 1)
+        waiters = flight.waiters - (1 if leaving_waiter else 0)
+        if viewers == 0 and waiters == 0 and not flight.task.done():
+            print(f"[合并分析] 已无观看者和等待者，取消分析: {flight.key[0]} @ {flight.key[1]}")
+            flight.task.cancel()
+
+    def _finish(self, flight: AnalysisFlight):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self.flights),
+            "flights": [
+                {"stock_code": key[0], "as_of_date": key[1], "viewers": flight.viewers,
+                 "events": len(flight.channel.history)}
+                for key, flight in self.flights.items()
+            ]
+        }
+
+
+# 进程内共享的合并器
+analysis_coalescer = AnalysisCoalescer()
@@ -0,0 +1,350 @@
+"""
+分析报告预热
+
+服务内的定时任务在收盘后或开盘前为关注列表预先运行完整的多Agent分析，
+报告连同截止日期保存在本地。/ws/multi 收到关注列表中的股票时，
+报告仍然新鲜就直接返回，过期或用户要求刷新时才实时分析
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from analysis_coalescer import analysis_coalescer
+from analysis_service import build_report
+from multi_agent_workflow import MultiAgentWorkflow
+from shared_cache import register_stats_source
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# A股收盘时间，收盘后行情数据才完整
+MARKET_CLOSE = time(15, 0)
+
+
+def parse_watchlist(value: str) -> List[Dict[str, str]]:
+    """解析关注列表，格式: sh.600519:贵州茅台,sz.002594:比亚迪"""
+    watchlist = []
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        code, _, name = entry.strip().partition(':')
+        watchlist.append({"code": code.strip(), "name": name.strip() or code.strip()})
+    return watchlist
+
+
+def parse_times(value: str) -> List[time]:
+    """解析每日预热时间，格式: 15:30,08:30"""
+    return sorted(datetime.strptime(t.strip(), "%H:%M").time() for t in value.split(',') if t.strip())
+
+
+def last_market_close(now: datetime) -> datetime:
+    """不晚于now的最近一个交易日收盘时间（按工作日估算，不含节假日）"""
+    close = datetime.combine(now.date(), MARKET_CLOSE)
+    if close > now:
+        close -= timedelta(days=1)
+    while close.weekday() >= 5:
+        close -= timedelta(days=1)
+    return close
+
+
+class PrewarmStore:
+    """预热报告存储，每只股票保留最新一份报告"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.getenv("PREWARM_DIR", "prewarm_reports")
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._mtimes: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self._load()
+
+    def _path(self, stock_code: str) -> str:
+        return os.path.join(self.root, f"{stock_code.lower()}.json")
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            code = entry["stock_code"].lower()
+            self._entries[code] = entry
+            self._mtimes[code] = mtime
+            return entry
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"读取预热报告 {os.path.basename(path)} 失败: {e}")
+            return None
+
+    def _load(self):
+        if not os.path.isdir(self.root):
+            return
+        for filename in os.listdir(self.root):
+            if filename.endswith('.json'):
+                self._read(os.path.join(self.root, filename))
+
+    def get(self, stock_code: str) -> Optional[Dict[str, Any]]:
+        code = stock_code.strip().lower()
+        # 多worker部署时报告可能由其他worker写入，按文件修改时间重新读取
+        path = self._path(code)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is not None and self._mtimes.get(code) != mtime:
+            self._read(path)
+        return self._entries.get(code)
+
+    def put(self, stock_code: str, company_name: str, report: Dict[str, Any],
+            generated_at: Optional[datetime] = None) -> Dict[str, Any]:
+        generated_at = generated_at or datetime.now()
+        entry = {
+            "stock_code": stock_code,
+            "company_name": company_name,
+            "as_of_date": report.get("current_date") or generated_at.strftime("%Y-%m-%d"),
+            "generated_at": generated_at.isoformat(timespec="seconds"),
+            "report": report
+        }
+        os.makedirs(self.root, exist_ok=True)
+        # 先写临时文件再替换，其他worker不会读到写了一半的报告
+        path = self._path(stock_code)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, path)
+        self._entries[stock_code.lower()] = entry
+        self._mtimes[stock_code.lower()] = os.stat(path).st_mtime
+        self.sets += 1
+        return entry
+
+    def is_fresh(self, entry: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+        """报告在最近一次收盘之后生成即视为新鲜"""
+        now = now or datetime.now()
+        return datetime.fromisoformat(entry["generated_at"]) >= last_market_close(now)
+
+    def fresh_entry(self, stock_code: str) -> Optional[Dict[str, Any]]:
+        """新鲜且没有错误的报告，不计入命中统计（供调度和状态查询使用）"""
+        entry = self.get(stock_code)
+        if entry and self.is_fresh(entry) and "error" not in entry["report"]:
+            return entry
+        return None
+
+    def get_fresh(self, stock_code: str) -> Optional[Dict[str, Any]]:
+        """为用户请求取新鲜报告，计入命中统计"""
+        entry = self.fresh_entry(stock_code)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def cache_counts(self) -> Dict[str, int]:
+        """报告命中统计，计入本worker的缓存统计"""
+        return {"hits": self.hits, "misses": self.misses, "sets": self.sets}
+
+    def entries(self) -> List[Dict[str, Any]]:
+        return list(self._entries.values())
+
+
+class PrewarmScheduler:
+    """关注列表预热调度器，在共享事件循环上按每日时间点运行"""
+
+    def __init__(self, store: PrewarmStore, watchlist: List[Dict[str, str]],
+                 times: List[time], concurrency: int = 2):
+        self.store = store
+        self.watchlist = watchlist
+        self.times = times
+        self.concurrency = concurrency
+        self.task: Optional[asyncio.Task] = None
+        # 手动触发的一轮预热，保留引用以免任务被回收，停止调度时一并取消
+        self.manual_task: Optional[asyncio.Task] = None
+        self.is_running = False
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._lock_file = None
+
+    def next_run_at(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """下一个预热时间点（跳过周末）"""
+        if not self.times:
+            return None
+        now = now or datetime.now()
+        day = now.date()
+        while True:
+            if day.weekday() < 5:
+                for t in self.times:
+                    candidate = datetime.combine(day, t)
+                    if candidate > now:
+                        return candidate
+            day += timedelta(days=1)
+
+    async def prewarm_one(self, stock: Dict[str, str], semaphore: asyncio.Semaphore) -> bool:
+        async with semaphore:
+            async def runner(channel):
+                workflow = MultiAgentWorkflow(channel, verbose=False)
+                return await workflow.run_analysis(stock["name"], stock["code"])
+
+            try:
+                state = await analysis_coalescer.run(analysis_coalescer.make_key(stock["code"]), None, runner)
+                report = build_report(state)
+                if "error" in report:
+                    logger.warning(f"预热 {stock['code']} 失败: {report['error']}")
+                    return False
+                self.store.put(stock["code"], stock["name"], report)
+                logger.info(f"预热 {stock['name']} ({stock['code']}) 完成")
+                return True
+            except Exception as e:
+                logger.error(f"预热 {stock['code']} 失败: {e}")
+                return False
+
+    async def run_once(self, force: bool = False) -> Dict[str, Any]:
+        """
+        预热一轮关注列表
+
+        Args:
+            force: 为True时即使报告仍然新鲜也重新分析
+        """
+        if self.is_running:
+            return {"skipped": True, "message": "预热正在进行中"}
+
+        self.is_running = True
+        started_at = datetime.now()
+        try:
+            stocks = [s for s in self.watchlist if force or not self.store.fresh_entry(s["code"])]
+            logger.info(f"🔥 开始预热 {len(stocks)}/{len(self.watchlist)} 只股票")
+            semaphore = asyncio.Semaphore(self.concurrency)
+            results = await asyncio.gather(*(self.prewarm_one(s, semaphore) for s in stocks))
+            self.last_run = {
+                "started_at": started_at.isoformat(timespec="seconds"),
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+                "analyzed": len(stocks),
+                "succeeded": sum(results),
+                "skipped_fresh": len(self.watchlist) - len(stocks)
+            }
+            return self.last_run
+        finally:
+            self.is_running = False
+
+    async def _loop(self):
+        while True:
+            run_at = self.next_run_at()
+            logger.info(f"⏰ 下次预热时间: {run_at}")
+            await asyncio.sleep(max(0.0, (run_at - datetime.now()).total_seconds()))
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"预热失败: {e}")
+
+    def _acquire_leader(self) -> bool:
+        """多worker部署时只由一个worker运行预热调度（非阻塞文件锁，进程退出时自动释放）"""
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        os.makedirs(self.store.root, exist_ok=True)
+        self._lock_file = open(os.path.join(self.store.root, ".scheduler.lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+
+    def trigger(self, force: bool = False) -> asyncio.Task:
+        """在后台立即运行一轮预热"""
+        self.manual_task = asyncio.create_task(self.run_once(force=force))
+        return self.manual_task
+
+    def start(self):
+        if self.task is None and self.times and self.watchlist:
+            if not self._acquire_leader():
+                logger.info("⏰ 预热调度由其他worker负责，本worker只读取预热报告")
+                return
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        for task in (self.task, self.manual_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.task = None
+        self.manual_task = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def status(self) -> Dict[str, Any]:
+        now = datetime.now()
+        next_run = self.next_run_at(now)
+        return {
+            "enabled": self.task is not None,
+            "is_running": self.is_running,
+            "times": [t.strftime("%H:%M") for t in self.times],
+            "next_run_at": next_run.isoformat(timespec="seconds") if next_run else None,
+            "last_run": self.last_run,
+            "watchlist": [
+                {
+                    "code": s["code"],
+                    "name": s["name"],
+                    "as_of_date": (self.store.get(s["code"]) or {}).get("as_of_date"),
+                    "generated_at": (self.store.get(s["code"]) or {}).get("generated_at"),
+                    "fresh": self.store.fresh_entry(s["code"]) is not None
+                }
+                for s in self.watchlist
+            ]
+        }
+
+
+def _default_watchlist() -> List[Dict[str, str]]:
+    from backtest_service import STOCK_SUGGESTIONS
+    return [{"code": s["code"], "name": s["name"]} for s in STOCK_SUGGESTIONS]
+
+
+prewarm_store = PrewarmStore()
+register_stats_source("report", prewarm_store.cache_counts)
+prewarm_scheduler = PrewarmScheduler(
+    prewarm_store,
+    watchlist=parse_watchlist(os.getenv("PREWARM_WATCHLIST", "")) or _default_watchlist(),
+    times=parse_times(os.getenv("PREWARM_TIMES", "15:30,08:30")),
+    concurrency=int(os.getenv("PREWARM_CONCURRENCY", "2"))
+)
+
+
+def prewarm_enabled() -> bool:
+    """预热会定时运行完整分析、消耗模型调用，默认关闭，设置 PREWARM_ENABLED=1 开启"""
+    return os.getenv("PREWARM_ENABLED", "0") == "1"
+
+
+@router.get("/api/analysis/prewarm")
+async def get_prewarm_status():
+    """获取预热调度状态和关注列表报告的新鲜度"""
+    return prewarm_scheduler.status()
+
+
+@router.post("/api/analysis/prewarm/run")
+async def run_prewarm(force: bool = False):
+    """立即触发一轮预热"""
+    if not prewarm_enabled():
+        return JSONResponse({'error': '预热未开启，设置 PREWARM_ENABLED=1 后可用'}, status_code=409)
+    if prewarm_scheduler.is_running:
+        return JSONResponse({'error': '预热正在进行中'}, status_code=400)
+    prewarm_scheduler.trigger(force=force)
+    return {'message': '预热已启动', 'stocks': len(prewarm_scheduler.watchlist)}
+
+
+@router.get("/api/analysis/prewarm/{stock_code}")
+async def get_prewarmed_report(stock_code: str):
+    """获取预热报告"""
+    entry = prewarm_store.get(stock_code)
+    if entry is None:
+        return JSONResponse({'error': f'没有 {stock_code} 的预热报告'}, status_code=404)
+    return dict(entry, fresh=prewarm_store.is_fresh(entry))
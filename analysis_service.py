@@ -0,0 +1,264 @@
+"""
+批量分析服务
+
+以HTTP作业接口批量运行多Agent分析：提交一组股票后返回作业ID，
+作业在共享事件循环上以可配置的并发度运行，复用进程内共享的MCP工具池和模型客户端，
+可按股票查询状态并获取带 ETag 缓存头的分析报告
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+
+from analysis_coalescer import analysis_coalescer
+from multi_agent_workflow import MultiAgentWorkflow
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 单个作业的默认并发度和上限
+DEFAULT_CONCURRENCY = int(os.getenv("ANALYSIS_BATCH_CONCURRENCY", "4"))
+MAX_CONCURRENCY = int(os.getenv("ANALYSIS_BATCH_MAX_CONCURRENCY", "16"))
+MAX_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_MAX_SIZE", "200"))
+
+# 已结束作业（含报告正文）的保留时间和数量上限，超出后从最早结束的开始清理
+FINISHED_JOB_TTL = int(os.getenv("ANALYSIS_JOB_TTL", "86400"))
+MAX_FINISHED_JOBS = int(os.getenv("ANALYSIS_JOB_MAX_FINISHED", "100"))
+
+# 报告中保留的分析结果字段
+REPORT_FIELDS = [
+    'company_name', 'stock_code', 'current_date', 'current_time_info',
+    'fundamental_analysis', 'technical_analysis', 'valuation_analysis',
+    'summary_analysis', 'investment_decision', 'error'
+]
+
+# 批量分析作业（进程内）
+analysis_jobs: Dict[str, Dict[str, Any]] = {}
+_job_tasks: Dict[str, asyncio.Task] = {}
+
+
+def prune_finished_jobs(now: Optional[datetime] = None) -> int:
+    """
+    清理过期和超出数量上限的已结束作业，运行中的作业不受影响
+
+    Returns:
+        清理的作业数
+    """
+    now = now or datetime.now()
+    expire_before = (now - timedelta(seconds=FINISHED_JOB_TTL)).isoformat()
+    finished = sorted(
+        (job for job in analysis_jobs.values() if job.get("finished_at")),
+        key=lambda job: job["finished_at"]
+    )
+    overflow = max(0, len(finished) - MAX_FINISHED_JOBS)
+    evicted = [
+        job["job_id"] for i, job in enumerate(finished)
+        if i < overflow or job["finished_at"] < expire_before
+    ]
+    for job_id in evicted:
+        analysis_jobs.pop(job_id, None)
+    if evicted:
+        logger.info(f"清理 {len(evicted)} 个已结束的批量分析作业")
+    return len(evicted)
+
+
+def build_report(state: Optional[dict]) -> Dict[str, Any]:
+    """从工作流最终状态中提取可序列化的分析报告"""
+    if not state:
+        return {"error": "未能生成分析报告"}
+    return {field: state[field] for field in REPORT_FIELDS if field in state}
+
+
+def report_etag(report: Dict[str, Any]) -> str:
+    body = json.dumps(report, ensure_ascii=False, sort_keys=True, default=str)
+    return '"' + hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
+
+
+def job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """作业状态（不含报告正文）"""
+    counts: Dict[str, int] = {}
+    for item in job["items"]:
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "finished_at": job.get("finished_at"),
+        "concurrency": job["concurrency"],
+        "total": len(job["items"]),
+        "counts": counts,
+        "items": [
+            {k: v for k, v in item.items() if k != "report"}
+            for item in job["items"]
+        ]
+    }
+
+
+async def analyze_one(job: Dict[str, Any], item: Dict[str, Any], semaphore: asyncio.Semaphore):
+    """分析单只股票，同一股票的并发请求与实时分析合并为一次工作流"""
+    async with semaphore:
+        item.update({"status": "running", "started_at": datetime.now().isoformat()})
+
+        async def runner(channel):
+            workflow = MultiAgentWorkflow(channel, verbose=False)
+            return await workflow.run_analysis(item["company_name"], item["stock_code"])
+
+        try:
+            key = analysis_coalescer.make_key(item["stock_code"])
+            state = await analysis_coalescer.run(key, None, runner)
+            report = build_report(state)
+            item.update({
+                "status": "failed" if "error" in report else "completed",
+                "error": report.get("error"),
+                "report": report,
+                "etag": report_etag(report)
+            })
+        except asyncio.CancelledError:
+            item["status"] = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"批量分析 {item['stock_code']} 失败: {e}")
+            item.update({"status": "failed", "error": str(e)})
+        finally:
+            item["finished_at"] = datetime.now().isoformat()
+
+
+async def run_analysis_job(job: Dict[str, Any]):
+    """批量分析作业，在共享事件循环上运行"""
+    semaphore = asyncio.Semaphore(job["concurrency"])
+    job["status"] = "running"
+    try:
+        await asyncio.gather(*(analyze_one(job, item, semaphore) for item in job["items"]))
+        job["status"] = "completed"
+        logger.info(f"批量分析作业 {job['job_id']} 完成")
+    except asyncio.CancelledError:
+        for item in job["items"]:
+            if item["status"] in ("pending", "running"):
+                item["status"] = "cancelled"
+        job["status"] = "cancelled"
+        logger.info(f"批量分析作业 {job['job_id']} 已取消")
+    finally:
+        job["finished_at"] = datetime.now().isoformat()
+        _job_tasks.pop(job["job_id"], None)
+
+
+@router.post("/api/analysis/jobs")
+async def create_analysis_job(request: Request):
+    """
+    提交批量分析作业
+
+    请求体: {"stocks": [{"company_name": "贵州茅台", "stock_code": "sh.600519"}, ...], "concurrency": 4}
+    """
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        return JSONResponse({'error': '无效的 JSON 格式'}, status_code=400)
+
+    stocks = data.get('stocks') if isinstance(data, dict) else None
+    if not stocks or not isinstance(stocks, list):
+        return JSONResponse({'error': '缺少必需参数: stocks'}, status_code=400)
+    if len(stocks) > MAX_BATCH_SIZE:
+        return JSONResponse({'error': f'单个作业最多 {MAX_BATCH_SIZE} 只股票'}, status_code=400)
+
+    items = []
+    seen = set()
+    for stock in stocks:
+        if not isinstance(stock, dict) or not stock.get('company_name') or not stock.get('stock_code'):
+            return JSONResponse({'error': '每只股票都需要 company_name 和 stock_code'}, status_code=400)
+        stock_code = stock['stock_code'].strip()
+        if stock_code.lower() in seen:
+            continue
+        seen.add(stock_code.lower())
+        items.append({
+            "company_name": stock['company_name'],
+            "stock_code": stock_code,
+            "status": "pending"
+        })
+
+    try:
+        concurrency = int(data.get('concurrency') or DEFAULT_CONCURRENCY)
+    except (TypeError, ValueError):
+        return JSONResponse({'error': 'concurrency 必须为整数'}, status_code=400)
+    concurrency = max(1, min(concurrency, MAX_CONCURRENCY))
+
+    prune_finished_jobs()
+    job_id = datetime.now().strftime('%Y%m%d_%H%M%S') + '_' + uuid.uuid4().hex[:6]
+    job = {
+        "job_id": job_id,
+        "status": "pending",
+        "created_at": datetime.now().isoformat(),
+        "concurrency": concurrency,
+        "items": items
+    }
+    analysis_jobs[job_id] = job
+    _job_tasks[job_id] = asyncio.create_task(run_analysis_job(job))
+
+    return JSONResponse(job_summary(job), status_code=202,
+                        headers={'Location': f'/api/analysis/jobs/{job_id}'})
+
+
+@router.get("/api/analysis/jobs")
+async def list_analysis_jobs():
+    """列出批量分析作业"""
+    prune_finished_jobs()
+    return {
+        "jobs": [
+            {k: v for k, v in job_summary(job).items() if k != "items"}
+            for job in sorted(analysis_jobs.values(), key=lambda j: j["created_at"], reverse=True)
+        ]
+    }
+
+
+@router.get("/api/analysis/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    """获取作业状态及每只股票的状态"""
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({'error': f'作业不存在: {job_id}'}, status_code=404)
+    return job_summary(job)
+
+
+@router.get("/api/analysis/jobs/{job_id}/reports/{stock_code}")
+async def get_analysis_report(job_id: str, stock_code: str, request: Request):
+    """获取单只股票的分析报告，已完成的报告带 ETag 和缓存头"""
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({'error': f'作业不存在: {job_id}'}, status_code=404)
+
+    item = next((i for i in job["items"] if i["stock_code"].lower() == stock_code.lower()), None)
+    if item is None:
+        return JSONResponse({'error': f'作业中没有股票: {stock_code}'}, status_code=404)
+    if "report" not in item:
+        return JSONResponse({'error': '报告尚未生成', 'status': item["status"]}, status_code=409)
+
+    # 报告生成后不再变化，可由客户端和代理缓存
+    headers = {'ETag': item["etag"], 'Cache-Control': 'private, max-age=86400'}
+    if request.headers.get('if-none-match') == item["etag"]:
+        return Response(status_code=304, headers=headers)
+
+    body = json.dumps(item["report"], ensure_ascii=False, default=str)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+@router.post("/api/analysis/jobs/{job_id}/cancel")
+async def cancel_analysis_job(job_id: str):
+    """取消作业中尚未完成的分析"""
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({'error': f'作业不存在: {job_id}'}, status_code=404)
+
+    task = _job_tasks.get(job_id)
+    if task is None or task.done():
+        return JSONResponse({'error': '作业已结束'}, status_code=400)
+
+    task.cancel()
+    return {'message': '作业已取消', 'job_id': job_id}
@@ -3,15 +3,37 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import json
 import asyncio
-from typing import List
+import datetime
+from contextlib import asynccontextmanager
 import uvicorn
-from multi_agent_websocket import MultiAgentWebSocketManager
+from multi_agent_websocket import ConnectionAnalyses
+from backtest_service import router as backtest_router
+from analysis_service import router as analysis_router
+from analysis_prewarm import router as prewarm_router, prewarm_enabled, prewarm_scheduler
+from analysis_coalescer import analysis_coalescer
+from server_warmup import router as readiness_router, readiness, start_warmup, stop_warmup
+from metrics_service import router as metrics_router
+from ws_broadcast import connection_manager
+from mcp_circuit_breaker import get_mcp_breaker
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台预热MCP工具池、模型客户端和工作流图，完成后 /ready 返回200
+    start_warmup()
+    # 关注列表预热调度（收盘后/开盘前）
+    if prewarm_enabled():
+        prewarm_scheduler.start()
+    yield
+    await prewarm_scheduler.stop()
+    await stop_warmup()
+    await manager.shutdown()
 
 # 创建 FastAPI 应用
 app = FastAPI(
     title="多Agent股票分析系统 API",
     description="基于LangGraph的多Agent并行股票分析系统，支持基本面、技术面、估值分析",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan
 )
 
 # 添加 CORS 支持
@@ -26,41 +48,19 @@ app.add_middleware(
 # 静态文件服务
 app.mount("/static", StaticFiles(directory="frontend"), name="static")
 
-# WebSocket 连接管理器
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"客户端 <{websocket.client.host}:{websocket.client.port}> 已连接. 当前连接数: {len(self.active_connections)}")
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            print(f"客户端 <{websocket.client.host}:{websocket.client.port}> 已断开.  当前连接数: {len(self.active_connections)}")
+# 回测服务（与实时分析共享事件循环、工作流和工具池）
+app.include_router(backtest_router)
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        try:
-            await websocket.send_text(message)
-        except Exception as e:
-            print(f"发送消息失败: {e}")
+# 批量分析作业接口
+app.include_router(analysis_router)
+app.include_router(prewarm_router)
 
-    async def broadcast(self, message: str):
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"广播消息失败: {e}")
-                disconnected.append(connection)
-        
-        # 清理断开的连接
-        for connection in disconnected:
-            self.disconnect(connection)
+# 就绪检查和指标
+app.include_router(readiness_router)
+app.include_router(metrics_router)
 
-manager = ConnectionManager()
+# WebSocket 连接管理器（每连接有界发送队列 + 写任务，广播只入队）
+manager = connection_manager
 
 @app.get("/")
 async def read_root():
@@ -77,7 +77,13 @@ async def read_root():
         "endpoints": {
             "websocket": "/ws/multi",
             "frontend": "/static/index.html",
-            "health": "/health"
+            "backtest": "/backtest",
+            "backtest_api": "/api/backtest",
+            "analysis_jobs": "/api/analysis/jobs",
+            "prewarm": "/api/analysis/prewarm",
+            "health": "/health",
+            "ready": "/ready",
+            "metrics": "/metrics"
         }
     }
 
@@ -85,28 +91,32 @@ async def read_root():
 async def health_check():
     return {
         "status": "healthy",
-        "active_connections": len(manager.active_connections),
+        "ready": readiness["ready"],
+        "active_connections": len(manager),
+        "in_flight_analyses": len(analysis_coalescer.flights),
+        "mcp_circuit": get_mcp_breaker().stats(),
         "timestamp": asyncio.get_event_loop().time()
     }
 
 @app.get("/connections")
 async def get_connections():
     return {
-        "active_connections": len(manager.active_connections),
-        "connections": [
-            {
-                "id": id(conn),
-                "state": conn.client_state.name if hasattr(conn, 'client_state') else "unknown"
-            }
-            for conn in manager.active_connections
-        ]
+        **manager.stats(),
+        "analyses": analysis_coalescer.stats()
     }
 
 @app.websocket("/ws/multi")
 async def multi_agent_websocket_endpoint(websocket: WebSocket):
-    """多Agent分析的WebSocket端点"""
+    """
+    多Agent分析的WebSocket端点
+    
+    每个分析请求作为独立任务运行，消息带 request_id；接收循环始终可以响应
+    ping、cancel（按 request_id 取消，未指定时取消全部）和新的分析请求
+    """
     await manager.connect(websocket)
-    multi_agent_manager = MultiAgentWebSocketManager(websocket)
+    # 分析事件、心跳和错误都经连接的发送队列写出，接收循环不直接写网络
+    channel = manager.channel(websocket)
+    analyses = ConnectionAnalyses(channel)
     
     try:
         while True:
@@ -118,58 +128,86 @@ async def multi_agent_websocket_endpoint(websocket: WebSocket):
                 print(f"[多Agent] 收到消息: {message.get('type', 'unknown')}")
                 
                 if message["type"] == "execute_multi_agent":
-                    # 支持两种格式：新格式（直接传递公司名和股票代码）和旧格式（查询字符串）
-                    if "company_name" in message and "stock_code" in message:
-                        # 新格式：直接传递公司名和股票代码
-                        company_name = message["company_name"]
-                        stock_code = message["stock_code"]
-                        print(f"[多Agent] 开始执行分析: {company_name} ({stock_code})")
-                        await multi_agent_manager.execute_multi_agent_analysis_direct(company_name, stock_code)
-                    else:
-                        # 旧格式：查询字符串（向后兼容）
-                        query = message["query"]
-                        print(f"[多Agent] 开始执行查询: {query[:50]}...")
-                        await multi_agent_manager.execute_multi_agent_analysis(query)
+                    await analyses.start(message)
+                    
+                elif message["type"] == "cancel":
+                    request_id = message.get("request_id")
+                    cancelled = await analyses.cancel(request_id)
+                    await channel.send_text(json.dumps({
+                        "type": "cancel_ack",
+                        "request_id": request_id,
+                        "cancelled": cancelled,
+                        "message": f"已取消 {cancelled} 个分析" if cancelled else "没有可取消的分析",
+                        "timestamp": datetime.datetime.now().strftime("%H:%M:%S")
+                    }))
                     
                 elif message["type"] == "ping":
                     # 心跳检测
-                    await websocket.send_text(json.dumps({
+                    await channel.send_text(json.dumps({
                         "type": "pong",
+                        "running": list(analyses.tasks),
                         "timestamp": asyncio.get_event_loop().time()
                     }))
                     
             except json.JSONDecodeError as e:
                 print(f"[多Agent] JSON 解析错误: {e}")
-                await websocket.send_text(json.dumps({
+                await channel.send_text(json.dumps({
                     "type": "error",
                     "message": "无效的 JSON 格式"
                 }))
             except Exception as e:
                 print(f"[多Agent] 处理消息时出错: {e}")
-                await websocket.send_text(json.dumps({
+                await channel.send_text(json.dumps({
                     "type": "error",
                     "message": f"处理消息时出错: {str(e)}"
                 }))
                 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print("[多Agent] 客户端主动断开连接")
     except Exception as e:
         print(f"[多Agent] WebSocket 错误: {e}")
+    finally:
+        # 用户离开后不再为其运行分析
+        await analyses.close()
         manager.disconnect(websocket)
 
 # 启动配置
 if __name__ == "__main__":
+    import argparse
+    import os
+    
+    parser = argparse.ArgumentParser(description="多Agent股票分析系统")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("APP_WORKERS", "1")),
+                        help="worker进程数，大于1时为生产模式（关闭自动重载，缓存改用共享SQLite）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    
     print("🚀 启动多Agent股票分析系统...")
-    print("📍 API 文档: http://localhost:8000/docs")
-    print("🌐 前端页面: http://localhost:8000/static/index.html")
-    print("🔌 多Agent WebSocket: ws://localhost:8000/ws/multi")
+    print(f"📍 API 文档: http://localhost:{args.port}/docs")
+    print(f"🌐 前端页面: http://localhost:{args.port}/static/index.html")
+    print(f"🔌 多Agent WebSocket: ws://localhost:{args.port}/ws/multi")
+    print(f"📈 回测页面: http://localhost:{args.port}/backtest")
     print("🤖 支持功能：基本面分析 + 技术面分析 + 估值分析 + 综合报告")
     
-    uvicorn.run(
-        "app:app",  # 使用导入字符串格式
-        host="0.0.0.0", 
-        port=8000,
-        log_level="info",
-        reload=True  # 现在可以正常使用重载功能
-    ) 
\ No newline at end of file
+    if args.workers > 1:
+        # 各worker是独立进程，工具结果、Agent结果和回测决策缓存放到共享SQLite（WAL）中
+        os.environ.setdefault("CACHE_BACKEND", "sqlite")
+        print(f"🏭 生产模式: {args.workers} 个worker，缓存后端 {os.environ['CACHE_BACKEND']}")
+        uvicorn.run(
+            "app:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            log_level="info",
+            ws_per_message_deflate=True
+        )
+    else:
+        uvicorn.run(
+            "app:app",  # 使用导入字符串格式
+            host=args.host, 
+            port=args.port,
+            log_level="info",
+            ws_per_message_deflate=True,  # WebSocket帧启用permessage-deflate压缩（浏览器握手时自动协商）
+            reload=True  # 现在可以正常使用重载功能
+        )
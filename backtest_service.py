@@ -0,0 +1,363 @@
+"""
+回测服务
+
+以FastAPI异步路由提供回测接口，回测任务作为共享事件循环上的异步任务运行，
+与实时分析复用同一个预热的工作流、MCP工具池和模型客户端
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+
+from backtest_system import BacktestSystem
+from multi_agent_workflow import BACKTEST_PROFILES, DEFAULT_BACKTEST_PROFILE, MultiAgentWorkflow
+from results_catalog import ResultsCatalog
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 回测运行状态
+current_backtest: Optional[BacktestSystem] = None
+current_task: Optional[asyncio.Task] = None
+backtest_results = None
+backtest_status = {"is_running": False, "progress": 0, "message": ""}
+
+# 回测结果目录
+results_catalog = ResultsCatalog()
+
+# 各回测配置最近一次实测的单步成本
+profile_costs = {}
+
+# 回测复用的共享工作流
+_shared_workflow: Optional[MultiAgentWorkflow] = None
+
+STOCK_SUGGESTIONS = [
+    {"name": "贵州茅台", "code": "sh.600519", "type": "白酒"},
+    {"name": "比亚迪", "code": "sz.002594", "type": "新能源汽车"},
+    {"name": "海康威视", "code": "sz.002415", "type": "安防"},
+    {"name": "宁德时代", "code": "sz.300750", "type": "新能源"},
+    {"name": "五粮液", "code": "sh.000858", "type": "白酒"},
+    {"name": "中国平安", "code": "sh.601318", "type": "保险"},
+    {"name": "招商银行", "code": "sh.600036", "type": "银行"},
+    {"name": "万科A", "code": "sz.000002", "type": "房地产"},
+    {"name": "格力电器", "code": "sz.000651", "type": "家电"},
+    {"name": "美的集团", "code": "sz.000333", "type": "家电"}
+]
+
+REQUIRED_FIELDS = ['stock_code', 'company_name', 'start_date', 'end_date', 'initial_capital', 'frequency']
+
+
+def get_shared_workflow() -> MultiAgentWorkflow:
+    """获取回测复用的共享工作流（工具池和模型由所有工作流共享）"""
+    global _shared_workflow
+    if _shared_workflow is None:
+        _shared_workflow = MultiAgentWorkflow(verbose=False)
+    return _shared_workflow
+
+
+@router.get("/backtest")
+async def backtest_page():
+    """返回回测页面"""
+    return FileResponse("frontend/backtest.html")
+
+
+@router.get("/api/stocks/suggest")
+async def suggest_stocks():
+    """获取股票建议列表"""
+    return STOCK_SUGGESTIONS
+
+
+async def run_backtest_job(data: dict):
+    """回测任务，在共享事件循环上运行"""
+    global current_backtest, backtest_results, backtest_status
+
+    try:
+        # 创建回测实例（baostock在首次取数时于工作线程中登录）
+        current_backtest = BacktestSystem(
+            initial_capital=float(data['initial_capital']),
+            verbose=True,
+            workflow=get_shared_workflow()
+        )
+
+        backtest_status.update({
+            "progress": 10,
+            "message": "回测系统初始化完成，开始运行回测..."
+        })
+
+        # 定义进度回调函数
+        def progress_callback(progress, message):
+            backtest_status.update({
+                "progress": progress,
+                "message": message
+            })
+            logger.info(f"进度更新: {progress}% - {message}")
+
+        backtest_status.update({
+            "progress": 15,
+            "message": f"正在初始化回测 {data['company_name']} ({data['stock_code']})..."
+        })
+
+        results = await current_backtest.run_backtest(
+            stock_code=data['stock_code'],
+            company_name=data['company_name'],
+            start_date=data['start_date'],
+            end_date=data['end_date'],
+            frequency=data['frequency'],
+            progress_callback=progress_callback,
+            profile=data.get('profile', DEFAULT_BACKTEST_PROFILE)
+        )
+        if 'profile_cost' in results:
+            profile_costs[results['profile']] = results['profile_cost']
+
+        backtest_status.update({
+            "progress": 95,
+            "message": "正在处理回测结果..."
+        })
+
+        # 处理结果以便JSON序列化
+        processed_results = process_results_for_json(results)
+
+        # 登记到结果目录
+        run_params = {field: data[field] for field in REQUIRED_FIELDS}
+        run_params['profile'] = data.get('profile', DEFAULT_BACKTEST_PROFILE)
+        run_id = await asyncio.to_thread(results_catalog.record_run, processed_results, run_params)
+        processed_results["run_id"] = run_id
+        backtest_results = processed_results
+
+        backtest_status.update({
+            "is_running": False,
+            "progress": 100,
+            "message": "回测完成！",
+            "run_id": run_id
+        })
+
+        logger.info("回测完成")
+
+    except asyncio.CancelledError:
+        logger.info("回测已取消")
+        backtest_status.update({
+            "is_running": False,
+            "progress": 0,
+            "message": "回测已停止"
+        })
+        raise
+    except Exception as e:
+        logger.error(f"回测错误: {e}")
+        backtest_status.update({
+            "is_running": False,
+            "progress": 0,
+            "message": f"回测失败: {str(e)}"
+        })
+
+
+@router.post("/api/backtest/start")
+async def start_backtest(request: Request):
+    """启动回测"""
+    global current_task, backtest_results
+
+    try:
+        data = await request.json()
+
+        # 验证参数
+        for field in REQUIRED_FIELDS:
+            if field not in data:
+                return JSONResponse({'error': f'缺少必需参数: {field}'}, status_code=400)
+        
+        profile = data.get('profile', DEFAULT_BACKTEST_PROFILE)
+        if profile not in BACKTEST_PROFILES:
+            return JSONResponse({'error': f'未知的回测配置: {profile}，可选: {", ".join(BACKTEST_PROFILES)}'},
+                                status_code=400)
+
+        # 检查是否已有回测在运行
+        if backtest_status["is_running"]:
+            return JSONResponse({'error': '已有回测在运行中，请等待完成'}, status_code=400)
+
+        # 更新状态
+        backtest_status.clear()
+        backtest_status.update({
+            "is_running": True,
+            "progress": 0,
+            "message": "正在初始化回测系统..."
+        })
+
+        # 清空之前的结果
+        backtest_results = None
+
+        # 作为异步任务在共享事件循环上运行
+        current_task = asyncio.create_task(run_backtest_job(data))
+
+        return {
+            'message': '回测已启动',
+            'status': backtest_status
+        }
+
+    except Exception as e:
+        logger.error(f"启动回测失败: {e}")
+        backtest_status.update({
+            "is_running": False,
+            "progress": 0,
+            "message": f"启动失败: {str(e)}"
+        })
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@router.get("/api/backtest/profiles")
+async def list_profiles():
+    """获取可选的回测配置及最近一次实测的单步成本"""
+    return [
+        {
+            "name": name,
+            "description": profile["description"],
+            "agents": profile["agents"],
+            "default": name == DEFAULT_BACKTEST_PROFILE,
+            "last_cost": profile_costs.get(name)
+        }
+        for name, profile in BACKTEST_PROFILES.items()
+    ]
+
+
+@router.get("/api/backtest/status")
+async def get_backtest_status():
+    """获取回测状态"""
+    return backtest_status
+
+
+@router.get("/api/backtest/results")
+async def get_backtest_results():
+    """获取回测结果"""
+    if backtest_results is None:
+        return JSONResponse({'error': '暂无回测结果'}, status_code=404)
+
+    return backtest_results
+
+
+@router.post("/api/backtest/stop")
+async def stop_backtest():
+    """停止回测，取消正在运行的回测任务"""
+    if not backtest_status["is_running"]:
+        return JSONResponse({'error': '没有正在运行的回测'}, status_code=400)
+
+    if current_task and not current_task.done():
+        current_task.cancel()
+
+    backtest_status.update({
+        "is_running": False,
+        "progress": 0,
+        "message": "回测已停止"
+    })
+
+    return {'message': '回测已停止'}
+
+
+@router.get("/api/backtest/download")
+async def download_results():
+    """下载当前回测结果"""
+    if backtest_results is None:
+        return JSONResponse({'error': '暂无回测结果'}, status_code=404)
+
+    run_id = backtest_results.get('run_id') or datetime.now().strftime('%Y%m%d_%H%M%S')
+    return json_attachment(backtest_results, f"backtest_results_{run_id}.json")
+
+
+@router.get("/api/backtest/runs")
+async def list_runs(stock_code: Optional[str] = None, frequency: Optional[str] = None,
+                    model: Optional[str] = None, prompt_version: Optional[str] = None,
+                    created_after: Optional[str] = None, created_before: Optional[str] = None,
+                    min_total_return: Optional[float] = None, min_sharpe_ratio: Optional[float] = None,
+                    order_by: str = "created_at", order: str = "desc",
+                    limit: int = 50, offset: int = 0):
+    """按条件列出历史回测"""
+    try:
+        runs = await asyncio.to_thread(
+            results_catalog.list_runs,
+            stock_code=stock_code,
+            frequency=frequency,
+            model=model,
+            prompt_version=prompt_version,
+            created_after=created_after,
+            created_before=created_before,
+            min_total_return=min_total_return,
+            min_sharpe_ratio=min_sharpe_ratio,
+            order_by=order_by,
+            descending=order != 'asc',
+            limit=limit,
+            offset=offset
+        )
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    return {'runs': runs, 'count': len(runs)}
+
+
+@router.get("/api/backtest/runs/compare")
+async def compare_runs(ids: str = ""):
+    """对比多次回测的参数、各Agent模型和核心指标"""
+    run_ids = [run_id for run_id in ids.split(',') if run_id]
+    if not run_ids:
+        return JSONResponse({'error': '缺少必需参数: ids'}, status_code=400)
+
+    return {'runs': await asyncio.to_thread(results_catalog.compare_runs, run_ids)}
+
+
+@router.get("/api/backtest/runs/{run_id}")
+async def get_run(run_id: str):
+    """获取单次回测的完整结果"""
+    results = await asyncio.to_thread(results_catalog.export_run, run_id)
+    if results is None:
+        return JSONResponse({'error': f'回测不存在: {run_id}'}, status_code=404)
+
+    return results
+
+
+@router.get("/api/backtest/runs/{run_id}/download")
+async def download_run(run_id: str):
+    """下载单次回测的完整结果"""
+    results = await asyncio.to_thread(results_catalog.export_run, run_id)
+    if results is None:
+        return JSONResponse({'error': f'回测不存在: {run_id}'}, status_code=404)
+
+    return json_attachment(results, f"backtest_results_{run_id}.json")
+
+
+def json_attachment(payload, filename):
+    """以附件形式返回JSON，不在工作目录落盘"""
+    body = json.dumps(payload, ensure_ascii=False, indent=2, default=str)
+    return Response(
+        body,
+        media_type='application/json',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def process_results_for_json(results):
+    """处理回测结果以便JSON序列化"""
+    def convert_to_serializable(obj):
+        if hasattr(obj, 'isoformat'):  # datetime对象
+            return obj.isoformat()
+        elif hasattr(obj, 'item'):  # numpy对象
+            return obj.item()
+        elif hasattr(obj, 'tolist'):  # numpy数组
+            return obj.tolist()
+        else:
+            return str(obj)
+
+    def process_dict(d):
+        if isinstance(d, dict):
+            return {k: process_dict(v) for k, v in d.items()}
+        elif isinstance(d, list):
+            return [process_dict(item) for item in d]
+        else:
+            try:
+                # 尝试JSON序列化
+                json.dumps(d)
+                return d
+            except (TypeError, ValueError):
+                return convert_to_serializable(d)
+
+    return process_dict(results)
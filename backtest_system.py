@@ -5,48 +5,67 @@
 """
 
 import asyncio
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
-import baostock as bs
+import hashlib
 import json
 import os
-from multi_agent_workflow import MultiAgentWorkflow
+import time
+from market_data_store import baostock_session
+from model_routing import resolve_agent_models
+from multi_agent_workflow import BACKTEST_PROFILES, DEFAULT_BACKTEST_PROFILE, MultiAgentWorkflow
+from streaming_indicators import StreamingIndicators
+from shared_cache import get_decision_cache
+from tracing import span
+
+# 流式指标首次加载的回看天数（自然日），覆盖MA60和指数平均的预热期
+INDICATOR_WARMUP_DAYS = 180
+
+# 提供给投资决策Agent的最近收盘价个数
+PRICE_WINDOW = 30
+
+
+def decision_config_version() -> str:
+    """
+    各Agent路由的模型和提示词版本的短哈希
+
+    投资决策缓存跨回测、跨worker共享，键中带上配置版本，修改 GEMINI_MODEL_<角色>
+    或提示词后重新回测不会命中旧配置的决策
+    """
+    from results_catalog import get_prompt_version
+
+    config = {"models": resolve_agent_models(), "prompt_version": get_prompt_version()}
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:12]
 
 
 class BacktestSystem:
     """简化的回测系统"""
     
-    def __init__(self, initial_capital: float = 100000.0, verbose: bool = True):
+    def __init__(self, initial_capital: float = 100000.0, verbose: bool = True,
+                 workflow: Optional[MultiAgentWorkflow] = None):
         """
         初始化回测系统
         
         Args:
             initial_capital: 初始资金
+            workflow: 复用的工作流实例（如服务端共享的预热工作流），默认新建
         """
         self.initial_capital = initial_capital
         self.current_capital = initial_capital
         self.positions = {}  # 股票代码 -> 持仓数量
         self.transactions = []  # 交易记录
         self.daily_values = []  # 每日资产价值
-        self.workflow = MultiAgentWorkflow(verbose=False)
+        self.workflow = workflow or MultiAgentWorkflow(verbose=False)
+        self.profile = DEFAULT_BACKTEST_PROFILE  # 回测配置，run_backtest时指定
+        self.config_version = decision_config_version()  # 模型路由和提示词版本，run_backtest时更新
+        self.decision_seconds = []  # 每个决策点获取投资决策的耗时
         
         # 添加缓存机制
         self.price_cache = {}  # 缓存股票价格数据
         self.analysis_cache = {}  # 缓存分析结果
-        
-        # 初始化baostock
-        lg = bs.login()
-        if lg.error_code != '0':
-            raise Exception(f"登录baostock失败: {lg.error_msg}")
-    
-    def __del__(self):
-        """析构函数，登出baostock"""
-        try:
-            bs.logout()
-        except:
-            pass
+        self.indicator_states = {}  # 股票代码 -> 流式指标状态，逐日推进时只喂入新K线
+        # baostock使用进程内共享的会话（market_data_store.baostock_session），
+        # 首次取数时登录，回测结束后不登出，本地指标引擎等可能仍在使用
     
     def get_stock_price(self, stock_code: str, date: str) -> Optional[float]:
         """
@@ -66,31 +85,26 @@ class BacktestSystem:
             return self.price_cache[cache_key]
         
         try:
-            # 确保baostock已登录
-            lg = bs.login()
-            if lg.error_code != '0':
-                print(f"重新登录baostock失败: {lg.error_msg}")
-                return None
-            
             print(f"📡 获取股票价格: {stock_code} @ {date}")
             
             # 获取前后几天的数据，确保能获取到价格
             start_date = (datetime.strptime(date, '%Y-%m-%d') - timedelta(days=5)).strftime('%Y-%m-%d')
             end_date = (datetime.strptime(date, '%Y-%m-%d') + timedelta(days=5)).strftime('%Y-%m-%d')
             
-            rs = bs.query_history_k_data_plus(
-                stock_code,
-                "date,close",
-                start_date=start_date,
-                end_date=end_date,
-                frequency="d",
-                adjustflag="3"
-            )
-            
-            data_list = []
-            if rs and rs.error_code == '0':
-                while rs.next():
-                    data_list.append(rs.get_row_data())
+            with span("data", "baostock.stock_price"), baostock_session() as bs:
+                rs = bs.query_history_k_data_plus(
+                    stock_code,
+                    "date,close",
+                    start_date=start_date,
+                    end_date=end_date,
+                    frequency="d",
+                    adjustflag="3"
+                )
+            
+                data_list = []
+                if rs and rs.error_code == '0':
+                    while rs.next():
+                        data_list.append(rs.get_row_data())
             
             if not data_list:
                 return None
@@ -140,36 +154,142 @@ class BacktestSystem:
             
             start_date = (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=days+10)).strftime('%Y-%m-%d')
             
+            with span("data", "baostock.historical_prices"), baostock_session() as bs:
+                rs = bs.query_history_k_data_plus(
+                    stock_code,
+                    "date,close",
+                    start_date=start_date,
+                    end_date=end_date,
+                    frequency="d",
+                    adjustflag="3"
+                )
+            
+                prices = []
+                if rs and rs.error_code == '0':
+                    while rs.next():
+                        try:
+                            close_price = float(rs.get_row_data()[1])
+                            prices.append(close_price)
+                        except (ValueError, IndexError):
+                            continue
+            
+            # 只保留最近的天数
+            if len(prices) > days:
+                prices = prices[-days:]
+            
+            # 缓存结果
+            self.price_cache[cache_key] = prices
+            print(f"✅ 历史数据获取成功: {len(prices)} 个价格点")
+            return prices
+            
+        except Exception as e:
+            print(f"获取历史价格失败: {e}")
+            return []
+    
+    def fetch_bars(self, stock_code: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+        """
+        获取日K线（date/high/low/close）
+        
+        Args:
+            stock_code: 股票代码
+            start_date: 开始日期
+            end_date: 结束日期
+            
+        Returns:
+            按日期升序的K线列表
+        """
+        with span("data", "baostock.bars"), baostock_session() as bs:
             rs = bs.query_history_k_data_plus(
                 stock_code,
-                "date,close",
+                "date,high,low,close",
                 start_date=start_date,
                 end_date=end_date,
                 frequency="d",
                 adjustflag="3"
             )
             
-            prices = []
+            bars = []
             if rs and rs.error_code == '0':
                 while rs.next():
+                    row = rs.get_row_data()
                     try:
-                        close_price = float(rs.get_row_data()[1])
-                        prices.append(close_price)
+                        bars.append({"date": row[0], "high": float(row[1]),
+                                     "low": float(row[2]), "close": float(row[3])})
                     except (ValueError, IndexError):
                         continue
+        return bars
+    
+    def advance_indicators(self, stock_code: str, date: str) -> Optional[StreamingIndicators]:
+        """
+        把流式指标推进到指定日期
+        
+        首次调用加载回看期的K线预热；之后只获取上次处理日期之后的新K线，
+        每推进一天的成本与回看长度无关
+        
+        Args:
+            stock_code: 股票代码
+            date: 推进到的日期
             
-            # 只保留最近的天数
-            if len(prices) > days:
-                prices = prices[-days:]
-            
-            # 缓存结果
-            self.price_cache[cache_key] = prices
-            print(f"✅ 历史数据获取成功: {len(prices)} 个价格点")
-            return prices
-            
+        Returns:
+            指标状态，获取K线失败时返回None
+        """
+        state = self.indicator_states.get(stock_code)
+        if state is None or state.last_date is None:
+            state = StreamingIndicators(PRICE_WINDOW)
+            start_date = (datetime.strptime(date, '%Y-%m-%d') - timedelta(days=INDICATOR_WARMUP_DAYS)).strftime('%Y-%m-%d')
+        else:
+            start_date = (datetime.strptime(state.last_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        if start_date > date:
+            return state
+        
+        try:
+            bars = self.fetch_bars(stock_code, start_date, date)
         except Exception as e:
-            print(f"获取历史价格失败: {e}")
-            return []
+            print(f"获取K线失败: {e}")
+            return None
+        
+        with span("data", "indicators.stream"):
+            added = state.update_many(bars)
+        if state.last_date is None:
+            return None
+        self.indicator_states[stock_code] = state
+        print(f"📐 流式指标推进至 {state.last_date}（新增 {added} 根K线）")
+        return state
+    
+    def create_checkpoint(self) -> Dict[str, Any]:
+        """
+        导出回测检查点（JSON兼容），包含资金、持仓、交易记录和流式指标状态
+        
+        Returns:
+            检查点字典
+        """
+        return {
+            'initial_capital': self.initial_capital,
+            'current_capital': self.current_capital,
+            'positions': dict(self.positions),
+            'transactions': list(self.transactions),
+            'daily_values': list(self.daily_values),
+            'profile': self.profile,
+            'indicator_states': {code: state.snapshot() for code, state in self.indicator_states.items()}
+        }
+    
+    def restore_checkpoint(self, checkpoint: Dict[str, Any]):
+        """
+        从检查点恢复回测状态，之后的 run_backtest 从检查点的下一根K线继续推进指标
+        
+        Args:
+            checkpoint: create_checkpoint() 导出的字典
+        """
+        self.initial_capital = checkpoint['initial_capital']
+        self.current_capital = checkpoint['current_capital']
+        self.positions = dict(checkpoint['positions'])
+        self.transactions = list(checkpoint['transactions'])
+        self.daily_values = list(checkpoint['daily_values'])
+        self.profile = checkpoint.get('profile', DEFAULT_BACKTEST_PROFILE)
+        self.indicator_states = {
+            code: StreamingIndicators.from_snapshot(snapshot)
+            for code, snapshot in checkpoint.get('indicator_states', {}).items()
+        }
     
     def get_portfolio_state(self, stock_code: str, current_price: float) -> Dict[str, Any]:
         """
@@ -233,17 +353,32 @@ class BacktestSystem:
             JSON格式的投资决策
         """
         try:
-            # 检查缓存
-            cache_key = f"decision_{stock_code}_{date}"
+            # 获取当前投资组合状态
+            portfolio_state = self.get_portfolio_state(stock_code, current_price)
+            
+            # 检查缓存：决策依赖持仓，键中包含持股数和现金，相同状态下的决策可以跨回测、跨worker复用；
+            # 配置版本区分模型路由和提示词，不同配置的决策互不复用
+            cache_key = (f"decision_{self.config_version}_{self.profile}_{stock_code}_{date}_"
+                         f"{portfolio_state['current_shares']}_{portfolio_state['cash']:.2f}")
             if cache_key in self.analysis_cache:
                 print(f"💾 使用缓存投资决策: {date} - {company_name} ({stock_code})")
                 return self.analysis_cache[cache_key]
+            decision_cache = get_decision_cache()
+            if decision_cache is not None:
+                cached_decision = decision_cache.get(cache_key)
+                if cached_decision is not None:
+                    print(f"💾 使用共享缓存投资决策: {date} - {company_name} ({stock_code})")
+                    self.analysis_cache[cache_key] = cached_decision
+                    return cached_decision
 
-            # 获取历史价格数据
-            historical_prices = self.get_historical_prices(stock_code, date, days=30)
-            
-            # 获取当前投资组合状态
-            portfolio_state = self.get_portfolio_state(stock_code, current_price)
+            # 推进流式指标，只获取上次之后的新K线（baostock为阻塞调用，放到线程中执行，避免阻塞共享事件循环）
+            indicators = await asyncio.to_thread(self.advance_indicators, stock_code, date)
+            if indicators is not None:
+                historical_prices = indicators.recent_closes(PRICE_WINDOW)
+                indicator_snapshot = indicators.latest()
+            else:
+                historical_prices = await asyncio.to_thread(self.get_historical_prices, stock_code, date, PRICE_WINDOW)
+                indicator_snapshot = {}
             
             # 准备workflow输入
             input_data = {
@@ -253,6 +388,7 @@ class BacktestSystem:
                 "current_time_info": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "current_price": current_price,
                 "historical_prices": historical_prices,
+                "indicator_snapshot": indicator_snapshot,
                 "portfolio_state": portfolio_state
             }
             
@@ -260,7 +396,7 @@ class BacktestSystem:
             print(f"💰 当前状态: 价格{current_price:.2f} | 持股{portfolio_state['current_shares']}股 | 现金{portfolio_state['cash']:.2f} | 总值{portfolio_state['total_value']:.2f}")
             
             # 运行workflow
-            result = await self.workflow.run(input_data)
+            result = await self.workflow.run(input_data, profile=self.profile)
             
             # 获取投资决策
             decision = result.get('investment_decision', {})
@@ -269,6 +405,8 @@ class BacktestSystem:
             
             # 缓存结果
             self.analysis_cache[cache_key] = decision
+            if decision_cache is not None:
+                decision_cache.set(cache_key, decision)
             return decision
             
         except Exception as e:
@@ -376,7 +514,8 @@ class BacktestSystem:
     async def run_backtest(self, stock_code: str, company_name: str, 
                           start_date: str, end_date: str, 
                           frequency: str = "weekly", 
-                          progress_callback=None) -> Dict[str, Any]:
+                          progress_callback=None,
+                          profile: str = DEFAULT_BACKTEST_PROFILE) -> Dict[str, Any]:
         """
         运行回测
         
@@ -387,13 +526,21 @@ class BacktestSystem:
             end_date: 结束日期
             frequency: 决策频率 ("daily" 或 "weekly" 或 "monthly")
             progress_callback: 进度回调函数
+            profile: 回测配置（"full"、"technical_fundamental"、"technical"），见 BACKTEST_PROFILES
             
         Returns:
             回测结果
         """
+        if profile not in BACKTEST_PROFILES:
+            raise ValueError(f"未知的回测配置: {profile}，可选: {', '.join(BACKTEST_PROFILES)}")
+        self.profile = profile
+        self.config_version = decision_config_version()
+        self.decision_seconds = []
+        
         print(f"🚀 开始回测: {company_name} ({stock_code})")
         print(f"📅 回测期间: {start_date} - {end_date}")
         print(f"🔄 决策频率: {frequency}")
+        print(f"🧩 回测配置: {profile} - {BACKTEST_PROFILES[profile]['description']}")
         print(f"💰 初始资金: {self.initial_capital:,.2f}")
         print("-" * 50)
         
@@ -429,19 +576,21 @@ class BacktestSystem:
             print(f"\n📈 [{i+1}/{total_dates}] 决策点: {date}")
             
             # 获取当前价格
-            current_price = self.get_stock_price(stock_code, date)
+            current_price = await asyncio.to_thread(self.get_stock_price, stock_code, date)
             if not current_price:
                 print(f"⚠️ {date} - 无法获取价格，跳过")
                 continue
             
-            # 获取投资决策
+            # 获取投资决策（记录耗时，用于比较各回测配置的单步成本）
+            decision_start = time.perf_counter()
             decision = await self.get_investment_decision(stock_code, company_name, date, current_price)
+            self.decision_seconds.append(time.perf_counter() - decision_start)
             
             # 执行决策
             self.execute_decision(stock_code, decision, current_price, date)
             
             # 记录每日价值
-            portfolio_value = self.calculate_portfolio_value(date)
+            portfolio_value = await asyncio.to_thread(self.calculate_portfolio_value, date)
             self.daily_values.append({
                 'date': date,
                 'portfolio_value': portfolio_value,
@@ -457,12 +606,28 @@ class BacktestSystem:
         
         # 计算回测结果
         results = self.calculate_performance()
+        if "error" not in results:
+            results['profile'] = profile
+            results['profile_cost'] = self.get_profile_cost()
         
         if progress_callback:
             progress_callback(100, "回测完成！")
         
         return results
     
+    def get_profile_cost(self) -> Dict[str, Any]:
+        """当前回测配置每个决策点的成本"""
+        steps = len(self.decision_seconds)
+        total = sum(self.decision_seconds)
+        return {
+            'profile': self.profile,
+            'agents': BACKTEST_PROFILES[self.profile]['agents'],
+            'steps': steps,
+            'total_seconds': round(total, 3),
+            'avg_seconds_per_step': round(total / steps, 3) if steps else 0.0,
+            'max_seconds_per_step': round(max(self.decision_seconds), 3) if steps else 0.0
+        }
+    
     def generate_decision_dates(self, start_date: str, end_date: str, frequency: str) -> List[str]:
         """
         生成决策日期列表
@@ -500,6 +665,8 @@ class BacktestSystem:
         if not self.daily_values:
             return {"error": "没有数据"}
         
+        import numpy as np
+        
         try:
             # 计算总收益
             final_value = self.daily_values[-1]['portfolio_value']
@@ -607,6 +774,9 @@ class BacktestSystem:
         print(f"📈 夏普比率: {results['sharpe_ratio']:.4f}")
         print(f"🔄 总交易次数: {results['total_trades']}")
         print(f"✅ 盈利交易: {results['winning_trades']}")
+        if 'profile_cost' in results:
+            cost = results['profile_cost']
+            print(f"🧩 回测配置: {cost['profile']} | 每步平均 {cost['avg_seconds_per_step']:.2f}秒 | 共 {cost['steps']} 步")
         print("="*50)
 
 
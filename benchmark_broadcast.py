@@ -0,0 +1,144 @@
+"""
+WebSocket广播基准：逐个等待发送 vs 发送队列扇出
+
+用内存中的模拟连接（send_text 按设定延迟返回，其中一部分是慢客户端）比较：
+- 逐个等待：原 ConnectionManager.broadcast 的做法，依次 await 每个连接的 send_text
+- 队列扇出：ws_broadcast.ConnectionManager，广播只入队，由各连接的写任务发送
+
+报告每次广播的调用耗时、所有快速客户端收到消息的耗时，以及慢客户端的丢弃/合并/断开次数
+
+用法:
+    python benchmark_broadcast.py                                  # 500个连接，其中5个慢客户端
+    python benchmark_broadcast.py --connections 1000 --slow 20 --slow-latency 0.2
+    python benchmark_broadcast.py --policy disconnect --queue-size 16 --json
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from ws_broadcast import SLOW_CONSUMER_POLICIES, ConnectionManager
+
+
+class SimulatedWebSocket:
+    """模拟连接：send_text 等待固定延迟，记录最后一条消息的送达时间"""
+
+    def __init__(self, index: int, latency: float):
+        self.index = index
+        self.latency = latency
+        self.received = 0
+        self.last_received = 0.0
+        self.closed_code = None
+        self.client = SimpleNamespace(host="simulated", port=index)
+
+    async def send_text(self, text: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.received += 1
+        self.last_received = time.perf_counter()
+
+    async def close(self, code: int = 1000):
+        self.closed_code = code
+
+
+def make_clients(connections: int, slow: int, fast_latency: float, slow_latency: float) -> List[SimulatedWebSocket]:
+    return [SimulatedWebSocket(i, slow_latency if i < slow else fast_latency) for i in range(connections)]
+
+
+async def bench_sequential(clients: List[SimulatedWebSocket], messages: int, interval: float) -> Dict[str, Any]:
+    """逐个等待发送"""
+    call_samples = []
+    start = time.perf_counter()
+    for index in range(messages):
+        call_start = time.perf_counter()
+        for client in clients:
+            await client.send_text(f'{{"seq": {index}}}')
+        call_samples.append(time.perf_counter() - call_start)
+        await asyncio.sleep(interval)
+    fast = [c for c in clients if c.latency < max(c.latency for c in clients)] or clients
+    return {
+        "broadcast_ms_p50": statistics.median(call_samples) * 1000,
+        "broadcast_ms_max": max(call_samples) * 1000,
+        "fast_delivered_ms": (max(c.last_received for c in fast) - start) * 1000,
+    }
+
+
+async def bench_fanout(clients: List[SimulatedWebSocket], messages: int, interval: float,
+                       queue_size: int, policy: str, keyed: bool) -> Dict[str, Any]:
+    """发送队列扇出"""
+    manager = ConnectionManager(queue_size=queue_size, policy=policy)
+    for client in clients:
+        manager.register(client)
+    call_samples = []
+    start = time.perf_counter()
+    for index in range(messages):
+        call_start = time.perf_counter()
+        await manager.broadcast(f'{{"seq": {index}}}', key="progress" if keyed else None)
+        call_samples.append(time.perf_counter() - call_start)
+        await asyncio.sleep(interval)
+
+    fast = [c for c in clients if c.latency < max(c.latency for c in clients)] or clients
+    deadline = time.perf_counter() + 10
+    while time.perf_counter() < deadline and any(c.received < messages for c in fast):
+        await asyncio.sleep(0.001)
+    stats = manager.stats()
+    slow_stats = [conn for conn in stats["connections"]
+                  if conn["id"] in {id(c) for c in clients if c not in fast}]
+    result = {
+        "broadcast_ms_p50": statistics.median(call_samples) * 1000,
+        "broadcast_ms_max": max(call_samples) * 1000,
+        "fast_delivered_ms": (max(c.last_received for c in fast) - start) * 1000,
+        "slow_dropped": sum(conn["dropped"] for conn in slow_stats),
+        "slow_coalesced": sum(conn["coalesced"] for conn in slow_stats),
+        "evicted": stats["evicted"],
+    }
+    await manager.shutdown()
+    return result
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    results = {"connections": args.connections, "slow": args.slow, "messages": args.messages,
+               "policy": args.policy, "queue_size": args.queue_size}
+    results["sequential"] = await bench_sequential(
+        make_clients(args.connections, args.slow, args.fast_latency, args.slow_latency),
+        args.messages, args.interval)
+    results["fanout"] = await bench_fanout(
+        make_clients(args.connections, args.slow, args.fast_latency, args.slow_latency),
+        args.messages, args.interval, args.queue_size, args.policy, args.keyed)
+    return results
+
+
+def print_report(results: Dict[str, Any]):
+    print(f"📡 {results['connections']} 个连接（慢客户端 {results['slow']} 个），广播 {results['messages']} 条消息，"
+          f"策略 {results['policy']}，队列 {results['queue_size']}")
+    for name, title in [("sequential", "逐个等待"), ("fanout", "队列扇出")]:
+        item = results[name]
+        print(f"   {title}: 广播调用 p50 {item['broadcast_ms_p50']:9.3f} ms，最大 {item['broadcast_ms_max']:9.3f} ms，"
+              f"快速客户端全部收到 {item['fast_delivered_ms']:9.1f} ms")
+    fanout = results["fanout"]
+    print(f"   慢客户端: 丢弃 {fanout['slow_dropped']} 条，合并 {fanout['slow_coalesced']} 条，断开 {fanout['evicted']} 个")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket广播：逐个等待 vs 发送队列扇出")
+    parser.add_argument("--connections", type=int, default=500, help="连接数")
+    parser.add_argument("--slow", type=int, default=5, help="慢客户端数")
+    parser.add_argument("--messages", type=int, default=50, help="广播消息数")
+    parser.add_argument("--interval", type=float, default=0.005, help="相邻广播的间隔（秒）")
+    parser.add_argument("--fast-latency", type=float, default=0.0, help="快速客户端每条消息的发送延迟（秒）")
+    parser.add_argument("--slow-latency", type=float, default=0.05, help="慢客户端每条消息的发送延迟（秒）")
+    parser.add_argument("--queue-size", type=int, default=16, help="每个连接的发送队列长度")
+    parser.add_argument("--policy", default="drop", choices=SLOW_CONSUMER_POLICIES, help="慢消费者策略")
+    parser.add_argument("--keyed", action="store_true", help="广播带合并键（配合 coalesce 策略）")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    benchmark_results = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(benchmark_results, indent=2, ensure_ascii=False))
+    else:
+        print_report(benchmark_results)
@@ -0,0 +1,126 @@
+"""
+技术指标基准：本地向量化计算 vs MCP工具
+
+对一段回测日期逐日获取技术指标，比较两种方式的耗时和注入提示词的token数：
+- 本地：technical_indicators.IndicatorEngine，每只股票加载和计算一次，各日期按日期截取
+- 工具：逐日调用MCP服务器的 get_technical_indicators 和 get_moving_averages（需 --mcp）
+
+用法:
+    python benchmark_indicators.py                          # 合成K线，仅本地
+    python benchmark_indicators.py --code sh.600519 --real  # 本地数据存储/baostock的真实K线
+    python benchmark_indicators.py --code sh.600519 --real --mcp   # 同时测量工具方式（需MCP服务器）
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from agents.context_compactor import count_tokens
+from technical_indicators import IndicatorEngine, compute_indicators, load_k_data
+
+# 工具方式每个决策日调用的指标工具
+INDICATOR_TOOLS = ["get_technical_indicators", "get_moving_averages"]
+
+
+def decision_dates(start_date: str, days: int) -> List[str]:
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)
+            if (start + timedelta(days=i)).weekday() < 5]
+
+
+def bench_local(code: str, dates: List[str], real: bool) -> dict:
+    """本地引擎：首次加载计算 + 各日期截取摘要"""
+    if real:
+        loader = load_k_data
+    else:
+        from offline_backend import synthetic_k_data
+        loader = synthetic_k_data
+
+    rows = loader(code, "2020-01-01", dates[-1])
+    compute_samples = []
+    for _ in range(5):
+        start = time.perf_counter()
+        compute_indicators(rows)
+        compute_samples.append(time.perf_counter() - start)
+
+    engine = IndicatorEngine(loader=loader)
+    start = time.perf_counter()
+    summaries = [engine.get_summary(code, date) for date in dates]
+    total = time.perf_counter() - start
+    tokens = [count_tokens(summary) for summary in summaries if summary]
+    return {
+        "dates": len(dates),
+        "kline_rows": len(rows),
+        "compute_ms": statistics.median(compute_samples) * 1000,
+        "total_ms": total * 1000,
+        "ms_per_date": total * 1000 / len(dates),
+        "loads": engine.loads,
+        "tokens_per_date": statistics.mean(tokens) if tokens else 0,
+    }
+
+
+async def bench_tools(code: str, dates: List[str]) -> dict:
+    """工具方式：逐日调用MCP指标工具"""
+    from multi_agent_workflow import MultiAgentWorkflow
+
+    tools = {tool.name: tool for tool in await MultiAgentWorkflow(verbose=False).connect_mcp_tools()}
+    missing = [name for name in INDICATOR_TOOLS if name not in tools]
+    if missing:
+        return {"error": f"MCP服务器缺少工具: {', '.join(missing)}"}
+
+    latencies, tokens = [], []
+    for date in dates:
+        start_date = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=180)).strftime("%Y-%m-%d")
+        start = time.perf_counter()
+        outputs = await asyncio.gather(*(
+            tools[name].ainvoke({"code": code, "start_date": start_date, "end_date": date})
+            for name in INDICATOR_TOOLS
+        ))
+        latencies.append(time.perf_counter() - start)
+        tokens.append(sum(count_tokens(str(output)) for output in outputs))
+    return {
+        "dates": len(dates),
+        "total_ms": sum(latencies) * 1000,
+        "ms_per_date": statistics.mean(latencies) * 1000,
+        "tokens_per_date": statistics.mean(tokens),
+    }
+
+
+def print_report(results: dict):
+    local = results["local"]
+    print(f"📐 本地引擎: {local['dates']} 个决策日，K线 {local['kline_rows']} 行")
+    print(f"   整段计算          {local['compute_ms']:10.2f} ms")
+    print(f"   逐日摘要合计      {local['total_ms']:10.2f} ms（加载 {local['loads']} 次）")
+    print(f"   每个决策日        {local['ms_per_date']:10.2f} ms，约 {local['tokens_per_date']:.0f} tokens")
+    tools = results.get("tools")
+    if tools is None:
+        print("🔧 工具方式: 未测量（使用 --mcp 连接MCP服务器）")
+    elif "error" in tools:
+        print(f"🔧 工具方式: {tools['error']}")
+    else:
+        print(f"🔧 工具方式: 每个决策日 {tools['ms_per_date']:.2f} ms，约 {tools['tokens_per_date']:.0f} tokens"
+              f"（不含模型发起调用和读取结果的往返）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地技术指标引擎与MCP指标工具的对比")
+    parser.add_argument("--code", default="sh.600519", help="股票代码")
+    parser.add_argument("--start", default="2024-01-02", help="第一个决策日")
+    parser.add_argument("--days", type=int, default=60, help="决策日跨度（自然日，只取工作日）")
+    parser.add_argument("--real", action="store_true", help="使用真实K线（本地数据存储，缺失时从baostock同步）")
+    parser.add_argument("--mcp", action="store_true", help="同时测量MCP指标工具")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    dates = decision_dates(args.start, args.days)
+    benchmark_results = {"local": bench_local(args.code, dates, args.real)}
+    if args.mcp:
+        benchmark_results["tools"] = asyncio.run(bench_tools(args.code, dates))
+    if args.json:
+        print(json.dumps(benchmark_results, indent=2, ensure_ascii=False))
+    else:
+        print_report(benchmark_results)
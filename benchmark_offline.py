@@ -0,0 +1,264 @@
+"""
+离线开销基准
+
+使用确定性的假模型和进程内桩工具（见 offline_backend.py），不依赖Gemini和MCP服务器，
+分别测量框架自身的开销：
+- 工作流开销：一次完整 run_analysis（5个Agent、工作流图、日志）的耗时
+- 事件流处理：BaseAgent.analyze 相对于直接消费 astream_events 的额外耗时
+- 日志吞吐：工作流和Agent的 send_log 每秒可发送的消息数
+- 回测单步开销：回测引擎每个决策点的耗时（仅引擎 / 引擎加各回测配置的工作流）
+- 指标推进：不同回看长度下流式指标推进一根K线的耗时，对比整段重算
+
+用法:
+    python benchmark_offline.py                       # 默认每项测5次取中位数
+    python benchmark_offline.py --runs 10 --json > baseline.json
+    python benchmark_offline.py --compare baseline.json   # 与基线对比，标出变化
+"""
+
+import os
+
+# 必须在导入工作流之前设置：假模型、桩工具，并关闭结果缓存以免重复运行命中缓存
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["MCP_BACKEND"] = "stub"
+os.environ["AGENT_CACHE_ENABLED"] = "0"
+os.environ["TOOL_CACHE_ENABLED"] = "0"
+
+import argparse
+import asyncio
+import contextlib
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from agents import TechnicalAgent
+from backtest_system import BacktestSystem
+from multi_agent_workflow import BACKTEST_PROFILES, DEFAULT_BACKTEST_PROFILE, MultiAgentWorkflow
+from offline_backend import build_stub_tools, create_fake_llm, synthetic_k_data
+from streaming_indicators import StreamingIndicators
+from technical_indicators import compute_indicators
+
+STOCK_CODE = "sh.600519"
+COMPANY_NAME = "贵州茅台"
+
+
+class NullWebSocket:
+    """丢弃消息的WebSocket，只计数"""
+
+    def __init__(self):
+        self.messages = 0
+
+    async def send_text(self, text: str):
+        self.messages += 1
+
+
+class StubPriceBacktestSystem(BacktestSystem):
+    """使用合成价格的回测系统，不访问baostock"""
+
+    def get_stock_price(self, stock_code: str, date: str):
+        day = datetime.strptime(date, "%Y-%m-%d").toordinal()
+        return 100.0 + (day % 17) - (day % 5) * 0.5
+
+    def get_historical_prices(self, stock_code: str, end_date: str, days: int = 30):
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+        return [self.get_stock_price(stock_code, (end - timedelta(days=i)).strftime("%Y-%m-%d"))
+                for i in range(days, 0, -1)]
+
+    def fetch_bars(self, stock_code: str, start_date: str, end_date: str):
+        day, end = datetime.strptime(start_date, "%Y-%m-%d"), datetime.strptime(end_date, "%Y-%m-%d")
+        bars = []
+        while day <= end:
+            date = day.strftime("%Y-%m-%d")
+            close = self.get_stock_price(stock_code, date)
+            bars.append({"date": date, "high": close + 1.0, "low": close - 1.0, "close": close})
+            day += timedelta(days=1)
+        return bars
+
+
+class EngineOnlyBacktestSystem(StubPriceBacktestSystem):
+    """固定决策的回测系统，只测量回测引擎本身"""
+
+    async def get_investment_decision(self, stock_code, company_name, date, current_price):
+        action = ["BUY", "HOLD", "SELL"][datetime.strptime(date, "%Y-%m-%d").toordinal() % 3]
+        return {"action": action, "confidence": 0.7, "target_price": None, "stop_loss": None,
+                "position_size": 0.3, "holding_period": "medium", "risk_level": "medium", "reasons": []}
+
+
+@contextlib.contextmanager
+def quiet():
+    """屏蔽被测代码的print输出，避免终端速度影响结果"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+async def _timed(coro_factory, runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        with quiet():
+            await coro_factory()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+async def bench_workflow(runs: int) -> dict:
+    """完整分析流程的耗时和日志条数"""
+    websocket = NullWebSocket()
+
+    async def once():
+        await MultiAgentWorkflow(websocket, verbose=False).run_analysis(COMPANY_NAME, STOCK_CODE)
+
+    await _timed(once, 1)  # 预热：建立共享工具池和模型
+    websocket.messages = 0
+    seconds = await _timed(once, runs)
+    return {"run_analysis_ms": seconds * 1000, "logs_per_run": websocket.messages / runs}
+
+
+def _make_agent(websocket=None) -> TechnicalAgent:
+    agent = TechnicalAgent(verbose=False)
+    agent.set_llm(create_fake_llm())
+    agent.set_tools(build_stub_tools())
+    agent.set_websocket(websocket)
+    return agent
+
+
+async def bench_event_stream(runs: int) -> dict:
+    """BaseAgent.analyze 的耗时与直接消费事件流的耗时对比"""
+    from langchain_core.messages import HumanMessage
+    from langgraph.prebuilt import create_react_agent
+
+    state = {"company_name": COMPANY_NAME, "stock_code": STOCK_CODE,
+             "current_date": "2024-06-28", "current_time_info": "2024-06-28 15:00:00"}
+    websocket = NullWebSocket()
+    agent = _make_agent(websocket)
+    event_count = 0
+
+    async def raw_stream():
+        nonlocal event_count
+        executor = create_react_agent(agent.llm, agent.tools)
+        event_count = 0
+        async for _ in executor.astream_events(
+                {"messages": [HumanMessage(content=agent.create_prompt(state))]}, version="v1"):
+            event_count += 1
+
+    async def analyze():
+        await agent.analyze(dict(state))
+
+    await _timed(analyze, 1)
+    raw = await _timed(raw_stream, runs)
+    websocket.messages = 0
+    full = await _timed(analyze, runs)
+    return {
+        "raw_event_stream_ms": raw * 1000,
+        "agent_analyze_ms": full * 1000,
+        "processing_overhead_ms": (full - raw) * 1000,
+        "events_per_run": event_count,
+        "logs_per_run": websocket.messages / runs,
+    }
+
+
+async def bench_logging(messages: int) -> dict:
+    """send_log 吞吐（条/秒）"""
+    websocket = NullWebSocket()
+    workflow = MultiAgentWorkflow(websocket, verbose=False)
+    agent = _make_agent(websocket)
+    text = "🔧 **工具调用 #1**\n- 工具: `get_stock_basic_info`\n- 参数: {'code': 'sh.600519'}"
+
+    results = {}
+    for name, send_log in [("workflow_send_log", workflow.send_log), ("agent_send_log", agent.send_log)]:
+        start = time.perf_counter()
+        for _ in range(messages):
+            await send_log(text, "info")
+        results[f"{name}_per_sec"] = messages / (time.perf_counter() - start)
+    return results
+
+
+async def bench_backtest(days: int) -> dict:
+    """回测每个决策点的耗时"""
+    start_date = "2024-01-01"
+    end_date = (datetime.strptime(start_date, "%Y-%m-%d") + timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    results = {}
+    # 仅引擎，以及引擎加各回测配置的工作流
+    variants = [("engine_only", EngineOnlyBacktestSystem, DEFAULT_BACKTEST_PROFILE)]
+    variants += [(f"profile_{profile}", StubPriceBacktestSystem, profile) for profile in BACKTEST_PROFILES]
+    for name, system_class, profile in variants:
+        with quiet():
+            # 预热一个决策点，排除首次导入和初始化的耗时
+            await system_class(verbose=False).run_backtest(
+                STOCK_CODE, COMPANY_NAME, start_date, start_date, "daily", profile=profile)
+        system = system_class(verbose=False)
+        start = time.perf_counter()
+        with quiet():
+            await system.run_backtest(STOCK_CODE, COMPANY_NAME, start_date, end_date, "daily", profile=profile)
+        results[f"{name}_ms_per_step"] = (time.perf_counter() - start) * 1000 / days
+    return results
+
+
+def bench_indicators(lookbacks=(250, 1000, 4000), steps: int = 200) -> dict:
+    """流式指标每推进一根K线的耗时与整段重算的对比，推进耗时应与回看长度无关"""
+    results = {}
+    for lookback in lookbacks:
+        start_date = (datetime(2024, 1, 1) - timedelta(days=lookback * 7 // 5)).strftime("%Y-%m-%d")
+        rows = synthetic_k_data(STOCK_CODE, start_date, "2025-12-31")
+        history, upcoming = rows[:lookback], rows[lookback:lookback + steps]
+        state = StreamingIndicators()
+        state.update_many(history)
+        start = time.perf_counter()
+        for bar in upcoming:
+            state.update(bar)
+        results[f"stream_us_per_bar_lookback_{lookback}"] = (time.perf_counter() - start) * 1e6 / len(upcoming)
+        start = time.perf_counter()
+        for _ in range(10):
+            compute_indicators(history)
+        results[f"recompute_us_lookback_{lookback}"] = (time.perf_counter() - start) * 1e6 / 10
+    return results
+
+
+async def run_benchmark(runs: int = 5, log_messages: int = 5000, backtest_days: int = 20) -> dict:
+    return {
+        "workflow": await bench_workflow(runs),
+        "event_stream": await bench_event_stream(runs),
+        "logging": await bench_logging(log_messages),
+        "backtest": await bench_backtest(backtest_days),
+        "indicators": bench_indicators(),
+    }
+
+
+def _is_throughput(metric: str) -> bool:
+    return metric.endswith("_per_sec")
+
+
+def print_report(results: dict, baseline: dict = None):
+    """打印结果；提供基线时附上变化百分比，变慢超过10%标记⚠️"""
+    titles = {"workflow": "🔁 工作流开销", "event_stream": "📡 事件流处理",
+              "logging": "📝 日志吞吐", "backtest": "📈 回测单步开销", "indicators": "📐 指标推进"}
+    for section, metrics in results.items():
+        print(titles.get(section, section))
+        for metric, value in metrics.items():
+            line = f"   {metric:<40} {value:12.2f}"
+            old = (baseline or {}).get(section, {}).get(metric)
+            if old:
+                change = (value - old) / old * 100
+                slower = -change if _is_throughput(metric) else change
+                line += f"   {change:+6.1f}%" + (" ⚠️" if slower > 10 else "")
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用假模型和桩工具测量框架自身开销")
+    parser.add_argument("--runs", type=int, default=5, help="每项测量次数")
+    parser.add_argument("--log-messages", type=int, default=5000, help="日志吞吐测试的消息条数")
+    parser.add_argument("--backtest-days", type=int, default=20, help="回测的决策点数（每日决策）")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    parser.add_argument("--compare", help="与之前 --json 输出的基线文件对比")
+    args = parser.parse_args()
+
+    benchmark_results = asyncio.run(run_benchmark(args.runs, args.log_messages, args.backtest_days))
+    if args.json:
+        print(json.dumps(benchmark_results, indent=2))
+    else:
+        baseline_results = None
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline_results = json.load(f)
+        print_report(benchmark_results, baseline_results)
@@ -0,0 +1,135 @@
+"""
+启动耗时基准
+
+测量各入口的冷启动表现：
+- 导入耗时：在全新的Python进程中导入模块所需时间
+- 就绪耗时：从启动uvicorn进程到HTTP接口首次成功响应的时间
+
+用法:
+    python benchmark_startup.py              # 默认每项测3次取中位数
+    python benchmark_startup.py --runs 5 --json
+    python benchmark_startup.py --ready      # 以 /ready 为准，包含MCP和模型预热（需MCP服务器和API密钥）
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# 需要测量导入耗时的模块
+IMPORT_TARGETS = [
+    "app",
+    "backtest_api",
+    "multi_agent_workflow",
+    "backtest_system",
+    "replay_mcp_server",
+]
+
+# 需要测量就绪耗时的服务: (名称, uvicorn应用, 就绪检查路径)
+SERVER_TARGETS = [
+    ("app.py", "app:app", "/health"),
+    ("backtest_api.py", "backtest_api:app", "/api/backtest/status"),
+]
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _env():
+    env = dict(os.environ)
+    # 基准测试不触发预热任务
+    env.setdefault("PREWARM_ENABLED", "0")
+    return env
+
+
+def measure_import(module: str) -> float:
+    """在新进程中测量模块导入耗时（秒）"""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - t)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=PROJECT_DIR, env=_env(),
+        capture_output=True, text=True, check=True
+    ).stdout.strip().splitlines()
+    return float(output[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_ready(app_path: str, ready_path: str, timeout: float = 60.0) -> float:
+    """测量从启动uvicorn进程到就绪检查路径返回200的耗时（秒）"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}{ready_path}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_path, "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_DIR, env=_env(),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"{app_path} 启动失败，退出码 {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, OSError):
+                pass
+            time.sleep(0.02)
+        raise TimeoutError(f"{app_path} 在 {timeout} 秒内未就绪")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_benchmark(runs: int = 3, warm_ready: bool = False) -> dict:
+    results = {"imports": {}, "ready": {}}
+    for module in IMPORT_TARGETS:
+        samples = [measure_import(module) for _ in range(runs)]
+        results["imports"][module] = statistics.median(samples)
+    for name, app_path, ready_path in SERVER_TARGETS:
+        if warm_ready:
+            ready_path = "/ready"
+        samples = [measure_ready(app_path, ready_path, timeout=120.0 if warm_ready else 60.0)
+                   for _ in range(runs)]
+        results["ready"][name] = statistics.median(samples)
+    return results
+
+
+def print_report(results: dict):
+    print("📦 导入耗时（中位数）")
+    for module, seconds in results["imports"].items():
+        print(f"   {module:<24} {seconds * 1000:8.1f} ms")
+    print("🚀 就绪耗时（启动进程到HTTP首次响应，中位数）")
+    for name, seconds in results["ready"].items():
+        print(f"   {name:<24} {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="测量各入口的导入耗时和就绪耗时")
+    parser.add_argument("--runs", type=int, default=3, help="每项测量次数")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    parser.add_argument("--ready", action="store_true", help="就绪耗时以 /ready 预热完成为准")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(args.runs, warm_ready=args.ready)
+    if args.json:
+        print(json.dumps(benchmark_results, indent=2))
+    else:
+        print_report(benchmark_results)
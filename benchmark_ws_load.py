@@ -0,0 +1,293 @@
+"""
+/ws/multi 并发压测
+
+启动一个使用假模型和桩工具的 app.py 服务（LLM_BACKEND=fake、MCP_BACKEND=stub），
+按并发档位打开N个 /ws/multi 会话，以设定的速率发送 execute_multi_agent 消息，统计：
+- 连接建立耗时
+- 事件送达：发送请求到收到首个事件、到收到完成信号的耗时，以及事件之间的最大间隔
+- 吞吐：每秒完成的分析数、每秒收到的消息数和字节数，以及每次分析收到的字节数（解压后）
+- 每会话内存：压测期间服务进程RSS峰值相对空闲时的增量 / 会话数
+- 失败率：连接失败、错误事件和超时的比例
+
+每个会话分析不同的股票代码，避免同一股票的并发请求被合并为一次工作流。
+
+用法:
+    python benchmark_ws_load.py                           # 并发 1,5,10,25，每会话1次分析
+    python benchmark_ws_load.py --concurrency 10,50,100 --requests 3 --rate 20
+    python benchmark_ws_load.py --llm-latency 0.5 --tool-latency 0.2 --json
+    python benchmark_ws_load.py --url ws://127.0.0.1:8000/ws/multi --pid 12345   # 压测已运行的服务
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmark_startup import PROJECT_DIR, _free_port
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))]
+
+
+def start_server(llm_latency: float, tool_latency: float):
+    """启动离线后端的 app.py 服务，返回 (进程, 端口)"""
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "LLM_BACKEND": "fake",
+        "MCP_BACKEND": "stub",
+        "FAKE_LLM_LATENCY": str(llm_latency),
+        "FAKE_TOOL_LATENCY": str(tool_latency),
+        # 每次分析都完整运行工作流，不命中结果缓存和预热报告
+        "AGENT_CACHE_ENABLED": "0",
+        "TOOL_CACHE_ENABLED": "0",
+        "PREWARM_ENABLED": "0",
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, port
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def wait_until_ready(port: int, timeout: float = 60.0):
+    """等待已启动的服务 /ready 返回200"""
+    import urllib.error
+    import urllib.request
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"服务在 {timeout} 秒内未就绪")
+
+
+class MemorySampler:
+    """后台采样服务进程的RSS"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+        try:
+            import psutil
+            self.process = psutil.Process(pid) if pid else None
+        except ImportError:
+            self.process = None
+
+    def rss(self) -> Optional[int]:
+        return self.process.memory_info().rss if self.process else None
+
+    async def _loop(self):
+        while True:
+            self.peak = max(self.peak, self.rss() or 0)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.process:
+            self.peak = self.rss()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self.peak = max(self.peak, self.rss() or 0)
+
+
+async def run_session(url: str, index: int, requests: int, start_delay: float,
+                      interval: float, timeout: float) -> Dict[str, Any]:
+    """运行一个会话：建立连接后依次发送分析请求，等待每次的完成信号"""
+    import websockets
+
+    result = {"connect": None, "analyses": [], "messages": 0, "bytes": 0,
+              "connect_error": None, "failures": 0}
+    await asyncio.sleep(start_delay)
+    start = time.perf_counter()
+    try:
+        websocket = await asyncio.wait_for(websockets.connect(url, max_size=None), timeout)
+    except Exception as e:
+        result["connect_error"] = str(e)
+        return result
+    result["connect"] = time.perf_counter() - start
+
+    async with websocket:
+        for request_index in range(requests):
+            if request_index:
+                await asyncio.sleep(interval)
+            stock_code = f"sh.{688000 + index % 1000:06d}"
+            sent = time.perf_counter()
+            await websocket.send(json.dumps({
+                "type": "execute_multi_agent",
+                "company_name": f"压测公司{index}",
+                "stock_code": stock_code,
+            }))
+            analysis = {"first_event": None, "complete": None, "max_gap": 0.0, "error": False}
+            last = sent
+            try:
+                while True:
+                    frame = await asyncio.wait_for(websocket.recv(), timeout)
+                    now = time.perf_counter()
+                    result["messages"] += 1
+                    result["bytes"] += len(frame.encode("utf-8") if isinstance(frame, str) else frame)
+                    if analysis["first_event"] is None:
+                        analysis["first_event"] = now - sent
+                    analysis["max_gap"] = max(analysis["max_gap"], now - last)
+                    last = now
+                    event_type = json.loads(frame).get("type")
+                    if event_type == "error":
+                        analysis["error"] = True
+                    elif event_type == "execution_complete":
+                        analysis["complete"] = now - sent
+                        break
+            except Exception:
+                analysis["error"] = True
+            if analysis["error"] or analysis["complete"] is None:
+                result["failures"] += 1
+            result["analyses"].append(analysis)
+            if analysis["complete"] is None:
+                break
+    return result
+
+
+async def run_level(url: str, concurrency: int, requests: int, rate: float,
+                    timeout: float, pid: Optional[int]) -> Dict[str, Any]:
+    """运行一个并发档位"""
+    sampler = MemorySampler(pid)
+    idle_rss = sampler.rss()
+    sampler.start()
+    # 会话按速率依次启动；同一会话的相邻请求间隔与并发数成正比，保持总体发送速率
+    start_interval = 1.0 / rate if rate > 0 else 0.0
+    request_interval = concurrency / rate if rate > 0 else 0.0
+    start = time.perf_counter()
+    sessions = await asyncio.gather(*(
+        run_session(url, i, requests, i * start_interval, request_interval, timeout)
+        for i in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    await sampler.stop()
+
+    connects = [s["connect"] for s in sessions if s["connect"] is not None]
+    analyses = [a for s in sessions for a in s["analyses"]]
+    completes = [a["complete"] for a in analyses if a["complete"] is not None and not a["error"]]
+    first_events = [a["first_event"] for a in analyses if a["first_event"] is not None]
+    gaps = [a["max_gap"] for a in analyses]
+    attempted = concurrency * requests
+    failed = attempted - len(completes)
+    connect_errors = sum(1 for s in sessions if s["connect_error"])
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "concurrency": concurrency,
+        "attempted": attempted,
+        "completed": len(completes),
+        "failure_rate": round(failed / attempted, 4) if attempted else 0.0,
+        "connect_errors": connect_errors,
+        "connect_ms_p50": ms(_percentile(connects, 50)),
+        "connect_ms_p95": ms(_percentile(connects, 95)),
+        "first_event_ms_p50": ms(_percentile(first_events, 50)),
+        "first_event_ms_p95": ms(_percentile(first_events, 95)),
+        "complete_ms_p50": ms(_percentile(completes, 50)),
+        "complete_ms_p95": ms(_percentile(completes, 95)),
+        "max_event_gap_ms_p95": ms(_percentile(gaps, 95)),
+        "analyses_per_sec": round(len(completes) / elapsed, 2),
+        "messages_per_sec": round(sum(s["messages"] for s in sessions) / elapsed, 1),
+        "mb_per_sec": round(sum(s["bytes"] for s in sessions) / elapsed / 1e6, 3),
+        "kb_per_analysis": round(sum(s["bytes"] for s in sessions) / len(analyses) / 1e3, 1) if analyses else None,
+        "rss_idle_mb": round(idle_rss / 1e6, 1) if idle_rss else None,
+        "rss_peak_mb": round(sampler.peak / 1e6, 1) if sampler.peak else None,
+        "rss_per_session_mb": round((sampler.peak - idle_rss) / 1e6 / concurrency, 2) if idle_rss else None,
+        "elapsed_s": round(elapsed, 2),
+    }
+
+
+async def run_load_test(levels: List[int], requests: int, rate: float, timeout: float,
+                        url: Optional[str] = None, pid: Optional[int] = None,
+                        llm_latency: float = 0.0, tool_latency: float = 0.0) -> Dict[str, Any]:
+    process = None
+    if url is None:
+        process, port = start_server(llm_latency, tool_latency)
+        url = f"ws://127.0.0.1:{port}/ws/multi"
+        pid = process.pid
+    try:
+        if process is not None:
+            # /ready 返回200说明假模型、桩工具和工作流图已预热
+            await asyncio.to_thread(wait_until_ready, port)
+        results = []
+        for concurrency in levels:
+            print(f"⏳ 并发 {concurrency} ...", file=sys.stderr)
+            results.append(await run_level(url, concurrency, requests, rate, timeout, pid))
+        return {"url": url, "requests_per_session": requests, "rate": rate,
+                "llm_latency": llm_latency, "tool_latency": tool_latency, "levels": results}
+    finally:
+        if process is not None:
+            stop_server(process)
+
+
+COLUMNS = [
+    ("concurrency", "并发"), ("failure_rate", "失败率"), ("connect_ms_p95", "连接p95"),
+    ("first_event_ms_p95", "首事件p95"), ("complete_ms_p50", "完成p50"), ("complete_ms_p95", "完成p95"),
+    ("max_event_gap_ms_p95", "事件间隔p95"), ("analyses_per_sec", "分析/秒"),
+    ("messages_per_sec", "消息/秒"), ("mb_per_sec", "MB/秒"), ("kb_per_analysis", "KB/分析"),
+    ("rss_per_session_mb", "MB/会话"),
+]
+
+
+def print_report(results: Dict[str, Any]):
+    print(f"🔌 {results['url']}  每会话 {results['requests_per_session']} 次分析，"
+          f"发送速率 {results['rate'] or '不限'} 次/秒，模型延迟 {results['llm_latency']}s，"
+          f"工具延迟 {results['tool_latency']}s（耗时单位 ms）")
+    print("  ".join(f"{title:>12}" for _, title in COLUMNS))
+    for level in results["levels"]:
+        print("  ".join(f"{'-' if level[key] is None else level[key]:>12}" for key, _ in COLUMNS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="/ws/multi 并发压测（假模型 + 桩工具）")
+    parser.add_argument("--concurrency", default="1,5,10,25", help="并发档位，逗号分隔")
+    parser.add_argument("--requests", type=int, default=1, help="每个会话发送的分析请求数")
+    parser.add_argument("--rate", type=float, default=0.0, help="总体发送速率（次/秒），0为不限")
+    parser.add_argument("--timeout", type=float, default=120.0, help="单次等待超时（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="假模型每次调用的模拟延迟（秒）")
+    parser.add_argument("--tool-latency", type=float, default=0.0, help="桩工具每次调用的模拟延迟（秒）")
+    parser.add_argument("--url", help="压测已运行的服务，不启动新进程")
+    parser.add_argument("--pid", type=int, help="配合 --url 指定服务进程PID以采样内存")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    load_results = asyncio.run(run_load_test(
+        [int(c) for c in args.concurrency.split(",") if c.strip()],
+        args.requests, args.rate, args.timeout, args.url, args.pid,
+        args.llm_latency, args.tool_latency
+    ))
+    if args.json:
+        print(json.dumps(load_results, indent=2, ensure_ascii=False))
+    else:
+        print_report(load_results)
@@ -6,6 +6,8 @@ let reconnectAttempts = 0; // 重连尝试次数
 let maxReconnectAttempts = 3; // 最大重连次数
 let reconnectTimer = null; // 重连定时器
 let finalReport = null; // 存储最终报告
+let currentRequestId = null; // 当前分析的请求ID，用于取消和区分消息
+const artifacts = new Map(); // 报告产物: 引用ID -> {title, chunks, received, text}
 
 // 查询模板
 const queryTemplates = {
@@ -73,9 +75,19 @@ function connect() {
     ws.onmessage = function(event) {
         try {
             const data = JSON.parse(event.data);
+            if (data.type === "artifact") {
+                receiveArtifactChunk(data);
+                return;
+            }
+            if (data.type === "report") {
+                receiveReport(data);
+                return;
+            }
             addLog(data.message, data.type, data.timestamp);
             
-            if (data.type === "execution_complete") {
+            if (data.type === "execution_complete" &&
+                (!data.request_id || data.request_id === currentRequestId)) {
+                currentRequestId = null;
                 isExecuting = false;
                 updateExecuteButton();
                 updateStatus("connected", "已连接");
@@ -417,6 +429,59 @@ function renderMarkdown(text) {
         }
 }
 
+// 报告产物按分块到达，全部收齐后拼装并只渲染一次
+function receiveArtifactChunk(data) {
+    let artifact = artifacts.get(data.id);
+    if (!artifact) {
+        artifact = { title: data.title, chunks: new Array(data.total), received: 0, text: null };
+        artifacts.set(data.id, artifact);
+    }
+    if (artifact.text !== null) {
+        // 相同内容（如缓存复用的结果）已经收到并渲染过，只提示引用
+        if (data.seq === 0) {
+            addLog(`📄 **${artifact.title}**：内容与之前收到的相同，见上方日志`, "success", data.timestamp);
+        }
+        return;
+    }
+    if (artifact.chunks[data.seq] !== undefined) {
+        return; // 重复的分块
+    }
+    artifact.chunks[data.seq] = data.chunk;
+    artifact.received++;
+    if (artifact.received === data.total) {
+        artifact.text = artifact.chunks.join("");
+        artifact.chunks = null;
+        addLog(`📄 **${artifact.title}**\n${artifact.text}`, "success", data.timestamp);
+    }
+}
+
+// 最终报告帧只包含产物引用ID，由已收到的产物组装下载内容
+function receiveReport(data) {
+    const sections = data.artifacts
+        .map(id => artifacts.get(id))
+        .filter(artifact => artifact && artifact.text !== null);
+    if (sections.length < data.artifacts.length) {
+        console.log("⚠️ 部分报告产物尚未收到:", data.artifacts.length - sections.length);
+    }
+    if (sections.length === 0) {
+        addLog("⚠️ 最终报告内容为空", "warning", data.timestamp);
+        return;
+    }
+    
+    finalReport = sections.map(artifact => `## ${artifact.title}\n\n${artifact.text}`).join("\n\n");
+    // 产物内容已进入最终报告，释放已用过的条目
+    data.artifacts.forEach(id => artifacts.delete(id));
+    console.log("✅ 最终报告已组装，长度:", finalReport.length);
+    
+    // 启用下载按钮
+    const downloadTxtBtn = document.getElementById("downloadTxtBtn");
+    if (downloadTxtBtn) {
+        downloadTxtBtn.disabled = false;
+    }
+    
+    addLog(data.message, "success", data.timestamp);
+}
+
 function addLog(message, type = "info", timestamp = null) {
     const logsContainer = document.getElementById("logs");
     if (!logsContainer) return;
@@ -426,45 +491,6 @@ function addLog(message, type = "info", timestamp = null) {
     
     const time = timestamp || new Date().toLocaleTimeString();
     
-    // 检查是否是最终报告 - 只处理真正包含内容的报告
-    if (message.includes("📄 最终报告")) {
-        console.log("检测到最终报告消息，原始消息长度:", message.length);
-        
-        // 提取报告内容 - 改进的匹配规则，支持多种格式
-        let reportMatch = null;
-        
-        // 模式1: 📄 最终报告:\n{content}
-        reportMatch = message.match(/📄 最终报告:\s*\n([\s\S]*)/);
-        if (!reportMatch) {
-            // 模式2: 📄 最终报告:{content}
-            reportMatch = message.match(/📄 最终报告:\s*([\s\S]*)/);
-        }
-        if (!reportMatch) {
-            // 模式3: 📄 最终报告：{content} (中文冒号)
-            reportMatch = message.match(/📄 最终报告：\s*([\s\S]*)/);
-        }
-        if (!reportMatch) {
-            // 模式4: 更宽松的匹配
-            reportMatch = message.match(/📄\s*最终报告[：:]\s*([\s\S]*)/);
-        }
-        
-        if (reportMatch && reportMatch[1].trim().length > 10) {
-            finalReport = reportMatch[1].trim();
-            console.log("✅ 成功提取最终报告，长度:", finalReport.length);
-            console.log("报告内容预览:", finalReport.substring(0, 200) + "...");
-            
-            // 启用下载按钮
-            const downloadTxtBtn = document.getElementById("downloadTxtBtn");
-            if (downloadTxtBtn) {
-                downloadTxtBtn.disabled = false;
-            }
-            
-            addLog("📄 最终报告已准备就绪，可以下载", "success");
-        } else if (reportMatch) {
-            console.log("⚠️ 检测到最终报告标题，但内容太短，跳过");
-        }
-    }
-    
     const renderedMessage = renderMarkdown(message);
     
     // 调试：记录渲染信息
@@ -524,8 +550,9 @@ function executeAgent() {
         return;
     }
     
-    // 重置最终报告和下载按钮状态
+    // 重置最终报告、上一次分析的报告产物和下载按钮状态
     finalReport = null;
+    artifacts.clear();
     const downloadTxtBtn = document.getElementById("downloadTxtBtn");
     if (downloadTxtBtn) {
         downloadTxtBtn.disabled = true;
@@ -537,11 +564,31 @@ function executeAgent() {
     
     const messageType = 'execute_multi_agent';
     
+    const forceRefreshElement = document.getElementById("forceRefresh");
+    const forceRefresh = forceRefreshElement ? forceRefreshElement.checked : false;
+    
+    currentRequestId = `${stockCode}-${Date.now().toString(36)}`;
+    updateExecuteButton();
+    
     addLog(`开始执行多Agent并行分析: ${companyName} (${stockCode})`, "info");
     ws.send(JSON.stringify({
         type: messageType,
+        request_id: currentRequestId,
         company_name: companyName,
-        stock_code: stockCode
+        stock_code: stockCode,
+        force_refresh: forceRefresh
+    }));
+}
+
+// 取消当前分析，服务端停止工作流及其LLM调用
+function cancelAnalysis() {
+    if (!currentRequestId || !ws || ws.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    addLog(`正在取消分析 ${currentRequestId}...`, "warning");
+    ws.send(JSON.stringify({
+        type: "cancel",
+        request_id: currentRequestId
     }));
 }
 
@@ -554,6 +601,11 @@ function updateExecuteButton() {
     
     btn.disabled = isExecuting;
     
+    const cancelBtn = document.getElementById("cancelBtn");
+    if (cancelBtn) {
+        cancelBtn.disabled = !isExecuting || !currentRequestId;
+    }
+    
     if (isExecuting) {
         btnText.textContent = "多Agent分析中...";
     } else {
@@ -415,6 +415,7 @@ function resetForm() {
     document.getElementById('stockCode').value = 'sh.600519';
     document.getElementById('initialCapital').value = '100000';
     document.getElementById('frequency').value = 'weekly';
+    document.getElementById('profile').value = 'full';
     
     // 重置日期
     setupDefaultDates();
@@ -479,7 +480,8 @@ function collectFormData() {
         start_date: document.getElementById('startDate').value,
         end_date: document.getElementById('endDate').value,
         initial_capital: parseFloat(document.getElementById('initialCapital').value),
-        frequency: document.getElementById('frequency').value
+        frequency: document.getElementById('frequency').value,
+        profile: document.getElementById('profile').value
     };
 }
 
@@ -0,0 +1,301 @@
+"""
+基本面时点快照
+
+批量加载股票全部季度的财务数据（盈利、营运、成长、偿债、现金流、杜邦），
+按财报发布日期（pubDate）组织成时点表，基本面分析Agent运行前取出截至分析日期
+已经发布的各期数据，整理为紧凑表格注入提示词，替代逐季度调用
+get_profit_data、get_growth_data 等工具的多轮往返。
+
+数据来源：
+- 本地数据存储（market_data_store），只从baostock同步本地缺失的季度
+- MCP_BACKEND=replay 时只读本地数据，保证回测可复现
+- MCP_BACKEND=stub 时使用离线基准的合成财务数据
+
+命令行批量同步单只股票、股票列表或全市场：
+    python fundamental_snapshot.py sh.600519 sz.000858 --start-year 2018
+    python fundamental_snapshot.py --universe --start-year 2020
+"""
+
+import bisect
+import os
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from tracing import span
+
+# 快照中每类数据保留的最近报告期数
+SNAPSHOT_QUARTERS = int(os.getenv("FUNDAMENTAL_SNAPSHOT_QUARTERS", "8"))
+
+# 分析日期之前加载的年份数（覆盖同比和多年趋势）
+HISTORY_YEARS = 3
+
+# 数据类型 -> (标题, [(字段, 列名, 格式)])；格式: pct 为比例转百分比，yi 为元转亿元，num 为原值
+SNAPSHOT_FIELDS: Dict[str, Tuple[str, List[Tuple[str, str, str]]]] = {
+    "profit": ("盈利能力", [
+        ("roeAvg", "ROE", "pct"), ("gpMargin", "毛利率", "pct"), ("npMargin", "净利率", "pct"),
+        ("netProfit", "净利润(亿)", "yi"), ("MBRevenue", "主营收入(亿)", "yi"), ("epsTTM", "EPS(TTM)", "num"),
+    ]),
+    "growth": ("成长能力（同比）", [
+        ("YOYNI", "净利润", "pct"), ("YOYPNI", "归母净利润", "pct"), ("YOYEPSBasic", "基本EPS", "pct"),
+        ("YOYEquity", "净资产", "pct"), ("YOYAsset", "总资产", "pct"),
+    ]),
+    "operation": ("营运能力", [
+        ("NRTurnRatio", "应收周转率", "num"), ("INVTurnRatio", "存货周转率", "num"),
+        ("CATurnRatio", "流动资产周转率", "num"), ("AssetTurnRatio", "总资产周转率", "num"),
+    ]),
+    "balance": ("偿债能力", [
+        ("liabilityToAsset", "资产负债率", "pct"), ("currentRatio", "流动比率", "num"),
+        ("quickRatio", "速动比率", "num"), ("cashRatio", "现金比率", "num"),
+        ("assetToEquity", "权益乘数", "num"), ("YOYLiability", "负债同比", "pct"),
+    ]),
+    "cash_flow": ("现金流量", [
+        ("CFOToOR", "经营现金流/营收", "num"), ("CFOToNP", "经营现金流/净利润", "num"),
+        ("CAToAsset", "流动资产/总资产", "pct"), ("ebitToInterest", "利息保障倍数", "num"),
+    ]),
+    "dupont": ("杜邦分析", [
+        ("dupontROE", "ROE", "pct"), ("dupontNitogr", "净利率", "pct"), ("dupontAssetTurn", "总资产周转率", "num"),
+        ("dupontAssetStoEquity", "权益乘数", "num"), ("dupontTaxBurden", "税负", "num"),
+        ("dupontIntburden", "利息负担", "num"),
+    ]),
+}
+
+SNAPSHOT_KINDS = list(SNAPSHOT_FIELDS)
+
+# 快照替代的MCP工具
+REPLACED_TOOLS = ["get_profit_data", "get_operation_data", "get_growth_data",
+                  "get_balance_data", "get_cash_flow_data", "get_dupont_data"]
+
+
+def _format_value(value: Any, fmt: str) -> str:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return "-"
+    if fmt == "pct":
+        return f"{number * 100:.1f}%"
+    if fmt == "yi":
+        return f"{number / 1e8:.2f}"
+    return f"{number:.2f}"
+
+
+def summarize_fundamentals(rows_by_kind: Dict[str, List[Dict[str, Any]]], as_of: str,
+                           quarters: int = SNAPSHOT_QUARTERS) -> str:
+    """
+    将已发布的各期财务数据整理为Markdown表格
+
+    Args:
+        rows_by_kind: 数据类型 -> 截至分析日期已发布的记录（按发布日期升序）
+        as_of: 分析日期
+        quarters: 每类数据保留的最近报告期数
+
+    Returns:
+        Markdown格式的财务快照，没有任何已发布数据时返回空字符串
+    """
+    sections = []
+    for kind, (title, fields) in SNAPSHOT_FIELDS.items():
+        rows = sorted(rows_by_kind.get(kind, []), key=lambda r: r.get("statDate") or "")[-quarters:]
+        if not rows:
+            continue
+        header = "| 报告期 | 发布日 | " + " | ".join(label for _, label, _ in fields) + " |"
+        lines = [f"### {title}", header, "|" + "---|" * (len(fields) + 2)]
+        for row in reversed(rows):
+            values = " | ".join(_format_value(row.get(field), fmt) for field, _, fmt in fields)
+            lines.append(f"| {row.get('statDate', '')} | {row.get('pubDate', '')} | {values} |")
+        sections.append("\n".join(lines))
+    if not sections:
+        return ""
+    return f"## 季度财务数据（截至 {as_of} 已发布的报告，最近 {quarters} 期）\n\n" + "\n\n".join(sections)
+
+
+# ----------------------------------------------------------------------
+# 批量加载与时点表
+# ----------------------------------------------------------------------
+
+def load_quarterly(code: str, start_year: int, end_year: int) -> List[Dict[str, Any]]:
+    """从本地数据存储读取各类季度数据，先从baostock补齐缺失的季度（MCP_BACKEND=replay 时只读本地）"""
+    from market_data_store import baostock_session, get_default_store
+
+    store = get_default_store()
+    if os.getenv("MCP_BACKEND", "http") != "replay":
+        with span("data", "baostock.fundamental_bulk"), baostock_session() as bs:
+            store.sync_quarterly(bs, code, start_year, end_year,
+                                 kinds=SNAPSHOT_KINDS, skip_existing=True)
+    return store.get_quarterly_table(code, start_year, end_year, SNAPSHOT_KINDS)
+
+
+def bulk_sync(codes: List[str], start_year: int, end_year: int,
+              progress: Optional[Callable[[int, int, str, int], None]] = None) -> int:
+    """
+    批量同步一组股票的全部季度财务数据（只查询本地缺失的季度）
+
+    Args:
+        codes: 股票代码列表
+        start_year: 开始年份
+        end_year: 结束年份
+        progress: 进度回调 (序号, 总数, 股票代码, 新增条数)
+
+    Returns:
+        新增的记录条数
+    """
+    from market_data_store import baostock_session, get_default_store
+
+    store = get_default_store()
+    total = 0
+    for index, code in enumerate(codes, 1):
+        try:
+            # 逐只股票持有会话，其他线程的查询可以穿插进行
+            with baostock_session() as bs:
+                added = store.sync_quarterly(bs, code, start_year, end_year,
+                                             kinds=SNAPSHOT_KINDS, skip_existing=True)
+        except Exception as e:
+            print(f"⚠️ {code} 同步失败: {e}")
+            continue
+        total += added
+        if progress:
+            progress(index, len(codes), code, added)
+    return total
+
+
+def _default_loader() -> Callable[[str, int, int], List[Dict[str, Any]]]:
+    if os.getenv("MCP_BACKEND", "http") == "stub":
+        from offline_backend import synthetic_quarterly_data
+        return synthetic_quarterly_data
+    return load_quarterly
+
+
+class FundamentalTable:
+    """单只股票的时点表：各类季度数据按发布日期排序，按分析日期截取已发布的部分"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows_by_kind: Dict[str, List[Dict[str, Any]]] = {kind: [] for kind in SNAPSHOT_KINDS}
+        for row in sorted(rows, key=lambda r: r.get("pubDate") or ""):
+            # 没有发布日期的记录无法判断何时可见，不纳入时点表
+            if row.get("pubDate") and row.get("kind") in self.rows_by_kind:
+                self.rows_by_kind[row["kind"]].append(row)
+        self.pub_dates = {kind: [r["pubDate"] for r in rows] for kind, rows in self.rows_by_kind.items()}
+
+    def as_of(self, date: str) -> Dict[str, List[Dict[str, Any]]]:
+        """截至date（含）已发布的记录"""
+        return {kind: rows[:bisect.bisect_right(self.pub_dates[kind], date)]
+                for kind, rows in self.rows_by_kind.items()}
+
+    def latest(self, date: str) -> Optional[Tuple[str, str]]:
+        """截至date（含）最新发布的报告 (statDate, pubDate)，没有已发布的报告时返回None"""
+        latest = None
+        for kind, rows in self.rows_by_kind.items():
+            index = bisect.bisect_right(self.pub_dates[kind], date)
+            if index:
+                row = rows[index - 1]
+                report = (row.get("statDate") or "", row["pubDate"])
+                if latest is None or (report[1], report[0]) > (latest[1], latest[0]):
+                    latest = report
+        return latest
+
+
+class FundamentalSnapshotEngine:
+    """
+    按股票缓存时点表
+
+    每只股票加载一次覆盖分析日期所在年份及之前 HISTORY_YEARS 年的全部季度，
+    同一回测内不同决策日直接按发布日期截取；分析日期超出已加载年份时重新加载
+    """
+
+    def __init__(self, loader: Optional[Callable[[str, int, int], List[Dict[str, Any]]]] = None,
+                 history_years: int = HISTORY_YEARS, quarters: int = SNAPSHOT_QUARTERS):
+        self.loader = loader or _default_loader()
+        self.history_years = history_years
+        self.quarters = quarters
+        self._tables: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+
+    def _ensure_table(self, code: str, as_of: str) -> FundamentalTable:
+        with self._lock:
+            entry = self._tables.get(code)
+            year = int(as_of[:4])
+            today = datetime.now().strftime("%Y-%m-%d")
+            # 加载当天之后才发布的报告不在表中，分析日期不早于加载日期时按天重新加载
+            if (entry and entry["start_year"] <= year - self.history_years and year <= entry["end_year"]
+                    and (as_of < entry["loaded_on"] or entry["loaded_on"] == today)):
+                self.hits += 1
+                return entry["table"]
+
+            start_year = year - self.history_years
+            if entry:
+                start_year = min(start_year, entry["start_year"])
+            # 回测按年推进，多加载一年避免跨年时重新加载
+            end_year = min(year + 1, int(today[:4]))
+            with span("data", "fundamentals.load"):
+                rows = self.loader(code, start_year, end_year)
+            entry = {"start_year": start_year, "end_year": end_year, "loaded_on": today,
+                     "table": FundamentalTable(rows)}
+            self._tables[code] = entry
+            self.loads += 1
+            return entry["table"]
+
+    def get_summary(self, code: str, as_of: str) -> Optional[str]:
+        """
+        获取截至as_of（含）已发布的财务快照
+
+        Args:
+            code: 股票代码
+            as_of: 分析日期 YYYY-MM-DD
+
+        Returns:
+            Markdown表格，没有已发布的财务数据时返回None
+        """
+        table = self._ensure_table(code, as_of)
+        return summarize_fundamentals(table.as_of(as_of), as_of, self.quarters) or None
+
+    def latest_report(self, code: str, as_of: str) -> Optional[Tuple[str, str]]:
+        """截至as_of（含）最新发布的报告 (statDate, pubDate)，基本面分析结果按此失效"""
+        return self._ensure_table(code, as_of).latest(as_of)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"stocks": len(self._tables), "loads": self.loads, "hits": self.hits}
+
+
+_shared_engine: Optional[FundamentalSnapshotEngine] = None
+
+
+def fundamental_snapshot_enabled() -> bool:
+    return os.getenv("FUNDAMENTAL_SNAPSHOT_ENABLED", "1") != "0"
+
+
+def get_shared_snapshot_engine() -> Optional[FundamentalSnapshotEngine]:
+    """获取进程内共享的快照引擎，FUNDAMENTAL_SNAPSHOT_ENABLED=0 时返回None"""
+    global _shared_engine
+    if not fundamental_snapshot_enabled():
+        return None
+    if _shared_engine is None:
+        _shared_engine = FundamentalSnapshotEngine()
+    return _shared_engine
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="批量同步季度财务数据到本地数据存储")
+    parser.add_argument("codes", nargs="*", help="股票代码，如 sh.600519")
+    parser.add_argument("--universe", action="store_true", help="同步全市场（按baostock行业分类的股票列表）")
+    parser.add_argument("--start-year", type=int, default=datetime.now().year - HISTORY_YEARS)
+    parser.add_argument("--end-year", type=int, default=datetime.now().year)
+    args = parser.parse_args()
+
+    codes = list(args.codes)
+    if args.universe:
+        from market_data_store import MarketDataStore, baostock_session
+
+        with baostock_session() as bs:
+            rows = MarketDataStore._fetch_rows(bs.query_stock_industry())
+        codes += [row["code"] for row in rows if row["code"] not in codes]
+    if not codes:
+        parser.error("请指定股票代码或 --universe")
+
+    def report(index: int, count: int, code: str, added: int):
+        print(f"📥 [{index}/{count}] {code} 新增 {added} 条")
+
+    added_total = bulk_sync(codes, args.start_year, args.end_year, progress=report)
+    print(f"✅ 同步完成: {len(codes)} 只股票，新增季度财务 {added_total} 条")
@@ -0,0 +1,519 @@
+"""
+本地行情数据存储
+
+从baostock同步日K线、估值字段、季度财务数据、分红、行业和交易日历到本地SQLite，
+所有查询都支持按截止日期（as-of）过滤，为回测提供时点一致的数据
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+
+# 当前分析的截止日期，回测时由工作流按决策日设置；为空表示不限制
+AS_OF_DATE: ContextVar[Optional[str]] = ContextVar("as_of_date", default=None)
+
+# baostock 当日日K线在收盘后批量更新，此时间之前当天的K线视为尚未发布
+DAILY_BAR_READY = time(17, 30)
+
+# baostock 是模块级的全局会话且不是线程安全的：技术指标、财务快照、估值历史在
+# to_thread 中并行同步，回测同时在取价格。所有登录和查询都经过这把锁，进程内只登录一次
+_baostock_lock = threading.RLock()
+_baostock_logged_in = False
+
+# 日K线字段（含估值字段，只有日线提供）
+K_DATA_FIELDS = [
+    "date", "code", "open", "high", "low", "close", "preclose", "volume", "amount",
+    "adjustflag", "turn", "tradestatus", "pctChg", "peTTM", "pbMRQ", "psTTM", "pcfNcfTTM", "isST",
+]
+K_DATA_NUMERIC = [
+    "open", "high", "low", "close", "preclose", "volume", "amount",
+    "turn", "pctChg", "peTTM", "pbMRQ", "psTTM", "pcfNcfTTM",
+]
+
+# 季度财务数据类型 -> baostock查询函数名
+QUARTERLY_QUERIES = {
+    "profit": "query_profit_data",
+    "operation": "query_operation_data",
+    "growth": "query_growth_data",
+    "balance": "query_balance_data",
+    "cash_flow": "query_cash_flow_data",
+    "dupont": "query_dupont_data",
+}
+
+
+def get_as_of_date() -> Optional[str]:
+    """获取当前上下文的截止日期"""
+    return AS_OF_DATE.get()
+
+
+@contextmanager
+def pinned_as_of(date: Optional[str]) -> Iterator[None]:
+    """在上下文中固定截止日期"""
+    token = AS_OF_DATE.set(date or None)
+    try:
+        yield
+    finally:
+        AS_OF_DATE.reset(token)
+
+
+@contextmanager
+def baostock_session() -> Iterator[Any]:
+    """
+    进程内共享的baostock会话
+
+    持有期间独占会话，查询和读取结果集都应在 with 块内完成；首次使用时登录，
+    之后复用同一会话，不登出（其他线程可能随时需要）
+    """
+    global _baostock_logged_in
+    import baostock as bs
+
+    with _baostock_lock:
+        if not _baostock_logged_in:
+            lg = bs.login()
+            if lg.error_code != '0':
+                raise Exception(f"登录baostock失败: {lg.error_msg}")
+            _baostock_logged_in = True
+        yield bs
+
+
+def clamp_to_as_of(date: Optional[str], as_of: Optional[str] = None) -> Optional[str]:
+    """将日期截断到截止日期之前"""
+    as_of = as_of or get_as_of_date()
+    if not as_of:
+        return date
+    if not date:
+        return as_of
+    return min(date, as_of)
+
+
+def _to_float(value: str) -> Optional[float]:
+    try:
+        return float(value) if value not in ("", None) else None
+    except ValueError:
+        return None
+
+
+class MarketDataStore:
+    """基于SQLite的本地行情数据存储"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化数据存储
+
+        Args:
+            db_path: 数据库路径，默认读取 MARKET_DATA_DB 环境变量
+        """
+        self.db_path = db_path or os.getenv("MARKET_DATA_DB", "data/market_data.db")
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        numeric_defs = ",\n".join(f"{col} REAL" for col in K_DATA_NUMERIC)
+        with self._connect() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS k_data (
+                    code TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    adjustflag TEXT NOT NULL,
+                    {numeric_defs},
+                    tradestatus TEXT,
+                    isST TEXT,
+                    PRIMARY KEY (code, adjustflag, date)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS quarterly (
+                    kind TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    quarter INTEGER NOT NULL,
+                    pubDate TEXT,
+                    statDate TEXT,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (kind, code, year, quarter)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_quarterly_pub ON quarterly (code, kind, pubDate)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stock_basic (
+                    code TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stock_industry (
+                    code TEXT PRIMARY KEY,
+                    code_name TEXT,
+                    industry TEXT,
+                    industryClassification TEXT,
+                    updateDate TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_industry ON stock_industry (industry)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dividend (
+                    code TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (code, year)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS trade_dates (
+                    calendar_date TEXT PRIMARY KEY,
+                    is_trading_day INTEGER NOT NULL
+                )
+            """)
+
+    # ------------------------------------------------------------------
+    # 从baostock同步
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _fetch_rows(rs) -> List[Dict[str, str]]:
+        """读取baostock结果集"""
+        rows = []
+        if rs is None or rs.error_code != '0':
+            return rows
+        while rs.next():
+            rows.append(dict(zip(rs.fields, rs.get_row_data())))
+        return rows
+
+    def baostock_session(self):
+        """进程内共享的baostock会话，见模块级 baostock_session"""
+        return baostock_session()
+
+    def sync_k_data(self, bs, code: str, start_date: str, end_date: str, adjustflag: str = "3") -> int:
+        """同步日K线和估值字段"""
+        rs = bs.query_history_k_data_plus(
+            code, ",".join(K_DATA_FIELDS),
+            start_date=start_date, end_date=end_date,
+            frequency="d", adjustflag=adjustflag
+        )
+        rows = self._fetch_rows(rs)
+        columns = ["code", "date", "adjustflag"] + K_DATA_NUMERIC + ["tradestatus", "isST"]
+        records = [
+            [row["code"], row["date"], adjustflag]
+            + [_to_float(row.get(col)) for col in K_DATA_NUMERIC]
+            + [row.get("tradestatus"), row.get("isST")]
+            for row in rows
+        ]
+        placeholders = ", ".join("?" for _ in columns)
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO k_data ({', '.join(columns)}) VALUES ({placeholders})", records
+            )
+        return len(records)
+
+    def sync_quarterly(self, bs, code: str, start_year: int, end_year: int,
+                       kinds: Optional[List[str]] = None, skip_existing: bool = False) -> int:
+        """
+        同步季度财务数据（盈利、营运、成长、偿债、现金流、杜邦）
+
+        skip_existing 为True时跳过本地已有的季度，只查询缺失的季度
+        """
+        existing = self.get_quarterly_keys(code) if skip_existing else set()
+        records = []
+        for kind in kinds or list(QUARTERLY_QUERIES):
+            query = getattr(bs, QUARTERLY_QUERIES[kind])
+            for year in range(start_year, end_year + 1):
+                for quarter in range(1, 5):
+                    if (kind, year, quarter) in existing:
+                        continue
+                    for row in self._fetch_rows(query(code=code, year=year, quarter=quarter)):
+                        records.append((kind, code, year, quarter, row.get("pubDate"),
+                                        row.get("statDate"), json.dumps(row, ensure_ascii=False)))
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO quarterly (kind, code, year, quarter, pubDate, statDate, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", records
+            )
+        return len(records)
+
+    def sync_reference_data(self, bs, code: str, start_year: int, end_year: int,
+                            start_date: str, end_date: str):
+        """同步基本信息、行业分类、分红和交易日历"""
+        basic_rows = self._fetch_rows(bs.query_stock_basic(code=code))
+        industry_rows = self._fetch_rows(bs.query_stock_industry(code=code))
+        dividend_records = []
+        for year in range(start_year, end_year + 1):
+            rows = self._fetch_rows(bs.query_dividend_data(code=code, year=str(year), yearType="report"))
+            dividend_records.append((code, year, json.dumps(rows, ensure_ascii=False)))
+        trade_rows = self._fetch_rows(bs.query_trade_dates(start_date=start_date, end_date=end_date))
+
+        with self._lock, self._connect() as conn:
+            for row in basic_rows:
+                conn.execute("INSERT OR REPLACE INTO stock_basic (code, payload) VALUES (?, ?)",
+                             (row["code"], json.dumps(row, ensure_ascii=False)))
+            for row in industry_rows:
+                conn.execute(
+                    "INSERT OR REPLACE INTO stock_industry (code, code_name, industry, industryClassification, updateDate) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (row["code"], row.get("code_name"), row.get("industry"),
+                     row.get("industryClassification"), row.get("updateDate"))
+                )
+            conn.executemany("INSERT OR REPLACE INTO dividend (code, year, payload) VALUES (?, ?, ?)",
+                             dividend_records)
+            conn.executemany(
+                "INSERT OR REPLACE INTO trade_dates (calendar_date, is_trading_day) VALUES (?, ?)",
+                [(row["calendar_date"], int(row["is_trading_day"])) for row in trade_rows]
+            )
+
+    def sync_industry(self, bs):
+        """同步全市场的行业分类"""
+        rows = self._fetch_rows(bs.query_stock_industry())
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO stock_industry (code, code_name, industry, industryClassification, updateDate) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(row["code"], row.get("code_name"), row.get("industry"),
+                  row.get("industryClassification"), row.get("updateDate")) for row in rows]
+            )
+        return len(rows)
+
+    def sync_stock(self, code: str, start_date: str, end_date: str, history_years: int = 3):
+        """
+        同步单只股票回测所需的全部数据
+
+        Args:
+            code: 股票代码
+            start_date: 开始日期
+            end_date: 结束日期
+            history_years: 开始日期之前额外同步的年份数（财务数据和估值历史）
+        """
+        start_year = int(start_date[:4]) - history_years
+        end_year = int(end_date[:4])
+        history_start = f"{start_year}-01-01"
+        with self.baostock_session() as bs:
+            k_count = self.sync_k_data(bs, code, history_start, end_date)
+            q_count = self.sync_quarterly(bs, code, start_year, end_year)
+            self.sync_reference_data(bs, code, start_year, end_year, history_start, end_date)
+        print(f"✅ 同步完成: {code} K线 {k_count} 条，季度财务 {q_count} 条")
+
+    # ------------------------------------------------------------------
+    # 时点一致的查询
+    # ------------------------------------------------------------------
+
+    def get_k_data(self, code: str, start_date: str, end_date: str,
+                   adjustflag: str = "3", as_of: Optional[str] = None) -> List[Dict[str, Any]]:
+        """查询日K线，结束日期截断到截止日期"""
+        end_date = clamp_to_as_of(end_date, as_of)
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM k_data WHERE code = ? AND adjustflag = ? AND date >= ? AND date <= ? "
+                "ORDER BY date", (code, adjustflag, start_date, end_date)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest_bar_date(self, end_date: str, now: Optional[datetime] = None) -> str:
+        """
+        截至end_date应当已有日K线的最近交易日
+
+        交易日历覆盖end_date时以日历为准，否则按工作日推算；当天的K线在 DAILY_BAR_READY 之后才计入
+        """
+        now = now or datetime.now()
+        latest = end_date
+        if end_date >= now.strftime("%Y-%m-%d"):
+            latest = now.strftime("%Y-%m-%d")
+            if now.time() < DAILY_BAR_READY:
+                latest = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+        with self._connect() as conn:
+            covered = conn.execute("SELECT 1 FROM trade_dates WHERE calendar_date >= ? LIMIT 1",
+                                   (latest,)).fetchone()
+            if covered:
+                row = conn.execute(
+                    "SELECT MAX(calendar_date) AS d FROM trade_dates WHERE is_trading_day = 1 AND calendar_date <= ?",
+                    (latest,)
+                ).fetchone()
+                if row and row["d"]:
+                    return row["d"]
+        day = datetime.strptime(latest, "%Y-%m-%d")
+        while day.weekday() >= 5:
+            day -= timedelta(days=1)
+        return day.strftime("%Y-%m-%d")
+
+    def missing_k_data_start(self, rows: List[Dict[str, Any]], start_date: str, end_date: str,
+                             head_tolerance_days: int = 15) -> Optional[str]:
+        """
+        本地K线需要从哪天开始补同步，已是最新时返回None
+
+        开头缺失（超过 head_tolerance_days，覆盖长假）时整段同步，
+        否则只从最后一根K线同步到end_date，最后一根K线已是最近交易日时无需同步
+        """
+        head_limit = (datetime.strptime(start_date, "%Y-%m-%d")
+                      + timedelta(days=head_tolerance_days)).strftime("%Y-%m-%d")
+        if not rows or rows[0]["date"] > head_limit:
+            return start_date
+        if rows[-1]["date"] < self.latest_bar_date(end_date):
+            return rows[-1]["date"]
+        return None
+
+    def get_k_data_many(self, codes: List[str], start_date: str, end_date: str,
+                        adjustflag: str = "3", as_of: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """一次查询多只股票的日K线，返回 股票代码 -> K线（只包含本地有数据的股票）"""
+        if not codes:
+            return {}
+        end_date = clamp_to_as_of(end_date, as_of)
+        placeholders = ", ".join("?" for _ in codes)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM k_data WHERE code IN ({placeholders}) AND adjustflag = ? "
+                f"AND date >= ? AND date <= ? ORDER BY code, date",
+                list(codes) + [adjustflag, start_date, end_date]
+            ).fetchall()
+        result: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            result.setdefault(row["code"], []).append(dict(row))
+        return result
+
+    def get_quarterly(self, kind: str, code: str, year: int, quarter: int,
+                      as_of: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """查询单季财务数据，截止日期前未发布的返回None"""
+        as_of = as_of or get_as_of_date()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, pubDate FROM quarterly WHERE kind = ? AND code = ? AND year = ? AND quarter = ?",
+                (kind, code, int(year), int(quarter))
+            ).fetchone()
+        if not row:
+            return None
+        if as_of and row["pubDate"] and row["pubDate"] > as_of:
+            return None
+        return json.loads(row["payload"])
+
+    def get_quarterly_history(self, kind: str, code: str, as_of: Optional[str] = None) -> List[Dict[str, Any]]:
+        """查询截止日期前已发布的全部季度数据（按报告期排序）"""
+        as_of = as_of or get_as_of_date()
+        sql = "SELECT payload FROM quarterly WHERE kind = ? AND code = ?"
+        args: List[Any] = [kind, code]
+        if as_of:
+            sql += " AND pubDate <= ?"
+            args.append(as_of)
+        with self._connect() as conn:
+            rows = conn.execute(sql + " ORDER BY statDate", args).fetchall()
+        return [json.loads(row["payload"]) for row in rows]
+
+    def get_quarterly_keys(self, code: str) -> set:
+        """本地已有的 (类型, 年份, 季度)"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT kind, year, quarter FROM quarterly WHERE code = ?", (code,)).fetchall()
+        return {(row["kind"], row["year"], row["quarter"]) for row in rows}
+
+    def get_quarterly_table(self, code: str, start_year: int, end_year: int,
+                            kinds: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        一次读取多种季度数据（不按截止日期过滤，由调用方按发布日期截取）
+
+        Returns:
+            按发布日期排序的记录，每条附带 kind、year、quarter
+        """
+        kinds = kinds or list(QUARTERLY_QUERIES)
+        placeholders = ", ".join("?" for _ in kinds)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT kind, year, quarter, payload FROM quarterly WHERE code = ? AND year >= ? AND year <= ? "
+                f"AND kind IN ({placeholders}) ORDER BY pubDate, statDate",
+                [code, int(start_year), int(end_year)] + kinds
+            ).fetchall()
+        return [dict(json.loads(row["payload"]), kind=row["kind"], year=row["year"], quarter=row["quarter"])
+                for row in rows]
+
+    def get_stock_basic(self, code: str) -> Optional[Dict[str, Any]]:
+        """查询股票基本信息"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT payload FROM stock_basic WHERE code = ?", (code,)).fetchone()
+        return json.loads(row["payload"]) if row else None
+
+    def get_stock_industry(self, code: Optional[str] = None) -> List[Dict[str, Any]]:
+        """查询行业分类"""
+        with self._connect() as conn:
+            if code:
+                rows = conn.execute("SELECT * FROM stock_industry WHERE code = ?", (code,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM stock_industry ORDER BY code").fetchall()
+        return [dict(row) for row in rows]
+
+    def get_industry_codes(self, industry: str) -> List[str]:
+        """同一行业的股票代码"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT code FROM stock_industry WHERE industry = ? ORDER BY code",
+                                (industry,)).fetchall()
+        return [row["code"] for row in rows]
+
+    def get_dividends(self, code: str, year: int, as_of: Optional[str] = None,
+                      year_type: str = "report") -> List[Dict[str, Any]]:
+        """
+        查询分红数据，只返回截止日期前已公告的预案
+
+        Args:
+            year_type: 'report' 按预案公告年份，'operate' 按除权除息年份。本地按公告年份同步，
+                除权除息可能在公告的次年，operate 从当年和上一年的公告中筛选
+        """
+        if year_type not in ("report", "operate"):
+            raise ValueError(f"不支持的年份类型: {year_type}，可选 report / operate")
+        as_of = as_of or get_as_of_date()
+        years = [int(year)] if year_type == "report" else [int(year) - 1, int(year)]
+        placeholders = ", ".join("?" for _ in years)
+        with self._connect() as conn:
+            payloads = conn.execute(
+                f"SELECT payload FROM dividend WHERE code = ? AND year IN ({placeholders}) ORDER BY year",
+                [code] + years).fetchall()
+        rows = [r for payload in payloads for r in json.loads(payload["payload"])]
+        if year_type == "operate":
+            rows = [r for r in rows if (r.get("dividOperateDate") or "").startswith(str(year))]
+        if as_of:
+            rows = [r for r in rows if (r.get("dividPlanAnnounceDate") or "") <= as_of]
+        return rows
+
+    def get_latest_trading_date(self, as_of: Optional[str] = None) -> Optional[str]:
+        """截止日期（默认今天）之前最近的交易日"""
+        as_of = as_of or get_as_of_date() or datetime.now().strftime("%Y-%m-%d")
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT MAX(calendar_date) AS d FROM trade_dates WHERE is_trading_day = 1 AND calendar_date <= ?",
+                (as_of,)
+            ).fetchone()
+            if row and row["d"]:
+                return row["d"]
+            row = conn.execute("SELECT MAX(date) AS d FROM k_data WHERE date <= ?", (as_of,)).fetchone()
+        return row["d"] if row else None
+
+
+_default_store: Optional[MarketDataStore] = None
+
+
+def get_default_store() -> MarketDataStore:
+    """获取进程内共享的默认数据存储"""
+    global _default_store
+    if _default_store is None:
+        _default_store = MarketDataStore()
+    return _default_store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="同步本地行情数据")
+    parser.add_argument("codes", nargs="+", help="股票代码，如 sh.600519")
+    parser.add_argument("--start", required=True, help="开始日期 YYYY-MM-DD")
+    parser.add_argument("--end", default=datetime.now().strftime("%Y-%m-%d"), help="结束日期 YYYY-MM-DD")
+    parser.add_argument("--history_years", type=int, default=3)
+    args = parser.parse_args()
+
+    store = get_default_store()
+    for stock_code in args.codes:
+        store.sync_stock(stock_code, args.start, args.end, history_years=args.history_years)
@@ -0,0 +1,245 @@
+"""
+MCP数据源熔断器与本地降级
+
+MCP服务器变慢或宕机时，每个新工作流的 connect_mcp_tools 都要经历多次超时重试，
+正在运行的Agent也会卡在每一次工具调用上。熔断器统计MCP连接和工具调用的连续失败：
+
+- closed: 正常调用MCP，调用超时（MCP_TOOL_TIMEOUT）或出错计为失败
+- open: 连续失败达到 MCP_BREAKER_FAILURES 次或连接重试用尽（单次超时 MCP_CONNECT_TIMEOUT）后断开，
+  之后的连接和调用立即失败，不再等待MCP
+- half_open: 断开 MCP_BREAKER_RESET_SECONDS 秒后放行一次探测调用，成功则恢复，失败则重新断开
+
+调用被拒绝或失败时，数据工具改由本地 market_data_store（baostock同步的数据库）提供，
+名称和参数与MCP工具一致（见 replay_mcp_server），分析快速降级而不是挂起。
+降级结果带有来源标记，不写入共享工具缓存。设置 MCP_FALLBACK_ENABLED=0 关闭本地降级
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from tracing import Counter, Gauge, register_metrics
+
+BREAKER_FAILURES = int(os.getenv("MCP_BREAKER_FAILURES", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("MCP_BREAKER_RESET_SECONDS", "30"))
+TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "30"))
+CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "10"))
+
+# 熔断状态在 /metrics 中的取值
+STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+MCP_CALLS = Counter("mcp_agent_mcp_calls_total",
+                    "MCP工具调用的结果（ok/failed/timeout/rejected）及降级来源（fallback/unavailable）")
+
+
+def fallback_enabled() -> bool:
+    return os.getenv("MCP_FALLBACK_ENABLED", "1") == "1"
+
+
+class CircuitBreaker:
+    """
+    连续失败计数的熔断器
+
+    半开状态同一时间只放行一个探测调用，其余调用仍然快速失败；
+    探测被取消时由 release 归还名额，超过 reset_seconds 仍未结束的探测视为丢失
+    """
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None,
+                 reset_seconds: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or BREAKER_FAILURES
+        self.reset_seconds = reset_seconds if reset_seconds is not None else BREAKER_RESET_SECONDS
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._state = "half_open"
+            self._probing = False
+        elif (self._state == "half_open" and self._probing
+              and time.monotonic() - self._probe_started >= self.reset_seconds):
+            # 探测调用没有记录结果（如所在任务被意外丢弃），放行下一次探测
+            self._probing = False
+        return self._state
+
+    def allow(self) -> bool:
+        """是否放行本次调用；半开状态下放行的调用即为探测调用"""
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                self._probe_started = time.monotonic()
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                print(f"[熔断] {self.name} 探测成功，恢复正常调用")
+            self._state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def release(self):
+        """放行的调用未得到结果（如被取消）时归还探测名额，不计成功或失败"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                print(f"[熔断] {self.name} 连续失败 {self._failures} 次，断开 {self.reset_seconds:g} 秒")
+
+    def trip(self):
+        """立即断开（如连接重试已用尽），不再等待失败次数达到阈值"""
+        with self._lock:
+            self._probing = False
+            if self._current_state() != "open":
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                print(f"[熔断] {self.name} 连接重试用尽，断开 {self.reset_seconds:g} 秒")
+
+    def retry_in(self) -> float:
+        """距离下一次探测的秒数，未断开时为0"""
+        with self._lock:
+            if self._current_state() != "open":
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "retry_in": round(self.retry_in(), 1),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+_mcp_breaker: Optional[CircuitBreaker] = None
+
+
+def get_mcp_breaker() -> CircuitBreaker:
+    """获取进程内共享的MCP熔断器"""
+    global _mcp_breaker
+    if _mcp_breaker is None:
+        _mcp_breaker = CircuitBreaker("a_share_data_provider")
+    return _mcp_breaker
+
+
+def _local_tools() -> Dict[str, Callable[..., str]]:
+    from replay_mcp_server import REPLAY_TOOLS
+    return {func.__name__: func for func in REPLAY_TOOLS}
+
+
+def build_fallback_tools() -> list:
+    """MCP不可用时整体替换的本地数据工具"""
+    from replay_mcp_server import build_replay_tools
+    return build_replay_tools()
+
+
+async def call_local_tool(name: str, kwargs: Dict[str, Any], reason: str) -> Optional[str]:
+    """
+    用本地数据库执行同名工具
+
+    Returns:
+        带降级说明的结果文本，本地没有该工具或执行出错时返回None
+    """
+    func = _local_tools().get(name)
+    if func is None:
+        return None
+    try:
+        # 本地查询在线程中执行，截止日期上下文随 to_thread 一并复制
+        result = await asyncio.to_thread(func, **kwargs)
+    except Exception as e:
+        print(f"[熔断] 本地降级工具 {name} 执行失败: {e}")
+        return None
+    return f"⚠️ MCP数据源{reason}，以下数据来自本地数据库\n\n{result}"
+
+
+def guard_tools(tools: list, breaker: CircuitBreaker, timeout: Optional[float] = None) -> list:
+    """
+    为MCP工具加上超时、熔断和本地降级
+
+    只替换工具的协程函数。降级结果以 (content, {"source": ...}) 返回，
+    带附件的结果不会被 shared_cache.cache_tool_results 缓存
+    """
+    timeout = timeout or TOOL_TIMEOUT
+
+    def respond(tool, text: str, source: str):
+        if getattr(tool, "response_format", "content") == "content_and_artifact":
+            return text, {"source": source}
+        return text
+
+    def wrap(tool, coroutine):
+        name = tool.name
+
+        async def fallback(kwargs: Dict[str, Any], reason: str):
+            text = await call_local_tool(name, kwargs, reason) if fallback_enabled() else None
+            if text is not None:
+                MCP_CALLS.inc(outcome="fallback")
+                return respond(tool, text, "local_store")
+            MCP_CALLS.inc(outcome="unavailable")
+            message = f"MCP数据源{reason}，{name} 暂无可用数据，请基于已有信息分析"
+            return respond(tool, message, "unavailable")
+
+        async def call(*args, **kwargs):
+            if not breaker.allow():
+                MCP_CALLS.inc(outcome="rejected")
+                return await fallback(kwargs, f"熔断中（约 {breaker.retry_in():.0f} 秒后重试）")
+            try:
+                result = await asyncio.wait_for(coroutine(*args, **kwargs), timeout=timeout)
+            except asyncio.CancelledError:
+                # 分析被取消（CancelledError 不是 Exception 的子类），探测名额必须归还
+                breaker.release()
+                raise
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                MCP_CALLS.inc(outcome="timeout")
+                return await fallback(kwargs, f"调用超时（{timeout:g} 秒）")
+            except Exception as e:
+                breaker.record_failure()
+                MCP_CALLS.inc(outcome="failed")
+                print(f"[熔断] MCP工具 {name} 调用失败: {e}")
+                return await fallback(kwargs, "调用失败")
+            breaker.record_success()
+            MCP_CALLS.inc(outcome="ok")
+            return result
+        return call
+
+    for tool in tools:
+        if getattr(tool, "coroutine", None) is not None:
+            tool.coroutine = wrap(tool, tool.coroutine)
+    return tools
+
+
+register_metrics(
+    MCP_CALLS,
+    Gauge("mcp_agent_mcp_circuit_state", "MCP熔断器状态（0=closed, 1=half_open, 2=open）",
+          lambda: STATE_VALUES[get_mcp_breaker().state]),
+)
@@ -0,0 +1,44 @@
+"""
+指标服务
+
+/metrics 以 Prometheus 文本格式导出链路追踪汇总的延迟直方图和计数器，
+/api/traces/{trace_id} 返回单次运行最近记录的span，便于排查慢请求，
+/api/cache/stats 返回本worker和（共享缓存下）所有worker的缓存命中统计，
+/api/llm/usage 返回各Agent的模型路由及按 (Agent, 模型) 汇总的调用耗时和token数
+"""
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from shared_cache import cache_stats
+from model_routing import resolve_agent_models
+from tracing import get_trace_spans, llm_usage_summary, render_metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus指标"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/api/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """获取单次运行的span列表"""
+    spans = get_trace_spans(trace_id)
+    if not spans:
+        return JSONResponse({'error': f'未找到trace: {trace_id}'}, status_code=404)
+    return {"trace_id": trace_id, "spans": spans}
+
+
+@router.get("/api/cache/stats")
+async def get_cache_stats():
+    """各缓存命名空间的命中统计，按worker区分"""
+    return cache_stats()
+
+
+@router.get("/api/llm/usage")
+async def get_llm_usage():
+    """各Agent当前的模型路由，以及按 (Agent, 模型) 汇总的平均耗时和token数"""
+    return {"routing": resolve_agent_models(), "usage": llm_usage_summary()}
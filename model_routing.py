@@ -0,0 +1,47 @@
+"""
+按Agent路由模型
+
+各Agent的模型可以单独配置：取数的ReAct循环和投资决策的JSON输出可以使用更快的模型，
+综合报告使用更强的模型。模型由环境变量 GEMINI_MODEL_<角色> 指定，未设置时使用 GEMINI_MODEL：
+
+- GEMINI_MODEL_FUNDAMENTAL / GEMINI_MODEL_TECHNICAL / GEMINI_MODEL_VALUATION: 专业分析（取数循环）
+- GEMINI_MODEL_SUMMARY: 综合报告
+- GEMINI_MODEL_INVESTMENT: 投资决策（JSON输出）
+
+同名模型只创建一个客户端。各Agent的调用耗时和token数按 (agent, model) 记录，
+见 /metrics 的 mcp_agent_llm_call_seconds、mcp_agent_llm_tokens_total 和 /api/llm/usage
+"""
+
+import os
+from typing import Dict, List, Tuple
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# 路由角色及说明，顺序与工作流中的执行顺序一致
+AGENT_ROLES: List[Tuple[str, str]] = [
+    ("fundamental", "基本面分析"),
+    ("technical", "技术分析"),
+    ("valuation", "估值分析"),
+    ("summary", "综合报告"),
+    ("investment", "投资决策"),
+]
+
+
+def default_model() -> str:
+    return os.getenv("GEMINI_MODEL", DEFAULT_MODEL)
+
+
+def agent_model(role: str) -> str:
+    """角色使用的模型名称"""
+    return os.getenv(f"GEMINI_MODEL_{role.upper()}") or default_model()
+
+
+def resolve_agent_models() -> Dict[str, str]:
+    """各角色使用的模型名称"""
+    return {role: agent_model(role) for role, _ in AGENT_ROLES}
+
+
+def describe_routing(models: Dict[str, str]) -> str:
+    """路由配置的单行说明，用于日志"""
+    titles = dict(AGENT_ROLES)
+    return "，".join(f"{titles.get(role, role)}={model}" for role, model in models.items())
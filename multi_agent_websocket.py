@@ -1,13 +1,39 @@
 from multi_agent_workflow import MultiAgentWorkflow
+from analysis_coalescer import AnalysisBroadcast, analysis_coalescer
+from analysis_prewarm import prewarm_store
+from report_artifacts import send_report
 from fastapi import WebSocket
+from typing import Dict, Optional
+import asyncio
 import json
 import datetime
+import os
 import re
+import uuid
 
-class MultiAgentWebSocketManager:
-    def __init__(self, websocket: WebSocket):
+# 每个连接同时运行的分析数上限
+MAX_CONCURRENT_ANALYSES = int(os.getenv("WS_MAX_CONCURRENT_ANALYSES", "3"))
+
+
+class RequestTaggedWebSocket:
+    """把请求ID写入每条消息的WebSocket包装，同一连接上的多个分析按ID区分消息"""
+    
+    def __init__(self, websocket: WebSocket, request_id: str):
         self.websocket = websocket
-        self.workflow = MultiAgentWorkflow(websocket)
+        self.request_id = request_id
+        self._prefix = '{"request_id": ' + json.dumps(request_id) + ', '
+    
+    async def send_text(self, text: str):
+        # 消息都是非空JSON对象，直接在开头插入字段，不重新解析（产物分块可能较大）
+        if text.startswith("{") and text[1:].lstrip() != "}":
+            text = self._prefix + text[1:]
+        await self.websocket.send_text(text)
+
+
+class MultiAgentWebSocketManager:
+    def __init__(self, websocket: WebSocket, request_id: Optional[str] = None):
+        self.request_id = request_id
+        self.websocket = RequestTaggedWebSocket(websocket, request_id) if request_id else websocket
     
     async def send_log(self, message: str, log_type: str = "info"):
         """发送日志消息到前端"""
@@ -18,6 +44,65 @@ class MultiAgentWebSocketManager:
             "timestamp": timestamp
         }))
     
+    async def run_coalesced_analysis(self, company_name: str, stock_code: str):
+        """
+        运行分析，同一股票、同一日期的并发请求合并为一次工作流
+        
+        事件流（包括最终报告和完成信号）通过广播通道发送给所有观看者
+        """
+        async def runner(channel: AnalysisBroadcast):
+            workflow = MultiAgentWorkflow(channel)
+            try:
+                final_report = await workflow.run_analysis(company_name, stock_code)
+                await self._send_report(channel, final_report)
+                return final_report
+            except Exception as e:
+                await self._send_error(channel, e)
+                return None
+        
+        key = analysis_coalescer.make_key(stock_code)
+        return await analysis_coalescer.run(key, self.websocket, runner)
+    
+    async def _send_report(self, target, final_report, include_agent_sections: bool = False):
+        """
+        发送最终报告和完成信号
+        
+        报告正文不再整体发送：各Agent的结果已在执行时作为产物发出，
+        这里只补发综合报告和投资决策，再发送引用这些产物的报告帧
+        """
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        if final_report:
+            await target.send_text(json.dumps({
+                "message": "=== 综合分析报告 ===",
+                "type": "success",
+                "timestamp": timestamp
+            }))
+            await send_report(target, final_report, include_agent_sections)
+        else:
+            await target.send_text(json.dumps({
+                "message": "未能生成最终报告",
+                "type": "error",
+                "timestamp": timestamp
+            }))
+        await target.send_text(json.dumps({
+            "message": "执行完成",
+            "type": "execution_complete",
+            "timestamp": timestamp
+        }))
+    
+    async def _send_error(self, target, error: Exception):
+        """发送错误详情和完成信号"""
+        import traceback
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        for message, log_type in [(f"执行过程中发生错误: {error}", "error"),
+                                  (f"错误详情: {traceback.format_exc()}", "error"),
+                                  ("执行完成", "execution_complete")]:
+            await target.send_text(json.dumps({
+                "message": message,
+                "type": log_type,
+                "timestamp": timestamp
+            }))
+    
     def parse_query(self, query: str):
         """解析用户查询，提取公司名称和股票代码"""
         # 尝试提取股票代码（支持多种格式）
@@ -84,25 +169,13 @@ class MultiAgentWebSocketManager:
             
             await self.send_log(f"解析结果 - 公司名称: {company_name}, 股票代码: {stock_code}", "success")
             
-            # 运行多agent分析
-            await self.send_log("启动多Agent分析系统...", "info")
-            final_report = await self.workflow.run_analysis(company_name, stock_code)
-            
-            if final_report:
-                await self.send_log("=== 综合分析报告 ===", "success")
-                await self.send_log(f"📄 最终报告:\n{final_report}", "success")
-                # # 分段发送长文本报告
-                # if len(final_report) > 2000:
-                #     parts = [final_report[i:i+2000] for i in range(0, len(final_report), 2000)]
-                #     for i, part in enumerate(parts):
-                #         await self.send_log(f"📄 报告 ({i+1}/{len(parts)}): {part}", "success")
-                # else:
-                #     await self.send_log(f"📄 最终报告: {final_report}", "success")
-            else:
-                await self.send_log("未能生成最终报告", "error")
+            # 预热报告仍然新鲜时直接返回
+            if await self.send_prewarmed_report(stock_code):
+                return
             
-            # 发送执行完成信号
-            await self.send_log("执行完成", "execution_complete")
+            # 运行多agent分析（同一股票的并发请求共享一次分析）
+            await self.send_log("启动多Agent分析系统...", "info")
+            await self.run_coalesced_analysis(company_name, stock_code)
             
         except Exception as e:
             await self.send_log(f"执行过程中发生错误: {e}", "error")
@@ -111,7 +184,20 @@ class MultiAgentWebSocketManager:
             await self.send_log(f"错误详情: {error_details}", "error")
             await self.send_log("执行完成", "execution_complete")
 
-    async def execute_multi_agent_analysis_direct(self, company_name: str, stock_code: str):
+    async def send_prewarmed_report(self, stock_code: str) -> bool:
+        """关注列表中的股票有新鲜的预热报告时直接返回，返回是否已发送"""
+        entry = prewarm_store.get_fresh(stock_code)
+        if entry is None:
+            return False
+        await self.send_log(
+            f"⚡ 使用预热报告（截止日期 {entry['as_of_date']}，生成于 {entry['generated_at']}），"
+            f"如需最新分析请强制刷新", "success")
+        # 预热报告没有经过Agent执行，各部分产物需要全部发送
+        await self._send_report(self.websocket, entry["report"], include_agent_sections=True)
+        return True
+    
+    async def execute_multi_agent_analysis_direct(self, company_name: str, stock_code: str,
+                                                  force_refresh: bool = False):
         """直接执行多agent分析，无需解析查询"""
         try:
             await self.send_log(f"开始分析: {company_name} ({stock_code})", "info")
@@ -124,18 +210,13 @@ class MultiAgentWebSocketManager:
                 
             await self.send_log(f"分析目标 - 公司名称: {company_name}, 股票代码: {stock_code}", "success")
             
-            # 运行多agent分析
-            await self.send_log("启动多Agent分析系统...", "info")
-            final_report = await self.workflow.run_analysis(company_name, stock_code)
-            
-            if final_report:
-                await self.send_log("=== 综合分析报告 ===", "success")
-                await self.send_log(f"📄 最终报告:\n{final_report}", "success")
-            else:
-                await self.send_log("未能生成最终报告", "error")
+            # 预热报告仍然新鲜时直接返回
+            if not force_refresh and await self.send_prewarmed_report(stock_code):
+                return
             
-            # 发送执行完成信号
-            await self.send_log("执行完成", "execution_complete")
+            # 运行多agent分析（同一股票的并发请求共享一次分析）
+            await self.send_log("启动多Agent分析系统...", "info")
+            await self.run_coalesced_analysis(company_name, stock_code)
             
         except Exception as e:
             await self.send_log(f"执行过程中发生错误: {e}", "error")
@@ -144,6 +225,79 @@ class MultiAgentWebSocketManager:
             await self.send_log(f"错误详情: {error_details}", "error")
             await self.send_log("执行完成", "execution_complete")
 
+class ConnectionAnalyses:
+    """
+    单个WebSocket连接上的分析任务
+    
+    每个分析请求作为独立任务运行并以请求ID标记消息，接收循环保持空闲，
+    可以随时响应心跳、取消请求或开始另一只股票的分析。
+    websocket 传入 connection_manager.channel(websocket)，消息经连接的发送队列写出
+    """
+    
+    def __init__(self, websocket: WebSocket, max_concurrent: Optional[int] = None):
+        self.websocket = websocket
+        self.max_concurrent = max_concurrent or MAX_CONCURRENT_ANALYSES
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.closed = False
+    
+    async def start(self, message: dict) -> Optional[str]:
+        """启动分析任务，返回请求ID；超过并发上限时拒绝"""
+        request_id = str(message.get("request_id") or uuid.uuid4().hex[:12])
+        manager = MultiAgentWebSocketManager(self.websocket, request_id)
+        if request_id in self.tasks:
+            await manager.send_log(f"请求ID {request_id} 的分析仍在进行中", "error")
+            return None
+        if len(self.tasks) >= self.max_concurrent:
+            await manager.send_log(
+                f"当前连接已有 {len(self.tasks)} 个分析在运行（上限 {self.max_concurrent}），请等待完成或取消后再试", "error")
+            await manager.send_log("执行完成", "execution_complete")
+            return None
+        
+        # 支持两种格式：新格式（直接传递公司名和股票代码）和旧格式（查询字符串）
+        if "company_name" in message and "stock_code" in message:
+            print(f"[多Agent] 开始执行分析: {message['company_name']} ({message['stock_code']}) [{request_id}]")
+            coroutine = manager.execute_multi_agent_analysis_direct(
+                message["company_name"], message["stock_code"], force_refresh=bool(message.get("force_refresh"))
+            )
+        else:
+            print(f"[多Agent] 开始执行查询: {message['query'][:50]}... [{request_id}]")
+            coroutine = manager.execute_multi_agent_analysis(message["query"])
+        
+        await manager.send_log(f"📨 已受理分析请求 {request_id}", "info")
+        self.tasks[request_id] = asyncio.create_task(self._run(request_id, manager, coroutine))
+        return request_id
+    
+    async def _run(self, request_id: str, manager: MultiAgentWebSocketManager, coroutine):
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            print(f"[多Agent] 分析已取消 [{request_id}]")
+            if not self.closed:
+                try:
+                    await manager.send_log("🛑 分析已取消", "warning")
+                    await manager.send_log("执行完成", "execution_complete")
+                except Exception:
+                    pass
+        finally:
+            self.tasks.pop(request_id, None)
+    
+    async def cancel(self, request_id: Optional[str] = None) -> int:
+        """取消指定请求（未指定时取消本连接的全部分析），返回取消的任务数"""
+        if request_id is None:
+            targets = list(self.tasks.values())
+        else:
+            targets = [self.tasks[request_id]] if request_id in self.tasks else []
+        for task in targets:
+            task.cancel()
+        await asyncio.gather(*targets, return_exceptions=True)
+        return len(targets)
+    
+    async def close(self):
+        """连接断开：取消全部分析，无人观看的工作流随之停止"""
+        self.closed = True
+        await self.cancel()
+
+
 # 测试函数
 async def test_parse_query():
     """测试查询解析功能"""
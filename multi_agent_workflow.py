@@ -1,52 +1,131 @@
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from langgraph.prebuilt import create_react_agent
-from langchain_google_genai import ChatGoogleGenerativeAI
 import os
 from dotenv import load_dotenv
-from typing import Annotated, TypedDict, List
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
-from langgraph.graph.message import add_messages
-from langgraph.graph import StateGraph, END
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Annotated, Any, Dict, Optional, TypedDict, List
 import asyncio
 import datetime
-from fastapi import WebSocket
 import json
 
 # 导入新创建的agent类
 from agents import FundamentalAgent, TechnicalAgent, ValuationAgent, SummaryAgent, InvestmentAgent
+from agents import get_shared_result_cache
+from market_data_store import pinned_as_of
+from model_routing import default_model, describe_routing, resolve_agent_models
+from mcp_circuit_breaker import CONNECT_TIMEOUT, build_fallback_tools, fallback_enabled, get_mcp_breaker, guard_tools
+from shared_cache import cache_tool_results, get_partial_summary_cache, get_tool_cache
+from tracing import span, start_trace, traced_node
+
+# langgraph、langchain_mcp_adapters、langchain_google_genai 导入耗时较长，
+# 在首次连接工具、创建模型或构建工作流时再加载，加快服务启动和热重载
+
+if TYPE_CHECKING:
+    from fastapi import WebSocket
 
 load_dotenv()
 
-class MultiAgentState(TypedDict):
-    company_name: str
-    stock_code: str
-    current_time_info: str
-    current_date: str
-    current_price: float
-    historical_prices: list
-    portfolio_state: dict
-    fundamental_analysis: str
-    technical_analysis: str
-    valuation_analysis: str
-    summary_analysis: str
-    investment_decision: str
-    final_report: str
-    messages: Annotated[list[BaseMessage], add_messages]
+_state_schema = None
+
+
+def get_state_schema():
+    """获取工作流状态类型（首次构建工作流时创建）"""
+    global _state_schema
+    if _state_schema is None:
+        from langchain_core.messages import BaseMessage
+        from langgraph.graph.message import add_messages
+
+        class MultiAgentState(TypedDict):
+            company_name: str
+            stock_code: str
+            current_time_info: str
+            current_date: str
+            current_price: float
+            historical_prices: list
+            indicator_snapshot: dict
+            portfolio_state: dict
+            fundamental_analysis: str
+            fundamental_snapshot: str
+            technical_analysis: str
+            technical_indicators: str
+            valuation_analysis: str
+            valuation_snapshot: str
+            summary_analysis: str
+            partial_summaries: dict
+            investment_decision: str
+            final_report: str
+            messages: Annotated[list[BaseMessage], add_messages]
+
+        _state_schema = MultiAgentState
+    return _state_schema
+
+
+def __getattr__(name):
+    # 兼容 from multi_agent_workflow import MultiAgentState
+    if name == "MultiAgentState":
+        return get_state_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# 回测工作流配置：每个决策点运行哪些专业Agent
+BACKTEST_PROFILES = {
+    "full": {
+        "agents": ["fundamental", "technical", "valuation"],
+        "description": "完整：基本面、技术、估值三个专业分析，用于最终验证"
+    },
+    "technical_fundamental": {
+        "agents": ["technical", "fundamental"],
+        "description": "技术分析加基本面（基本面结果按最新发布的财报缓存）"
+    },
+    "technical": {
+        "agents": ["technical"],
+        "description": "仅技术分析，适合快速的每日探索性回测"
+    },
+}
+
+DEFAULT_BACKTEST_PROFILE = "full"
+
+
+def incremental_summary_enabled() -> bool:
+    """专业Agent完成后是否立即提炼要点（map-reduce增量汇总）"""
+    return os.getenv("INCREMENTAL_SUMMARY_ENABLED", "1") != "0"
+
+
+# 正在执行工作流图的实例。编译好的图在进程内共享，节点运行时由此取得
+# 本次请求的实例（WebSocket/广播通道、Agent和状态日志），与 pinned_as_of 一样随任务上下文传递
+_active_workflow: ContextVar[Optional["MultiAgentWorkflow"]] = ContextVar("active_workflow", default=None)
+
+
+def current_workflow() -> "MultiAgentWorkflow":
+    workflow = _active_workflow.get()
+    if workflow is None:
+        raise RuntimeError("工作流图只能在 MultiAgentWorkflow.bind() 内执行")
+    return workflow
+
+
+def workflow_node(method: str):
+    """按方法名调用当前工作流实例的节点函数"""
+    async def node(state: "MultiAgentState") -> "MultiAgentState":
+        return await getattr(current_workflow(), method)(state)
+    node.__name__ = method
+    return node
+
 
 class MultiAgentWorkflow:
-    def __init__(self, websocket: WebSocket = None, verbose: bool = True):
+    # 进程内共享的MCP客户端、工具池和模型，实时分析与回测的所有工作流实例复用
+    _shared_client = None
+    _shared_tools = None
+    _shared_llms = {}  # 按模型名称共享的模型客户端
+    _shared_lock = None
+    _tools_degraded = False  # 共享工具池是否为MCP不可用时的本地降级工具
+    # 编译好的工作流图按类型和回测配置在进程内共享，每个请求只创建轻量的实例
+    _compiled_workflows: Dict[str, Any] = {}
+    
+    def __init__(self, websocket: "WebSocket" = None, verbose: bool = True):
         self.websocket = websocket
         self.verbose = verbose
         
-        # 优化MCP客户端配置 - 使用测试验证的工作配置
-        self.client = MultiServerMCPClient({
-            "a_share_data_provider": {
-                "url": "http://localhost:3000/mcp/",
-                "transport": "streamable_http"
-            }
-        })
         self.tools = None
-        self.llm = None
+        self.llms = {}  # 各角色使用的模型客户端，见 model_routing
         self._initialized = False  # 追踪初始化状态
         
         # 初始化agent实例，传入verbose参数
@@ -56,6 +135,42 @@ class MultiAgentWorkflow:
         self.summary_agent = SummaryAgent(verbose=self.verbose)
         self.investment_agent = InvestmentAgent(verbose=self.verbose)
         
+        # 按角色路由模型的Agent
+        self.agents_by_role = {
+            "fundamental": self.fundamental_agent,
+            "technical": self.technical_agent,
+            "valuation": self.valuation_agent,
+            "summary": self.summary_agent,
+            "investment": self.investment_agent,
+        }
+        
+        # 专业Agent及其显示名称，回测配置按键选择
+        self.specialists = {
+            "fundamental": (self.fundamental_agent, "基本面分析"),
+            "technical": (self.technical_agent, "技术分析"),
+            "valuation": (self.valuation_agent, "估值分析"),
+        }
+    
+    @property
+    def client(self):
+        """进程内共享的MCP客户端，首次使用时创建"""
+        return self.get_shared_client()
+    
+    @classmethod
+    def get_shared_client(cls):
+        """获取进程内共享的MCP客户端"""
+        if MultiAgentWorkflow._shared_client is None:
+            from langchain_mcp_adapters.client import MultiServerMCPClient
+            
+            # 优化MCP客户端配置 - 使用测试验证的工作配置
+            MultiAgentWorkflow._shared_client = MultiServerMCPClient({
+                "a_share_data_provider": {
+                    "url": os.getenv("MCP_SERVER_URL", "http://localhost:3000/mcp/"),
+                    "transport": "streamable_http"
+                }
+            })
+        return MultiAgentWorkflow._shared_client
+        
     async def send_log(self, message: str, log_type: str = "info"):
         """发送日志消息到前端"""
         if self.websocket:
@@ -68,81 +183,180 @@ class MultiAgentWorkflow:
         else:
             print(f"[{log_type.upper()}] {message}")
     
+    async def connect_mcp_tools(self):
+        """连接MCP服务器并加载工具（带重试）"""
+        if os.getenv("MCP_BACKEND", "http") == "replay":
+            # 离线回放：进程内加载本地数据工具，按分析日期固定截止日期
+            from replay_mcp_server import build_replay_tools
+            tools = build_replay_tools()
+            await self.send_log(f"✅ 使用离线回放数据工具！可用工具数量: {len(tools)}", "success")
+            return tools
+        
+        if os.getenv("MCP_BACKEND", "http") == "stub":
+            # 离线基准：进程内桩工具，返回固定结果
+            from offline_backend import build_stub_tools
+            tools = build_stub_tools()
+            await self.send_log(f"✅ 使用离线桩工具！可用工具数量: {len(tools)}", "success")
+            return tools
+        
+        breaker = get_mcp_breaker()
+        if not breaker.allow():
+            # 熔断期间不再等待MCP超时，直接使用本地数据工具
+            reason = f"MCP数据源熔断中（约 {breaker.retry_in():.0f} 秒后重试）"
+            if fallback_enabled():
+                return await self.use_fallback_tools(reason)
+            raise Exception(reason)
+        
+        await self.send_log("正在连接 MCP 服务器...", "info")
+        
+        # 优化的连接逻辑：减少重试次数，增加每次重试间隔；熔断器断开后不再重试
+        max_retries = 2
+        base_delay = 3
+        last_error = None
+        
+        for attempt in range(max_retries):
+            try:
+                # 确保每次尝试都是独立的
+                await self.send_log(f"尝试连接 MCP 服务器 ({attempt + 1}/{max_retries})", "info")
+                
+                # 连接超时可通过 MCP_CONNECT_TIMEOUT 调整
+                tools = await asyncio.wait_for(
+                    self.client.get_tools(), 
+                    timeout=CONNECT_TIMEOUT
+                )
+                
+                breaker.record_success()
+                MultiAgentWorkflow._tools_degraded = False
+                await self.send_log(f"✅ MCP连接成功！可用工具数量: {len(tools)}", "success")
+                # 工具调用加上超时和熔断，失败时由本地数据库降级
+                return guard_tools(tools, breaker)
+                
+            except asyncio.TimeoutError:
+                last_error = "MCP服务器连接超时，请检查服务器状态"
+                retry_message = "MCP连接超时"
+                    
+            except Exception as e:
+                error_msg = str(e)
+                if "session" in error_msg.lower():
+                    # 会话相关错误，稍等后重试
+                    last_error = "MCP服务器会话管理错误，请重启MCP服务器"
+                    retry_message = "MCP会话错误"
+                else:
+                    last_error = f"MCP连接失败: {error_msg}"
+                    retry_message = "MCP连接失败"
+            
+            breaker.record_failure()
+            if attempt < max_retries - 1 and breaker.state == "closed":
+                delay = base_delay * (attempt + 1)
+                await self.send_log(f"{retry_message}，{delay}秒后重试... ({attempt + 1}/{max_retries})", "warning")
+                await asyncio.sleep(delay)
+            else:
+                break
+        
+        breaker.trip()
+        if fallback_enabled():
+            return await self.use_fallback_tools(last_error)
+        raise Exception(last_error)
+    
+    async def use_fallback_tools(self, reason: str):
+        """MCP不可用时改用本地数据库的同名数据工具，熔断器恢复后重新连接MCP"""
+        tools = build_fallback_tools()
+        MultiAgentWorkflow._tools_degraded = True
+        await self.send_log(f"⚠️ {reason}，改用本地数据库工具（{len(tools)} 个），MCP恢复后自动切回", "warning")
+        return tools
+    
+    def create_llm(self, model: str = None):
+        """创建 Gemini 模型客户端，默认使用 GEMINI_MODEL"""
+        if os.getenv("LLM_BACKEND", "gemini") == "fake":
+            # 离线基准：确定性的假模型，无需API密钥
+            from offline_backend import create_fake_llm
+            return create_fake_llm(model)
+        
+        if not os.getenv("GOOGLE_API_KEY"):
+            raise Exception("GOOGLE_API_KEY 未设置")
+        
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        
+        return ChatGoogleGenerativeAI(
+            model=model or default_model(),
+            timeout=60,  # 设置模型调用超时
+            max_retries=2,  # 设置模型重试次数
+            temperature=0.1  # 降低随机性
+        )
+    
+    async def acquire_shared_resources(self):
+        """
+        获取共享的工具池和各角色的模型，首次调用时建立连接
+        
+        Returns:
+            (工具列表, {角色: 模型客户端})
+        """
+        if MultiAgentWorkflow._shared_lock is None:
+            MultiAgentWorkflow._shared_lock = asyncio.Lock()
+        
+        async with MultiAgentWorkflow._shared_lock:
+            # 降级期间熔断器进入半开后，下一个工作流重新连接MCP
+            reconnect = MultiAgentWorkflow._tools_degraded and get_mcp_breaker().state != "open"
+            if MultiAgentWorkflow._shared_tools is None or reconnect:
+                tools = await self.connect_mcp_tools()
+                tool_cache = get_tool_cache()
+                if tool_cache is not None:
+                    # 工具结果按 (工具, 参数, 截止日期) 缓存，多worker部署时跨进程共享
+                    tools = cache_tool_results(tools, tool_cache)
+                MultiAgentWorkflow._shared_tools = tools
+            else:
+                await self.send_log(f"♻️ 复用共享MCP工具池 ({len(MultiAgentWorkflow._shared_tools)} 个工具)", "info")
+            
+            # 按角色路由模型，同名模型共享一个客户端
+            models = resolve_agent_models()
+            missing = [model for model in dict.fromkeys(models.values())
+                       if model not in MultiAgentWorkflow._shared_llms]
+            if missing:
+                # 初始化 Gemini 模型
+                await self.send_log(f"正在初始化 Gemini 模型（{', '.join(missing)}）...", "info")
+                for model in missing:
+                    MultiAgentWorkflow._shared_llms[model] = self.create_llm(model)
+                if len(set(models.values())) > 1:
+                    await self.send_log(f"🧭 模型路由: {describe_routing(models)}", "info")
+            llms = {role: MultiAgentWorkflow._shared_llms[model] for role, model in models.items()}
+        
+        return MultiAgentWorkflow._shared_tools, llms
+    
     async def initialize_tools_and_model(self):
-        """初始化工具和模型（带缓存和优化的连接管理）"""
+        """初始化工具和模型（进程内共享工具池和模型客户端）"""
         if self._initialized:
             await self.send_log("使用已初始化的连接", "info")
             return True
             
         try:
-            # 获取工具
-            await self.send_log("正在连接 MCP 服务器...", "info")
-            
-            # 优化的连接逻辑：减少重试次数，增加每次重试间隔
-            max_retries = 2
-            base_delay = 3
-            
-            for attempt in range(max_retries):
-                try:
-                    # 确保每次尝试都是独立的
-                    await self.send_log(f"尝试连接 MCP 服务器 ({attempt + 1}/{max_retries})", "info")
-                    
-                    # 设置适中的超时时间，确保MCP连接稳定
-                    self.tools = await asyncio.wait_for(
-                        self.client.get_tools(), 
-                        timeout=30.0  # 增加超时时间
-                    )
-                    
-                    await self.send_log(f"✅ MCP连接成功！可用工具数量: {len(self.tools)}", "success")
-                    break
-                    
-                except asyncio.TimeoutError:
-                    if attempt < max_retries - 1:
-                        delay = base_delay * (attempt + 1)
-                        await self.send_log(f"MCP连接超时，{delay}秒后重试... ({attempt + 1}/{max_retries})", "warning")
-                        await asyncio.sleep(delay)
-                    else:
-                        raise Exception("MCP服务器连接超时，请检查服务器状态")
-                        
-                except Exception as e:
-                    error_msg = str(e)
-                    if "session" in error_msg.lower() or "missing session id" in error_msg.lower():
-                        # 会话相关错误，稍等后重试
-                        if attempt < max_retries - 1:
-                            delay = base_delay * (attempt + 1)
-                            await self.send_log(f"MCP会话错误，{delay}秒后重试... ({attempt + 1}/{max_retries})", "warning")
-                            await asyncio.sleep(delay)
-                        else:
-                            raise Exception("MCP服务器会话管理错误，请重启MCP服务器")
-                    else:
-                        if attempt < max_retries - 1:
-                            delay = base_delay * (attempt + 1)
-                            await self.send_log(f"MCP连接失败，{delay}秒后重试... ({attempt + 1}/{max_retries}): {error_msg}", "warning")
-                            await asyncio.sleep(delay)
-                        else:
-                            raise Exception(f"MCP连接失败: {error_msg}")
-            
-            # 初始化 Gemini 模型
-            await self.send_log("正在初始化 Gemini 模型...", "info")
-            if not os.getenv("GOOGLE_API_KEY"):
-                raise Exception("GOOGLE_API_KEY 未设置")
-            
-            self.llm = ChatGoogleGenerativeAI(
-                model=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
-                timeout=60,  # 设置模型调用超时
-                max_retries=2,  # 设置模型重试次数
-                temperature=0.1  # 降低随机性
-            )
+            self.tools, self.llms = await self.acquire_shared_resources()
             
             await self.send_log("✅ 系统初始化完成", "success")
             
-            # 为所有agent设置LLM、工具和WebSocket
-            for agent in [self.fundamental_agent, self.technical_agent, 
-                         self.valuation_agent, self.summary_agent, self.investment_agent]:
-                agent.set_llm(self.llm)
+            # 为所有agent设置各自路由的LLM、工具和WebSocket
+            for role, agent in self.agents_by_role.items():
+                agent.set_llm(self.llms[role])
                 agent.set_tools(self.tools)
                 agent.set_websocket(self.websocket)
             
+            # 三个专业Agent共享结果缓存，有效窗口内复用分析结果
+            result_cache = get_shared_result_cache()
+            for agent in [self.fundamental_agent, self.technical_agent, self.valuation_agent]:
+                agent.set_result_cache(result_cache)
+            self.summary_agent.set_partial_cache(get_partial_summary_cache())
+            
+            # 技术分析Agent使用本地计算的技术指标，不再通过工具逐个获取
+            from technical_indicators import get_shared_indicator_engine
+            self.technical_agent.set_indicator_engine(get_shared_indicator_engine())
+            
+            # 基本面分析Agent使用批量加载的季度财务时点表，不再逐季度调用工具
+            from fundamental_snapshot import get_shared_snapshot_engine
+            self.fundamental_agent.set_snapshot_engine(get_shared_snapshot_engine())
+            
+            # 估值分析Agent使用预计算的估值历史分位，不再让模型从估值序列中推断区间
+            from valuation_history import get_shared_valuation_engine
+            self.valuation_agent.set_valuation_engine(get_shared_valuation_engine())
+            
             await self.send_log("Gemini 模型和Agent配置完成", "success")
             self._initialized = True
             return True
@@ -154,33 +368,81 @@ class MultiAgentWorkflow:
     async def cleanup(self):
         """清理资源"""
         try:
-            if hasattr(self.client, 'close'):
+            if MultiAgentWorkflow._shared_client is not None and hasattr(self.client, 'close'):
                 await self.client.close()
             await self.send_log("MCP连接已清理", "info")
         except Exception as e:
             await self.send_log(f"清理资源时出错: {e}", "warning")
     
-    async def router_node(self, state: MultiAgentState) -> MultiAgentState:
+    async def router_node(self, state: "MultiAgentState") -> "MultiAgentState":
         """路由节点，用于启动并行分析"""
         await self.send_log("🚀 启动并行分析流程...", "info")
         return state
     
-    async def parallel_analysis(self, state: MultiAgentState) -> MultiAgentState:
-        """并行执行三个分析agent"""
-        await self.send_log("⚡ 开始并行执行三个专业分析...", "info")
+    async def run_agent(self, agent, state: "MultiAgentState") -> "MultiAgentState":
+        """执行单个Agent并记录耗时span"""
+        with span("agent", agent.name):
+            return await agent.analyze(state)
+    
+    async def parallel_analysis(self, state: "MultiAgentState",
+                                agent_keys: List[str] = ("fundamental", "technical", "valuation"),
+                                summarize: bool = False) -> "MultiAgentState":
+        """
+        并行执行专业分析agent
+        
+        Args:
+            state: 状态字典
+            agent_keys: 要运行的专业Agent，默认三个全部运行
+            summarize: 是否在每个Agent完成后立即提炼要点（map），最后完成的Agent除外，
+                汇总节点只需把各要点合并为报告（reduce），不必再做一次完整的长上下文汇总
+        """
+        agents = [self.specialists[key] for key in agent_keys]
+        agent_names = [name for _, name in agents]
+        if len(agents) == len(self.specialists):
+            await self.send_log("⚡ 开始并行执行三个专业分析...", "info")
+        else:
+            await self.send_log(f"⚡ 开始并行执行专业分析: {'、'.join(agent_names)}", "info")
         
-        # 并行执行三个分析
-        tasks = [
-            self.fundamental_agent.analyze(state),
-            self.technical_agent.analyze(state),
-            self.valuation_agent.analyze(state)
-        ]
+        partial_tasks = []
+        remaining = len(agents)
+        stopped = False
         
-        # 等待所有分析完成
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        async def run_specialist(agent):
+            nonlocal remaining, stopped
+            try:
+                return await self.run_agent(agent, state)
+            except asyncio.CancelledError:
+                stopped = True
+                raise
+            finally:
+                remaining -= 1
+                if summarize and remaining > 0 and not stopped:
+                    # 其他Agent仍在运行，提炼要点不占用关键路径
+                    partial_tasks.append(asyncio.create_task(
+                        self.summary_agent.summarize_section(state, agent.get_result_key())))
+        
+        # 并行执行分析
+        tasks = [run_specialist(agent) for agent, _ in agents]
+        
+        try:
+            # 等待所有分析完成
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            stopped = True
+            # 要点提炼在其他Agent运行期间已经开始，等它们完成后再合并，已花费的调用不浪费
+            unfinished = [task for task in partial_tasks if not task.done()]
+            if unfinished:
+                await self.send_log(f"⏳ 等待 {len(unfinished)} 个要点提炼完成...", "info")
+                await asyncio.gather(*unfinished, return_exceptions=True)
+        finally:
+            # 分析被取消时取消全部要点提炼，不在后台继续调用模型
+            stopped = True
+            cancelled = [task for task in partial_tasks if not task.done()]
+            for task in cancelled:
+                task.cancel()
+            if cancelled:
+                await asyncio.gather(*cancelled, return_exceptions=True)
         
         # 处理结果并更新状态
-        agent_names = ["基本面分析", "技术分析", "估值分析"]
         for i, result in enumerate(results):
             if isinstance(result, Exception):
                 await self.send_log(f"❌ {agent_names[i]}失败: {result}", "error")
@@ -191,13 +453,13 @@ class MultiAgentWorkflow:
         
         return state
     
-    async def summary_agent_node(self, state: MultiAgentState) -> MultiAgentState:
+    async def summary_agent_node(self, state: "MultiAgentState") -> "MultiAgentState":
         """汇总分析节点"""
         await self.send_log("📝 开始生成综合分析报告...", "info")
         
         try:
             # 使用汇总agent进行分析
-            result_state = await self.summary_agent.analyze(state)
+            result_state = await self.run_agent(self.summary_agent, state)
             
             await self.send_log("✅ 综合分析报告生成完成", "success")
             return result_state
@@ -207,13 +469,13 @@ class MultiAgentWorkflow:
             state["summary_analysis"] = f"综合分析报告生成失败: {e}"
             return state
     
-    async def investment_agent_node(self, state: MultiAgentState) -> MultiAgentState:
+    async def investment_agent_node(self, state: "MultiAgentState") -> "MultiAgentState":
         """投资决策节点"""
         await self.send_log("💰 开始生成投资决策...", "info")
         
         try:
             # 使用投资agent进行分析
-            result_state = await self.investment_agent.analyze(state)
+            result_state = await self.run_agent(self.investment_agent, state)
             
             await self.send_log("✅ 投资决策生成完成", "success")
             return result_state
@@ -232,15 +494,63 @@ class MultiAgentWorkflow:
             }
             return state
     
-    def create_workflow(self):
+    @classmethod
+    def get_compiled_workflow(cls, kind: str = "analysis", profile: str = DEFAULT_BACKTEST_PROFILE):
+        """
+        获取已编译的工作流图（每个进程只编译一次）
+        
+        图中的节点不绑定实例，需要在 bind() 内执行，见 workflow_node
+        
+        Args:
+            kind: "analysis" 完整分析流程，"investment" 回测用的投资决策流程
+            profile: 投资决策流程的回测配置，见 BACKTEST_PROFILES
+        """
+        key = kind if kind == "analysis" or profile == DEFAULT_BACKTEST_PROFILE else f"{kind}:{profile}"
+        compiled = MultiAgentWorkflow._compiled_workflows
+        if key not in compiled:
+            if kind == "analysis":
+                compiled[key] = cls.create_workflow()
+            else:
+                compiled[key] = cls.create_investment_workflow(profile)
+        return compiled[key]
+    
+    @contextmanager
+    def bind(self):
+        """在此范围内执行的共享工作流图使用本实例"""
+        token = _active_workflow.set(self)
+        try:
+            yield self
+        finally:
+            _active_workflow.reset(token)
+    
+    async def analysis_node(self, state: "MultiAgentState") -> "MultiAgentState":
+        """完整分析流程的并行分析节点，按配置边分析边提炼要点"""
+        return await self.parallel_analysis(state, summarize=incremental_summary_enabled())
+    
+    async def warm_up(self):
+        """
+        预热：建立共享MCP工具池、创建模型客户端并编译工作流图
+        
+        服务启动时调用，之后的分析请求无需再等待连接和初始化
+        """
+        # 先直接获取共享资源，失败时把原始异常抛给调用方
+        await self.acquire_shared_resources()
+        await self.initialize_tools_and_model()
+        self.get_compiled_workflow("analysis")
+        self.get_compiled_workflow("investment")
+    
+    @staticmethod
+    def create_workflow():
         """创建工作流图"""
-        workflow = StateGraph(MultiAgentState)
+        from langgraph.graph import StateGraph, END
+        
+        workflow = StateGraph(get_state_schema())
         
         # 添加节点
-        workflow.add_node("router", self.router_node)
-        workflow.add_node("parallel_analysis", self.parallel_analysis)
-        workflow.add_node("summary", self.summary_agent_node)
-        workflow.add_node("investment", self.investment_agent_node)
+        workflow.add_node("router", traced_node("router", workflow_node("router_node")))
+        workflow.add_node("parallel_analysis", traced_node("parallel_analysis", workflow_node("analysis_node")))
+        workflow.add_node("summary", traced_node("summary", workflow_node("summary_agent_node")))
+        workflow.add_node("investment", traced_node("investment", workflow_node("investment_agent_node")))
         
         # 设置入口点
         workflow.set_entry_point("router")
@@ -274,11 +584,16 @@ class MultiAgentWorkflow:
             "current_date": datetime.datetime.now().strftime("%Y-%m-%d"),
             "current_price": 0.0,
             "historical_prices": [],
+            "indicator_snapshot": {},
             "portfolio_state": {},
             "fundamental_analysis": "",
+            "fundamental_snapshot": "",
             "technical_analysis": "",
+            "technical_indicators": "",
             "valuation_analysis": "",
+            "valuation_snapshot": "",
             "summary_analysis": "",
+            "partial_summaries": {},
             "investment_decision": "",
             "final_report": "",
             "messages": []
@@ -304,11 +619,13 @@ class MultiAgentWorkflow:
             
             # 创建并运行工作流
             await self.send_log("🔧 构建分析工作流...", "info")
-            app = self.create_workflow()
+            app = self.get_compiled_workflow("analysis")
             
             # 运行工作流
             await self.send_log("🚀 开始执行分析工作流（无超时限制）...", "info")
-            result = await app.ainvoke(initial_state)
+            with self.bind(), pinned_as_of(initial_state["current_date"]), start_trace("analysis") as trace_id:
+                await self.send_log(f"🧭 trace_id: {trace_id}", "info")
+                result = await app.ainvoke(initial_state)
             
             await self.send_log("🎉 所有分析完成！", "success")
             
@@ -336,12 +653,13 @@ class MultiAgentWorkflow:
             # await self.cleanup()
             pass
     
-    async def run(self, input_data: dict):
+    async def run(self, input_data: dict, profile: str = DEFAULT_BACKTEST_PROFILE):
         """
         简化的运行接口，用于回测系统调用
         
         Args:
             input_data: 包含分析所需数据的字典
+            profile: 回测配置，决定运行哪些专业Agent，见 BACKTEST_PROFILES
             
         Returns:
             包含投资决策的结果字典
@@ -350,7 +668,7 @@ class MultiAgentWorkflow:
             company_name = input_data.get("company_name", "未知公司")
             stock_code = input_data.get("stock_code", "unknown")
             
-            await self.send_log(f"📊 开始单次分析: {company_name} ({stock_code})", "info")
+            await self.send_log(f"📊 开始单次分析: {company_name} ({stock_code})，回测配置: {profile}", "info")
             
             # 准备状态
             state = {
@@ -360,11 +678,16 @@ class MultiAgentWorkflow:
                 "current_date": input_data.get("current_date", ""),
                 "current_price": input_data.get("current_price", 0.0),
                 "historical_prices": input_data.get("historical_prices", []),
+                "indicator_snapshot": input_data.get("indicator_snapshot", {}),
                 "portfolio_state": input_data.get("portfolio_state", {}),
                 "fundamental_analysis": "",
+                "fundamental_snapshot": "",
                 "technical_analysis": "",
+                "technical_indicators": "",
                 "valuation_analysis": "",
+                "valuation_snapshot": "",
                 "summary_analysis": "",
+                "partial_summaries": {},
                 "investment_decision": "",
                 "final_report": "",
                 "messages": []
@@ -375,11 +698,14 @@ class MultiAgentWorkflow:
                 raise Exception("系统初始化失败")
             
             # 创建简化的工作流（只到投资决策）
-            app = self.create_investment_workflow()
+            app = self.get_compiled_workflow("investment", profile)
             
             await self.send_log(f"🚀 开始单次分析（无超时限制）", "info")
             
-            result = await app.ainvoke(state)
+            # 固定数据截止日期为决策日，离线回放工具只返回当日及之前的数据
+            with self.bind(), pinned_as_of(state["current_date"]), start_trace("backtest_decision") as trace_id:
+                await self.send_log(f"🧭 trace_id: {trace_id}", "info")
+                result = await app.ainvoke(state)
             
             # 提取投资决策
             investment_decision = result.get('investment_decision', {})
@@ -427,15 +753,30 @@ class MultiAgentWorkflow:
                 }
             }
     
-    def create_investment_workflow(self):
-        """创建简化的投资决策工作流（用于回测）"""
+    @staticmethod
+    def create_investment_workflow(profile: str = DEFAULT_BACKTEST_PROFILE):
+        """
+        创建简化的投资决策工作流（用于回测）
+        
+        Args:
+            profile: 回测配置，决定并行分析节点运行哪些专业Agent
+        """
+        from langgraph.graph import StateGraph, END
+        
+        if profile not in BACKTEST_PROFILES:
+            raise ValueError(f"未知的回测配置: {profile}，可选: {', '.join(BACKTEST_PROFILES)}")
+        agent_keys = BACKTEST_PROFILES[profile]["agents"]
+        
+        async def profile_analysis(state: "MultiAgentState") -> "MultiAgentState":
+            return await current_workflow().parallel_analysis(state, agent_keys)
+        
         # 创建状态图
-        workflow = StateGraph(MultiAgentState)
+        workflow = StateGraph(get_state_schema())
         
         # 添加节点
-        workflow.add_node("router", self.router_node)
-        workflow.add_node("parallel_analysis", self.parallel_analysis)
-        workflow.add_node("investment_node", self.investment_agent_node)
+        workflow.add_node("router", traced_node("router", workflow_node("router_node")))
+        workflow.add_node("parallel_analysis", traced_node("parallel_analysis", profile_analysis))
+        workflow.add_node("investment_node", traced_node("investment_node", workflow_node("investment_agent_node")))
         
         # 设置入口点
         workflow.set_entry_point("router")
@@ -0,0 +1,264 @@
+"""
+离线基准后端
+
+确定性的假聊天模型和进程内桩工具，工具名称和参数与MCP数据工具一致，
+返回固定的Markdown结果。用于在没有Gemini和MCP服务器的情况下测量框架自身的开销：
+
+- 假模型: 设置 LLM_BACKEND=fake，工作流用 FakeChatModel 代替 Gemini
+- 桩工具: 设置 MCP_BACKEND=stub，工作流直接加载 build_stub_tools()
+
+模型和工具的模拟延迟可通过 FAKE_LLM_LATENCY、FAKE_TOOL_LATENCY（秒）调整，默认为0
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# 假模型依次调用的工具及参数，只调用已绑定的工具
+TOOL_PLAN = [
+    ("get_stock_basic_info", lambda code: {"code": code}),
+    ("get_historical_k_data", lambda code: {"code": code, "start_date": "2024-01-01", "end_date": "2024-06-28"}),
+    ("get_profit_data", lambda code: {"code": code, "year": "2024", "quarter": 1}),
+    ("get_valuation_metrics", lambda code: {"code": code}),
+    ("get_latest_trading_date", lambda code: {}),
+]
+
+ACTIONS = ["BUY", "HOLD", "SELL"]
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(m.content for m in messages if isinstance(m.content, str))
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _stock_code(prompt: str) -> str:
+    match = re.search(r'(?:sh|sz)\.\d{6}', prompt)
+    return match.group(0) if match else "sh.600519"
+
+
+def build_report_text(prompt: str, lines: int = 12) -> str:
+    """生成带标题、要点和结论的固定分析文本"""
+    body = [f"## {_stock_code(prompt)} 分析报告", ""]
+    for index in range(lines):
+        body.append(f"- 要点{index + 1}: 指标保持稳定，**趋势**向好，估值处于合理区间")
+    body += ["", "**结论**: 基本面稳健，建议持有，目标价上浮10%，注意行业政策风险"]
+    return "\n".join(body)
+
+
+def build_decision_text(prompt: str) -> str:
+    """生成JSON投资决策，动作由提示词内容确定，相同输入得到相同决策"""
+    action = ACTIONS[zlib.crc32(prompt.encode("utf-8")) % len(ACTIONS)]
+    decision = {
+        "action": action,
+        "confidence": 0.7,
+        "target_price": None,
+        "stop_loss": None,
+        "position_size": 0.3 if action != "HOLD" else 0.0,
+        "holding_period": "medium",
+        "risk_level": "medium",
+        "reasons": ["离线基准的固定决策"]
+    }
+    return f"```json\n{json.dumps(decision, ensure_ascii=False)}\n```"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    确定性的假聊天模型
+
+    绑定工具时，前 tool_rounds 轮按 TOOL_PLAN 发起工具调用，之后返回最终文本；
+    提示词要求JSON时返回投资决策，否则返回分析报告。流式输出按 chunk_size 切块
+    """
+
+    latency: float = 0.0
+    tool_rounds: int = 1
+    report_lines: int = 12
+    chunk_size: int = 40
+    model_name: str = "fake-chat-model"
+    tool_names: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(t, "name", None) or getattr(t, "__name__", str(t)) for t in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    def _next_tool_call(self, messages: List[BaseMessage], prompt: str) -> Optional[Dict[str, Any]]:
+        rounds = sum(isinstance(m, ToolMessage) for m in messages)
+        if rounds >= self.tool_rounds:
+            return None
+        plan = [(name, args) for name, args in TOOL_PLAN if name in self.tool_names]
+        if not plan:
+            return None
+        name, make_args = plan[rounds % len(plan)]
+        return {"name": name, "args": make_args(_stock_code(prompt)), "id": f"call_{rounds + 1}"}
+
+    def _build_message(self, messages: List[BaseMessage]) -> AIMessage:
+        prompt = _prompt_text(messages)
+        usage = {"input_tokens": _estimate_tokens(prompt)}
+        tool_call = self._next_tool_call(messages, prompt)
+        if tool_call:
+            usage.update(output_tokens=1, total_tokens=usage["input_tokens"] + 1)
+            return AIMessage(content="", tool_calls=[tool_call], usage_metadata=usage)
+        if "JSON" in prompt:
+            content = build_decision_text(prompt)
+        else:
+            content = build_report_text(prompt, self.report_lines)
+        usage.update(output_tokens=_estimate_tokens(content),
+                     total_tokens=usage["input_tokens"] + _estimate_tokens(content))
+        return AIMessage(content=content, usage_metadata=usage)
+
+    def _chunks(self, message: AIMessage) -> Iterator[ChatGenerationChunk]:
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]),
+                                   "id": call["id"], "index": 0}],
+                usage_metadata=message.usage_metadata))
+            return
+        content = message.content
+        for start in range(0, len(content), self.chunk_size):
+            last = start + self.chunk_size >= len(content)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=content[start:start + self.chunk_size],
+                usage_metadata=message.usage_metadata if last else None))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._build_message(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._build_message(messages))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        for chunk in self._chunks(self._build_message(messages)):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self._build_message(messages)):
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def create_fake_llm(model_name: Optional[str] = None) -> FakeChatModel:
+    """按环境变量创建假模型，model_name 仅用于区分按Agent路由的模型"""
+    return FakeChatModel(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+                         model_name=model_name or "fake-chat-model")
+
+
+def _canned_output(name: str, args: Dict[str, Any]) -> str:
+    """工具的固定输出：带参数回显的Markdown表格"""
+    code = args.get("code") or "sh.600519"
+    rows = ["| date | code | open | close | volume |", "|---|---|---|---|---|"]
+    for day in range(1, 11):
+        price = 100 + day
+        rows.append(f"| 2024-06-{day:02d} | {code} | {price - 0.5:.2f} | {price:.2f} | {day * 1000} |")
+    return f"**{name}**\n\n" + "\n".join(rows)
+
+
+def synthetic_k_data(code: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """合成的日K线（工作日，价格和估值由股票代码和日期确定），供离线基准的本地指标和估值计算使用"""
+    from datetime import datetime, timedelta
+
+    seed = zlib.crc32(code.encode("utf-8")) % 50
+    day = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    rows = []
+    while day <= end:
+        if day.weekday() < 5:
+            ordinal = day.toordinal()
+            close = 100.0 + seed + 10 * ((ordinal % 40) / 40) + (ordinal % 7) * 0.3
+            rows.append({"date": day.strftime("%Y-%m-%d"), "code": code, "open": close - 0.5,
+                         "high": close + 1.0, "low": close - 1.2, "close": close,
+                         "volume": 1e6 + (ordinal % 11) * 5e4,
+                         "peTTM": close / 4.0, "pbMRQ": close / 20.0,
+                         "psTTM": close / 12.0, "pcfNcfTTM": close / 5.0 + (ordinal % 13)})
+        day += timedelta(days=1)
+    return rows
+
+
+def synthetic_quarterly_data(code: str, start_year: int, end_year: int) -> List[Dict[str, Any]]:
+    """合成的季度财务数据（各类型字段取固定比例，发布日期按法定披露期限），供离线基准的基本面快照使用"""
+    from fundamental_snapshot import SNAPSHOT_FIELDS
+
+    seed = zlib.crc32(code.encode("utf-8")) % 10
+    stat_dates = {1: "03-31", 2: "06-30", 3: "09-30", 4: "12-31"}
+    pub_dates = {1: "04-28", 2: "08-28", 3: "10-28", 4: "04-28"}
+    rows = []
+    for year in range(start_year, end_year + 1):
+        for quarter in range(1, 5):
+            pub_date = f"{year + 1 if quarter == 4 else year}-{pub_dates[quarter]}"
+            for kind, (_, fields) in SNAPSHOT_FIELDS.items():
+                row = {"code": code, "pubDate": pub_date, "statDate": f"{year}-{stat_dates[quarter]}",
+                       "kind": kind, "year": year, "quarter": quarter}
+                for index, (field, _, fmt) in enumerate(fields):
+                    base = 1e9 * quarter if fmt == "yi" else 0.1 + 0.01 * (seed + index + quarter)
+                    row[field] = str(round(base, 6))
+                rows.append(row)
+    return rows
+
+
+def build_stub_tools(latency: Optional[float] = None) -> list:
+    """
+    构建进程内桩工具（名称和参数与MCP服务器一致，返回固定结果）
+
+    Args:
+        latency: 每次调用的模拟延迟（秒），默认读取 FAKE_TOOL_LATENCY
+
+    Returns:
+        LangChain工具列表
+    """
+    from langchain_core.tools import StructuredTool
+    from replay_mcp_server import REPLAY_TOOLS
+
+    if latency is None:
+        latency = float(os.getenv("FAKE_TOOL_LATENCY", "0"))
+
+    def make_tool(func):
+        name = func.__name__
+
+        async def call(**kwargs) -> str:
+            if latency:
+                await asyncio.sleep(latency)
+            return _canned_output(name, kwargs)
+
+        schema_tool = StructuredTool.from_function(func=func, name=name)
+        return StructuredTool.from_function(
+            coroutine=call, name=name, description=func.__doc__.strip(),
+            args_schema=schema_tool.args_schema
+        )
+
+    return [make_tool(func) for func in REPLAY_TOOLS]
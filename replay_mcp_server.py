@@ -0,0 +1,499 @@
+"""
+离线回放MCP服务器
+
+实现与 a_share_data_provider 相同名称和参数的数据工具，数据来自本地
+market_data_store，并固定在回测的截止日期（as-of），保证回测中工具调用
+快速、可复现、不穿越未来数据，且无需网络。技术指标、均线、PEG和同行业估值比较
+由本地K线和财务数据计算，同样只使用截止日期及之前的数据。
+
+两种使用方式：
+- 独立运行MCP服务器: python replay_mcp_server.py --as_of 2024-06-28 --port 3100
+- 进程内工具: 设置 MCP_BACKEND=replay，工作流直接加载 build_replay_tools()
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from market_data_store import MarketDataStore, clamp_to_as_of, get_as_of_date, get_default_store
+
+# 计算指标时在开始日期之前多加载的自然日，覆盖MACD等指数平均的预热期
+INDICATOR_WARMUP_DAYS = 120
+
+TECHNICAL_INDICATORS = ("MACD", "RSI", "KDJ", "BOLL", "WR", "ATR")
+MOVING_AVERAGE_PERIODS = [5, 10, 20, 50, 120, 250]
+
+
+# 独立运行时通过命令行固定的截止日期；进程内使用时由上下文中的 AS_OF_DATE 决定
+_server_as_of: Optional[str] = None
+_store: Optional[MarketDataStore] = None
+
+
+def _get_store() -> MarketDataStore:
+    return _store or get_default_store()
+
+
+def _as_of() -> Optional[str]:
+    return get_as_of_date() or _server_as_of
+
+
+def _to_markdown(rows: List[Dict[str, Any]], columns: Optional[List[str]] = None) -> str:
+    """将记录列表格式化为Markdown表格"""
+    import pandas as pd
+
+    if not rows:
+        return "未找到数据"
+    df = pd.DataFrame(rows)
+    if columns:
+        df = df[[col for col in columns if col in df.columns]]
+    return df.to_markdown(index=False)
+
+
+def get_historical_k_data(code: str, start_date: str, end_date: str,
+                          frequency: str = "d", adjust_flag: str = "3") -> str:
+    """获取中国A股股票的历史K线（开盘价、最高价、最低价、收盘价、成交量）数据。
+
+    Args:
+        code: 股票代码 (例如, 'sh.600000', 'sz.000001')
+        start_date: 开始日期 'YYYY-MM-DD'
+        end_date: 结束日期 'YYYY-MM-DD'
+        frequency: 数据频率。'd'(日), 'w'(周), 'm'(月)。默认为 'd'
+        adjust_flag: 复权类型。'1'(后复权), '2'(前复权), '3'(不复权)。默认为 '3'
+    """
+    import pandas as pd
+
+    if frequency not in ("d", "w", "m"):
+        return f"错误: 离线数据源不支持频率 '{frequency}'，仅支持 'd'、'w'、'm'"
+
+    rows = _get_store().get_k_data(code, start_date, end_date, adjustflag=adjust_flag, as_of=_as_of())
+    if not rows:
+        return f"未找到 {code} 在 {start_date} 至 {clamp_to_as_of(end_date, _as_of())} 的K线数据"
+
+    columns = ["date", "code", "open", "high", "low", "close", "preclose", "volume", "amount",
+               "turn", "pctChg"]
+    if frequency == "d":
+        return _to_markdown(rows, columns)
+
+    df = pd.DataFrame(rows)
+    df["date"] = pd.to_datetime(df["date"])
+    rule = "W-FRI" if frequency == "w" else "ME"
+    resampled = df.set_index("date").resample(rule).agg({
+        "code": "last", "open": "first", "high": "max", "low": "min", "close": "last",
+        "volume": "sum", "amount": "sum", "turn": "sum",
+    }).dropna(subset=["close"])
+    resampled["pctChg"] = resampled["close"].pct_change() * 100
+    resampled = resampled.reset_index()
+    resampled["date"] = resampled["date"].dt.strftime("%Y-%m-%d")
+    return resampled.to_markdown(index=False)
+
+
+def get_stock_basic_info(code: str, fields: Optional[List[str]] = None) -> str:
+    """获取给定中国A股股票的基本信息。
+
+    Args:
+        code: 股票代码
+        fields: 指定需要返回的字段 (例如, 'code_name', 'industry')
+    """
+    basic = dict(_get_store().get_stock_basic(code) or {})
+    industry = _get_store().get_stock_industry(code)
+    if industry:
+        basic.update({k: v for k, v in industry[0].items() if k not in basic})
+    if not basic:
+        return f"未找到 {code} 的基本信息"
+    return _to_markdown([basic], fields)
+
+
+def get_dividend_data(code: str, year: str, year_type: str = "report") -> str:
+    """获取指定股票和年份的分红信息。
+
+    Args:
+        code: 股票代码
+        year: 查询年份 (例如, '2023')
+        year_type: 年份类型。'report'(预案公告年份), 'operate'(除权除息年份)。默认为 'report'
+    """
+    try:
+        rows = _get_store().get_dividends(code, int(year), as_of=_as_of(), year_type=year_type)
+    except ValueError as e:
+        return str(e)
+    return _to_markdown(rows)
+
+
+def _make_quarterly_tool(kind: str, name: str, title: str) -> Callable[..., str]:
+    def tool(code: str, year: str, quarter: int) -> str:
+        row = _get_store().get_quarterly(kind, code, int(year), int(quarter), as_of=_as_of())
+        if row is None:
+            return f"未找到 {code} {year}年第{quarter}季度的{title}数据（截至 {_as_of() or '最新'} 尚未发布或未同步）"
+        return _to_markdown([row])
+
+    tool.__name__ = name
+    tool.__doc__ = f"""获取股票的季度{title}数据。
+
+    Args:
+        code: 股票代码
+        year: 4位数字年份
+        quarter: 季度 (1, 2, 3, or 4)
+    """
+    return tool
+
+
+get_profit_data = _make_quarterly_tool("profit", "get_profit_data", "盈利能力")
+get_operation_data = _make_quarterly_tool("operation", "get_operation_data", "运营能力")
+get_growth_data = _make_quarterly_tool("growth", "get_growth_data", "成长能力")
+get_balance_data = _make_quarterly_tool("balance", "get_balance_data", "偿债能力（资产负债表）")
+get_cash_flow_data = _make_quarterly_tool("cash_flow", "get_cash_flow_data", "现金流量")
+get_dupont_data = _make_quarterly_tool("dupont", "get_dupont_data", "杜邦分析")
+
+
+def get_stock_industry(code: Optional[str] = None) -> str:
+    """获取指定股票或所有股票的行业分类。
+
+    本地只同步最新的行业分类（updateDate 列为分类更新日期），不支持按历史日期查询。
+
+    Args:
+        code: 股票代码。如果为空，则获取所有股票
+    """
+    return _to_markdown(_get_store().get_stock_industry(code))
+
+
+def get_valuation_metrics(code: str, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None) -> str:
+    """获取股票的估值指标数据，包括市盈率(P/E)、市净率(P/B)、市销率(P/S)等的实时数据和历史趋势。
+
+    Args:
+        code: 股票代码 (例如, 'sh.600000', 'sz.000001')
+        start_date: 开始日期 'YYYY-MM-DD'。默认为最近1年
+        end_date: 结束日期 'YYYY-MM-DD'。默认为当前日期
+    """
+    import pandas as pd
+
+    end_date = clamp_to_as_of(end_date or datetime.now().strftime("%Y-%m-%d"), _as_of())
+    if not start_date:
+        start_date = (datetime.strptime(end_date, "%Y-%m-%d") - timedelta(days=365)).strftime("%Y-%m-%d")
+
+    rows = _get_store().get_k_data(code, start_date, end_date, as_of=_as_of())
+    if not rows:
+        return f"未找到 {code} 在 {start_date} 至 {end_date} 的估值数据"
+
+    metrics = ["peTTM", "pbMRQ", "psTTM", "pcfNcfTTM"]
+    df = pd.DataFrame(rows)[["date"] + metrics]
+    summary = []
+    for metric in metrics:
+        series = df[metric].dropna()
+        if series.empty:
+            continue
+        current = series.iloc[-1]
+        summary.append({
+            "指标": metric,
+            "当前值": round(current, 4),
+            "历史均值": round(series.mean(), 4),
+            "最小值": round(series.min(), 4),
+            "最大值": round(series.max(), 4),
+            "当前分位数": f"{(series <= current).mean():.1%}",
+        })
+
+    recent = df.tail(10).to_markdown(index=False)
+    return (f"## {code} 估值指标 ({start_date} 至 {end_date})\n\n"
+            f"{_to_markdown(summary)}\n\n### 最近10个交易日\n\n{recent}")
+
+
+def _load_with_warmup(code: str, start_date: str, end_date: str, warmup_days: int) -> List[Dict[str, Any]]:
+    """加载 [start_date - warmup_days, end_date] 的日K线，结束日期截断到截止日期"""
+    warmup_start = (datetime.strptime(start_date, "%Y-%m-%d") - timedelta(days=warmup_days)).strftime("%Y-%m-%d")
+    rows = _get_store().get_k_data(code, warmup_start, end_date, as_of=_as_of())
+    return [row for row in rows if row.get("close") is not None]
+
+
+def _round_rows(rows: List[Dict[str, Any]], digits: int = 2) -> List[Dict[str, Any]]:
+    import math
+
+    return [{key: (None if isinstance(value, float) and math.isnan(value) else
+                   round(value, digits) if isinstance(value, float) else value)
+             for key, value in row.items()} for row in rows]
+
+
+def get_technical_indicators(code: str, start_date: str, end_date: str,
+                             indicators: Optional[List[str]] = None) -> str:
+    """计算股票的技术指标，包括MACD、RSI、KDJ、布林带、威廉指标、ATR等。
+
+    Args:
+        code: 股票代码 (例如, 'sh.600000', 'sz.000001')
+        start_date: 开始日期 'YYYY-MM-DD'
+        end_date: 结束日期 'YYYY-MM-DD'
+        indicators: 指标列表，可选 ['MACD', 'RSI', 'KDJ', 'BOLL', 'WR', 'ATR']。如果为空，则计算所有支持的指标
+    """
+    import numpy as np
+    from technical_indicators import bollinger, kdj, macd, rolling_max, rolling_min, rsi, sma
+
+    requested = [name.upper() for name in indicators] if indicators else list(TECHNICAL_INDICATORS)
+    unsupported = [name for name in requested if name not in TECHNICAL_INDICATORS]
+    requested = [name for name in requested if name in TECHNICAL_INDICATORS]
+    if not requested:
+        return f"错误: 离线数据源不支持指标 {', '.join(unsupported)}，可选 {', '.join(TECHNICAL_INDICATORS)}"
+
+    rows = _load_with_warmup(code, start_date, end_date, INDICATOR_WARMUP_DAYS)
+    if not rows:
+        return f"未找到 {code} 在 {start_date} 至 {clamp_to_as_of(end_date, _as_of())} 的K线数据"
+
+    close = np.array([float(row["close"]) for row in rows])
+    high = np.array([float(row.get("high") or row["close"]) for row in rows])
+    low = np.array([float(row.get("low") or row["close"]) for row in rows])
+    columns: Dict[str, np.ndarray] = {}
+    if "MACD" in requested:
+        columns.update({f"MACD_{key.upper()}": values for key, values in macd(close).items()})
+    if "RSI" in requested:
+        columns.update({f"RSI{period}": rsi(close, period) for period in (6, 12, 24)})
+    if "KDJ" in requested:
+        columns.update({f"KDJ_{key.upper()}": values for key, values in kdj(high, low, close).items()})
+    if "BOLL" in requested:
+        columns.update({f"BOLL_{key.upper()}": values for key, values in bollinger(close).items()})
+    if "WR" in requested:
+        highest, lowest = rolling_max(high, 14), rolling_min(low, 14)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            columns["WR14"] = np.where(highest > lowest, (highest - close) / (highest - lowest) * 100, np.nan)
+    if "ATR" in requested:
+        previous = np.concatenate([[close[0]], close[:-1]])
+        true_range = np.maximum(high - low, np.maximum(np.abs(high - previous), np.abs(low - previous)))
+        columns["ATR14"] = sma(true_range, 14)
+
+    table = [dict({"date": row["date"], "close": float(row["close"])},
+                  **{name: float(values[i]) for name, values in columns.items()})
+             for i, row in enumerate(rows) if row["date"] >= start_date]
+    if not table:
+        return f"未找到 {code} 在 {start_date} 至 {clamp_to_as_of(end_date, _as_of())} 的K线数据"
+    note = f"\n\n注: 离线数据源不支持 {', '.join(unsupported)}" if unsupported else ""
+    return f"## {code} 技术指标 ({table[0]['date']} 至 {table[-1]['date']})\n\n{_to_markdown(_round_rows(table))}{note}"
+
+
+def get_moving_averages(code: str, start_date: str, end_date: str,
+                        periods: Optional[List[int]] = None) -> str:
+    """计算多种周期的移动平均线（5、10、20、50、120、250日），包括SMA和EMA。
+
+    Args:
+        code: 股票代码
+        start_date: 开始日期 'YYYY-MM-DD'
+        end_date: 结束日期 'YYYY-MM-DD'
+        periods: 移动平均线周期列表，如[5, 10, 20, 50]。默认使用常用周期[5, 10, 20, 50, 120, 250]
+    """
+    import numpy as np
+    from technical_indicators import ema, sma
+
+    periods = sorted({int(period) for period in periods or MOVING_AVERAGE_PERIODS if int(period) > 0})
+    # 250日均线需要约一年的交易日预热
+    rows = _load_with_warmup(code, start_date, end_date, max(periods) * 3 // 2 + 30)
+    if not rows:
+        return f"未找到 {code} 在 {start_date} 至 {clamp_to_as_of(end_date, _as_of())} 的K线数据"
+
+    close = np.array([float(row["close"]) for row in rows])
+    columns = {}
+    for period in periods:
+        columns[f"SMA{period}"] = sma(close, period)
+        columns[f"EMA{period}"] = ema(close, period)
+    table = [dict({"date": row["date"], "close": float(row["close"])},
+                  **{name: float(values[i]) for name, values in columns.items()})
+             for i, row in enumerate(rows) if row["date"] >= start_date]
+    if not table:
+        return f"未找到 {code} 在 {start_date} 至 {clamp_to_as_of(end_date, _as_of())} 的K线数据"
+
+    # 最后一个交易日的均线位置和排列
+    last = table[-1]
+    analysis = []
+    values = [(period, last[f"SMA{period}"]) for period in periods if not np.isnan(last[f"SMA{period}"])]
+    for period, value in values:
+        analysis.append(f"- 收盘价 {last['close']:.2f} {'高于' if last['close'] >= value else '低于'} "
+                        f"SMA{period} ({value:.2f})")
+    if len(values) >= 2:
+        ordered = [value for _, value in values]
+        if all(a > b for a, b in zip(ordered, ordered[1:])):
+            analysis.append("- 均线多头排列（短期均线依次在长期均线之上）")
+        elif all(a < b for a, b in zip(ordered, ordered[1:])):
+            analysis.append("- 均线空头排列（短期均线依次在长期均线之下）")
+        else:
+            analysis.append("- 均线交织，趋势不明确")
+    return (f"## {code} 移动平均线 ({table[0]['date']} 至 {last['date']})\n\n"
+            f"### 均线分析（{last['date']}）\n\n" + "\n".join(analysis) +
+            f"\n\n{_to_markdown(_round_rows(table))}")
+
+
+def _latest_k_row(code: str, date: str, lookback_days: int = 30) -> Optional[Dict[str, Any]]:
+    """截至date（含）最近一个交易日的K线"""
+    start = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=lookback_days)).strftime("%Y-%m-%d")
+    rows = _get_store().get_k_data(code, start, date, as_of=_as_of())
+    return rows[-1] if rows else None
+
+
+def calculate_peg_ratio(code: str, year: str, quarter: int) -> str:
+    """计算PEG比率（市盈率相对盈利增长比率），PEG = PE / 净利润增长率。
+
+    Args:
+        code: 股票代码
+        year: 4位数字年份，如'2024'
+        quarter: 季度 (1, 2, 3, or 4)
+    """
+    growth = _get_store().get_quarterly("growth", code, int(year), int(quarter), as_of=_as_of())
+    if growth is None:
+        return f"未找到 {code} {year}年第{quarter}季度的成长能力数据（截至 {_as_of() or '最新'} 尚未发布或未同步）"
+    date = clamp_to_as_of(datetime.now().strftime("%Y-%m-%d"), _as_of())
+    row = _latest_k_row(code, date)
+    if row is None or row.get("peTTM") is None:
+        return f"未找到 {code} 截至 {date} 的市盈率数据"
+
+    pe = float(row["peTTM"])
+    try:
+        growth_rate = float(growth.get("YOYNI")) * 100
+    except (TypeError, ValueError):
+        return f"{code} {year}年第{quarter}季度缺少净利润同比增长率（YOYNI），无法计算PEG"
+
+    result = [{"项目": "市盈率(TTM)", "数值": f"{pe:.2f}（{row['date']}）"},
+              {"项目": "净利润同比增长率", "数值": f"{growth_rate:.2f}%（报告期 {growth.get('statDate', '')}）"}]
+    if pe <= 0 or growth_rate <= 0:
+        verdict = "市盈率或净利润增长率不为正，PEG不适用，应结合其他估值方法判断"
+    else:
+        peg = pe / growth_rate
+        result.append({"项目": "PEG", "数值": f"{peg:.2f}"})
+        if peg < 0.5:
+            verdict = "PEG < 0.5，相对盈利增长明显低估"
+        elif peg < 1:
+            verdict = "PEG < 1，估值低于盈利增长，相对合理偏低"
+        elif peg <= 2:
+            verdict = "1 ≤ PEG ≤ 2，估值与增长大致匹配，偏高时需关注增长持续性"
+        else:
+            verdict = "PEG > 2，估值明显高于盈利增长，存在高估风险"
+    return f"## {code} PEG比率\n\n{_to_markdown(result)}\n\n**估值判断**: {verdict}"
+
+
+def compare_industry_valuation(code: str, date: Optional[str] = None) -> str:
+    """进行同行业估值比较分析，对比目标股票与同行业其他公司的估值水平。
+
+    Args:
+        code: 目标股票代码
+        date: 比较基准日期 'YYYY-MM-DD'。默认为最新交易日
+    """
+    import pandas as pd
+
+    store = _get_store()
+    industry_rows = store.get_stock_industry(code)
+    industry = industry_rows[0].get("industry") if industry_rows else None
+    if not industry:
+        return f"未找到 {code} 的行业分类"
+    date = clamp_to_as_of(date or datetime.now().strftime("%Y-%m-%d"), _as_of())
+    start = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=30)).strftime("%Y-%m-%d")
+    # 只比较本地已同步K线的同行业股票
+    k_data = store.get_k_data_many(store.get_industry_codes(industry), start, date, as_of=_as_of())
+    latest = {peer: rows[-1] for peer, rows in k_data.items() if rows}
+    if code not in latest:
+        return f"未找到 {code} 截至 {date} 的估值数据"
+
+    metrics = {"peTTM": "市盈率(TTM)", "pbMRQ": "市净率(MRQ)", "psTTM": "市销率(TTM)"}
+    df = pd.DataFrame([dict({"code": peer}, **{m: row.get(m) for m in metrics}) for peer, row in latest.items()])
+    summary = []
+    for metric, label in metrics.items():
+        # 负值（亏损）不参与行业统计
+        series = df[metric].dropna()
+        series = series[series > 0]
+        target = latest[code].get(metric)
+        if series.empty or target is None:
+            continue
+        rank = (series <= target).mean() if target > 0 else None
+        if rank is None:
+            level = "为负，不参与比较"
+        elif rank <= 0.3:
+            level = "低于多数同行"
+        elif rank >= 0.7:
+            level = "高于多数同行"
+        else:
+            level = "处于行业中游"
+        summary.append({
+            "指标": label,
+            "目标值": round(float(target), 2),
+            "行业中位数": round(float(series.median()), 2),
+            "行业均值": round(float(series.mean()), 2),
+            "行业分位": f"{rank:.0%}" if rank is not None else "-",
+            "评价": level,
+        })
+    peers = df.sort_values("peTTM").round(2).to_markdown(index=False)
+    return (f"## {code} 同行业估值比较（{industry}，{len(latest)} 家有本地数据，截至 {date}）\n\n"
+            f"{_to_markdown(summary)}\n\n### 同行业估值\n\n{peers}")
+
+
+def get_latest_trading_date() -> str:
+    """获取最近的交易日期。"""
+    return _get_store().get_latest_trading_date(as_of=_as_of()) or "未找到交易日数据"
+
+
+def get_market_analysis_timeframe(period: str = "recent") -> str:
+    """获取适合市场分析的时间范围。
+
+    Args:
+        period: 时间范围类型。'recent'(最近1-2月), 'quarter'(最近一季度), 'half_year'(最近半年), 'year'(最近一年)。默认为 'recent'
+    """
+    end = datetime.strptime(_as_of() or datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
+    days = {"recent": 60, "quarter": 90, "half_year": 182, "year": 365}.get(period, 60)
+    start = end - timedelta(days=days)
+    return f"{start.strftime('%Y-%m-%d')} 至 {end.strftime('%Y-%m-%d')}"
+
+
+REPLAY_TOOLS: List[Callable[..., str]] = [
+    get_historical_k_data,
+    get_stock_basic_info,
+    get_dividend_data,
+    get_profit_data,
+    get_operation_data,
+    get_growth_data,
+    get_balance_data,
+    get_cash_flow_data,
+    get_dupont_data,
+    get_stock_industry,
+    get_valuation_metrics,
+    get_technical_indicators,
+    get_moving_averages,
+    calculate_peg_ratio,
+    compare_industry_valuation,
+    get_latest_trading_date,
+    get_market_analysis_timeframe,
+]
+
+
+def build_replay_tools(store: Optional[MarketDataStore] = None) -> list:
+    """
+    构建进程内的LangChain工具（名称和参数与MCP服务器一致）
+
+    Args:
+        store: 数据存储，默认使用共享的本地存储
+
+    Returns:
+        LangChain工具列表
+    """
+    from langchain_core.tools import StructuredTool
+
+    global _store
+    if store is not None:
+        _store = store
+    return [
+        StructuredTool.from_function(func=func, name=func.__name__, description=func.__doc__.strip())
+        for func in REPLAY_TOOLS
+    ]
+
+
+def create_server(host: str = "0.0.0.0", port: int = 3100):
+    """创建离线回放MCP服务器"""
+    from mcp.server.fastmcp import FastMCP
+
+    server = FastMCP("a_share_data_provider_replay", host=host, port=port, stateless_http=True)
+    for func in REPLAY_TOOLS:
+        server.add_tool(func, name=func.__name__, description=func.__doc__.strip())
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="离线回放MCP服务器")
+    parser.add_argument("--as_of", help="固定的截止日期 YYYY-MM-DD，默认不限制")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=3100)
+    args = parser.parse_args()
+
+    _server_as_of = args.as_of
+    print(f"🚀 启动离线回放MCP服务器: http://{args.host}:{args.port}/mcp/")
+    print(f"📅 截止日期: {_server_as_of or '不限制'}")
+    print(f"🗄️ 数据库: {_get_store().db_path}")
+    create_server(args.host, args.port).run(transport="streamable-http")
@@ -0,0 +1,110 @@
+"""
+报告产物协议
+
+各Agent的分析结果、综合报告和投资决策作为产物（artifact）在WebSocket上只发送一次：
+按状态键和内容生成引用ID，正文切成固定大小的分块帧；最终报告帧只列出产物ID，
+由前端按ID拼装分块、渲染一次并组装下载报告。帧格式：
+
+- 产物分块: {"type": "artifact", "id", "title", "seq", "total", "chunk", "timestamp"}
+- 最终报告: {"type": "report", "artifacts": [id, ...], "message", "timestamp"}
+
+分块大小可通过 WS_ARTIFACT_CHUNK_SIZE（字符数）调整，默认16384
+"""
+
+import datetime
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+ARTIFACT_CHUNK_SIZE = int(os.getenv("WS_ARTIFACT_CHUNK_SIZE", "16384"))
+
+# 最终报告包含的状态键及标题，按报告中的顺序排列
+REPORT_SECTIONS: List[Tuple[str, str]] = [
+    ("fundamental_analysis", "基本面分析"),
+    ("technical_analysis", "技术面分析"),
+    ("valuation_analysis", "估值分析"),
+    ("summary_analysis", "综合报告"),
+    ("investment_decision", "投资决策"),
+]
+SECTION_TITLES = dict(REPORT_SECTIONS)
+
+# 由各Agent在执行结束时自行发送的产物
+AGENT_SECTIONS = {"fundamental_analysis", "technical_analysis", "valuation_analysis"}
+
+
+def artifact_text(value: Any) -> str:
+    """产物正文：字典（投资决策）格式化为JSON代码块，其余转为字符串"""
+    if isinstance(value, dict):
+        return f"```json\n{json.dumps(value, ensure_ascii=False, indent=2)}\n```"
+    return "" if value is None else str(value)
+
+
+def artifact_id(key: str, text: str) -> str:
+    """引用ID由状态键和内容摘要组成，同一内容（如缓存复用的结果）得到相同ID"""
+    return f"{key}-{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}"
+
+
+def artifact_frames(key: str, text: str, title: Optional[str] = None,
+                    chunk_size: Optional[int] = None) -> Tuple[str, List[str]]:
+    """
+    把产物切成分块帧
+
+    Returns:
+        (引用ID, JSON帧列表)
+    """
+    chunk_size = chunk_size or ARTIFACT_CHUNK_SIZE
+    ref = artifact_id(key, text)
+    chunks = [text[start:start + chunk_size] for start in range(0, len(text), chunk_size)] or [""]
+    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+    frames = [json.dumps({
+        "type": "artifact",
+        "id": ref,
+        "title": title or SECTION_TITLES.get(key, key),
+        "seq": seq,
+        "total": len(chunks),
+        "chunk": chunk,
+        "timestamp": timestamp
+    }, ensure_ascii=False) for seq, chunk in enumerate(chunks)]
+    return ref, frames
+
+
+async def send_artifact(target, key: str, value: Any, title: Optional[str] = None) -> Optional[str]:
+    """按分块发送一个产物，正文为空时不发送，返回引用ID"""
+    text = artifact_text(value)
+    if not text:
+        return None
+    ref, frames = artifact_frames(key, text, title)
+    for frame in frames:
+        await target.send_text(frame)
+    return ref
+
+
+async def send_report(target, final_report: Dict[str, Any], include_agent_sections: bool = False) -> List[str]:
+    """
+    发送最终报告：补发尚未发送的产物，再发送只含引用ID的报告帧
+
+    Args:
+        target: 具有 send_text 的WebSocket或广播通道
+        final_report: 工作流返回的状态字典
+        include_agent_sections: 各Agent的分析结果是否也需要发送（预热报告没有经过Agent执行）
+
+    Returns:
+        报告引用的产物ID列表
+    """
+    refs = []
+    for key, title in REPORT_SECTIONS:
+        text = artifact_text(final_report.get(key))
+        if not text:
+            continue
+        if key in AGENT_SECTIONS and not include_agent_sections:
+            refs.append(artifact_id(key, text))
+        else:
+            refs.append(await send_artifact(target, key, text, title))
+    await target.send_text(json.dumps({
+        "type": "report",
+        "artifacts": refs,
+        "message": f"📄 最终报告已准备就绪（{len(refs)} 个部分），可以下载",
+        "timestamp": datetime.datetime.now().strftime("%H:%M:%S")
+    }, ensure_ascii=False))
+    return refs
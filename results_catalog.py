@@ -0,0 +1,471 @@
+"""
+回测结果目录
+
+用SQLite索引每次回测的运行参数、核心指标、模型和提示词版本，
+资产曲线和交易流水按列存储为numpy压缩文件，按需加载
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from model_routing import resolve_agent_models
+
+# numpy 只在读写序列文件时加载，列出、比较运行等元数据查询不必导入
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# 作为索引列存储的核心指标
+METRIC_COLUMNS = [
+    "final_value",
+    "total_return",
+    "total_profit",
+    "max_drawdown",
+    "volatility",
+    "sharpe_ratio",
+    "win_rate",
+    "total_trades",
+    "buy_trades",
+    "sell_trades",
+]
+
+# 运行参数列
+PARAM_COLUMNS = [
+    "stock_code",
+    "company_name",
+    "start_date",
+    "end_date",
+    "frequency",
+    "initial_capital",
+]
+
+# 按列存储的序列字段（资产曲线、交易流水）
+SERIES_FIELDS = ["daily_values", "transactions"]
+
+# 空值掩码列的名称前缀，见 ResultsCatalog._write_series
+NULL_MASK_PREFIX = "nulls"
+
+# 允许排序的字段
+SORTABLE_COLUMNS = set(["created_at"] + PARAM_COLUMNS + METRIC_COLUMNS)
+
+# 定义提示词的Agent源文件，用于计算提示词版本
+PROMPT_SOURCES = [
+    "fundamental_agent.py",
+    "technical_agent.py",
+    "valuation_agent.py",
+    "summary_agent.py",
+    "investment_agent.py",
+]
+
+
+def _column_array(values: List[Any]) -> "np.ndarray":
+    """按列中非空值的类型选择dtype，空值位置填充占位值（由掩码列标记）"""
+    import numpy as np
+
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, bool) for v in present):
+        return np.asarray([bool(v) for v in values], dtype=np.bool_)
+    if present and all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+        try:
+            return np.asarray([0 if v is None else v for v in values], dtype=np.int64)
+        except OverflowError:
+            pass
+    if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return np.asarray([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.asarray(["" if v is None else str(v) for v in values], dtype=np.str_)
+
+
+def get_prompt_version() -> str:
+    """根据各Agent提示词源文件内容计算提示词版本号"""
+    agents_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agents")
+    digest = hashlib.sha1()
+    for name in PROMPT_SOURCES:
+        path = os.path.join(agents_dir, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def get_model_name(models: Optional[Dict[str, str]] = None) -> str:
+    """
+    模型列的取值：各Agent使用同一模型时为模型名，按Agent路由了不同模型时为 角色=模型 的列表
+
+    Args:
+        models: 各Agent的模型映射，默认读取当前路由配置
+    """
+    models = models or resolve_agent_models()
+    if len(set(models.values())) == 1:
+        return next(iter(models.values()))
+    return ",".join(f"{role}={model}" for role, model in models.items())
+
+
+class ResultsCatalog:
+    """回测结果目录"""
+
+    def __init__(self, root: Optional[str] = None):
+        """
+        初始化结果目录
+
+        Args:
+            root: 目录根路径，默认读取 BACKTEST_CATALOG_DIR 环境变量
+        """
+        self.root = root or os.getenv("BACKTEST_CATALOG_DIR", "backtest_catalog")
+        self.db_path = os.path.join(self.root, "catalog.db")
+        self.columns_dir = os.path.join(self.root, "columns")
+        os.makedirs(self.columns_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        """创建索引表"""
+        param_defs = ",\n".join(
+            f"{col} {'REAL' if col == 'initial_capital' else 'TEXT'}" for col in PARAM_COLUMNS
+        )
+        metric_defs = ",\n".join(f"{col} REAL" for col in METRIC_COLUMNS)
+        with self._connect() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    created_at TEXT NOT NULL,
+                    {param_defs},
+                    model TEXT,
+                    models_json TEXT,
+                    prompt_version TEXT,
+                    {metric_defs},
+                    params_json TEXT,
+                    extra_json TEXT,
+                    columns_path TEXT
+                )
+            """)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(runs)")}
+            if "models_json" not in existing:
+                # 早期的目录没有按Agent记录模型
+                conn.execute("ALTER TABLE runs ADD COLUMN models_json TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_stock ON runs (stock_code, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_model ON runs (model, prompt_version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_frequency ON runs (frequency)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_return ON runs (total_return)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_sharpe ON runs (sharpe_ratio)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_created ON runs (created_at)")
+
+    def record_run(self, results: Dict[str, Any], params: Optional[Dict[str, Any]] = None,
+                   model: Optional[str] = None, prompt_version: Optional[str] = None,
+                   run_id: Optional[str] = None, created_at: Optional[str] = None,
+                   models: Optional[Dict[str, str]] = None) -> str:
+        """
+        登记一次回测结果
+
+        Args:
+            results: calculate_performance 返回的结果字典
+            params: 回测参数（股票代码、日期范围、频率等）
+            model: 使用的模型名称，默认根据各Agent的模型生成
+            prompt_version: 提示词版本，默认根据Agent源码计算
+            run_id: 指定运行ID，默认自动生成
+            created_at: 指定登记时间，默认当前时间
+            models: 各Agent使用的模型，默认读取当前路由配置（见 model_routing）
+
+        Returns:
+            运行ID
+        """
+        params = dict(params or {})
+        run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        created_at = created_at or datetime.now().isoformat(timespec="seconds")
+        if "initial_capital" not in params and "initial_capital" in results:
+            params["initial_capital"] = results["initial_capital"]
+
+        columns_path = os.path.join(self.columns_dir, f"{run_id}.npz")
+        self._write_series(columns_path, results)
+
+        extra = {
+            k: v for k, v in results.items()
+            if k not in SERIES_FIELDS and k not in METRIC_COLUMNS and k not in ("run_id", "models")
+        }
+        if models is None and model is None:
+            models = resolve_agent_models()
+
+        row = {
+            "run_id": run_id,
+            "created_at": created_at,
+            "model": model or get_model_name(models),
+            "models_json": json.dumps(models, ensure_ascii=False) if models else None,
+            "prompt_version": prompt_version or get_prompt_version(),
+            "params_json": json.dumps(params, ensure_ascii=False, default=str),
+            "extra_json": json.dumps(extra, ensure_ascii=False, default=str),
+            "columns_path": os.path.relpath(columns_path, self.root),
+        }
+        for col in PARAM_COLUMNS:
+            row[col] = params.get(col)
+        if row["initial_capital"] is not None:
+            row["initial_capital"] = float(row["initial_capital"])
+        for col in METRIC_COLUMNS:
+            value = results.get(col)
+            row[col] = float(value) if isinstance(value, (int, float)) else None
+
+        columns = ", ".join(row.keys())
+        placeholders = ", ".join("?" for _ in row)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO runs ({columns}) VALUES ({placeholders})",
+                         list(row.values()))
+        return run_id
+
+    def _write_series(self, path: str, results: Dict[str, Any]):
+        """
+        将资产曲线和交易流水按列写入npz文件
+
+        整数、布尔、浮点列保留各自的dtype，无法统一为数值的列存为字符串。
+        含空值或部分记录缺少该键的列另存一个掩码列（NULL_MASK_PREFIX__字段__列名，
+        1为None、2为缺少该键），导出时据此还原，不用""或0代替空值
+        """
+        import numpy as np
+
+        arrays = {}
+        for field in SERIES_FIELDS:
+            records = results.get(field) or []
+            keys = []
+            for record in records:
+                for key in record.keys():
+                    if key not in keys:
+                        keys.append(key)
+            for key in keys:
+                mask = [0 if key in record and record[key] is not None else (1 if key in record else 2)
+                        for record in records]
+                values = [record.get(key) for record in records]
+                arrays[f"{field}__{key}"] = _column_array(values)
+                if any(mask):
+                    arrays[f"{NULL_MASK_PREFIX}__{field}__{key}"] = np.asarray(mask, dtype=np.int8)
+        np.savez_compressed(path, **arrays)
+
+    def _read_columns(self, row: Dict[str, Any], fields: List[str]) -> Dict[str, Dict[str, tuple]]:
+        """读取列数组及其空值掩码: {字段: {列名: (数组, 掩码或None)}}"""
+        import numpy as np
+
+        columns = {field: {} for field in fields}
+        masks = {}
+        with np.load(os.path.join(self.root, row["columns_path"]), allow_pickle=False) as data:
+            for name in data.files:
+                field, _, column = name.partition("__")
+                if field == NULL_MASK_PREFIX:
+                    masks[column] = data[name]
+                elif field in columns:
+                    columns[field][column] = data[name]
+        return {
+            field: {column: (values, masks.get(f"{field}__{column}")) for column, values in cols.items()}
+            for field, cols in columns.items()
+        }
+
+    def load_series(self, run_id: str, fields: Optional[List[str]] = None) -> Dict[str, Dict[str, "np.ndarray"]]:
+        """
+        读取一次运行的列式序列
+
+        Args:
+            run_id: 运行ID
+            fields: 需要的序列字段，默认全部
+
+        Returns:
+            {字段: {列名: 数组}}，含空值的列为 numpy.ma.MaskedArray
+        """
+        import numpy as np
+
+        row = self.get_run(run_id)
+        if not row:
+            return {}
+        series = self._read_columns(row, fields or SERIES_FIELDS)
+        return {
+            field: {
+                column: values if mask is None else np.ma.masked_array(values, mask=mask != 0)
+                for column, (values, mask) in columns.items()
+            }
+            for field, columns in series.items()
+        }
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        record["params"] = json.loads(record.pop("params_json") or "{}")
+        record["extra"] = json.loads(record.pop("extra_json") or "{}")
+        record["models"] = json.loads(record.pop("models_json") or "{}")
+        return record
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """获取单次运行的索引记录"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_runs(self, stock_code: Optional[str] = None, frequency: Optional[str] = None,
+                  model: Optional[str] = None, prompt_version: Optional[str] = None,
+                  created_after: Optional[str] = None, created_before: Optional[str] = None,
+                  min_total_return: Optional[float] = None, min_sharpe_ratio: Optional[float] = None,
+                  order_by: str = "created_at", descending: bool = True,
+                  limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        按条件筛选回测运行
+
+        Returns:
+            索引记录列表（不含序列数据）
+        """
+        clauses = []
+        args: List[Any] = []
+        for column, value in [("stock_code", stock_code), ("frequency", frequency),
+                              ("model", model), ("prompt_version", prompt_version)]:
+            if value:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        if created_after:
+            clauses.append("created_at >= ?")
+            args.append(created_after)
+        if created_before:
+            clauses.append("created_at <= ?")
+            args.append(created_before)
+        if min_total_return is not None:
+            clauses.append("total_return >= ?")
+            args.append(min_total_return)
+        if min_sharpe_ratio is not None:
+            clauses.append("sharpe_ratio >= ?")
+            args.append(min_sharpe_ratio)
+
+        if order_by not in SORTABLE_COLUMNS:
+            raise ValueError(f"不支持的排序字段: {order_by}")
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (f"SELECT * FROM runs {where} ORDER BY {order_by} {'DESC' if descending else 'ASC'} "
+               f"LIMIT ? OFFSET ?")
+        args.extend([int(limit), int(offset)])
+        with self._connect() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def compare_runs(self, run_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        对比多次运行的参数和核心指标（单次索引查询）
+
+        Args:
+            run_ids: 运行ID列表
+
+        Returns:
+            按传入顺序排列的索引记录
+        """
+        if not run_ids:
+            return []
+        placeholders = ", ".join("?" for _ in run_ids)
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT * FROM runs WHERE run_id IN ({placeholders})",
+                                list(run_ids)).fetchall()
+        by_id = {row["run_id"]: self._row_to_dict(row) for row in rows}
+        return [by_id[run_id] for run_id in run_ids if run_id in by_id]
+
+    def export_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """
+        还原完整的回测结果字典（与原JSON结果格式一致）
+
+        Args:
+            run_id: 运行ID
+
+        Returns:
+            结果字典，不存在时返回None
+        """
+        row = self.get_run(run_id)
+        if not row:
+            return None
+        results = dict(row["extra"])
+        for col in METRIC_COLUMNS:
+            if row[col] is not None:
+                results[col] = int(row[col]) if col.endswith("trades") else row[col]
+        series = self._read_columns(row, SERIES_FIELDS)
+        for field in SERIES_FIELDS:
+            columns = series.get(field, {})
+            length = len(next(iter(columns.values()))[0]) if columns else 0
+            records = []
+            for i in range(length):
+                record = {}
+                for key, (values, mask) in columns.items():
+                    state = 0 if mask is None else mask[i]
+                    if state == 0:
+                        record[key] = values[i].item()
+                    elif state == 1:
+                        record[key] = None
+                records.append(record)
+            results[field] = records
+        results["run_id"] = run_id
+        results["params"] = row["params"]
+        results["model"] = row["model"]
+        if row["models"]:
+            results["models"] = row["models"]
+        results["prompt_version"] = row["prompt_version"]
+        return results
+
+    def delete_run(self, run_id: str) -> bool:
+        """删除一次运行及其列式数据"""
+        row = self.get_run(run_id)
+        if not row:
+            return False
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+        path = os.path.join(self.root, row["columns_path"])
+        if os.path.exists(path):
+            os.remove(path)
+        return True
+
+    def import_json_file(self, path: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        导入历史遗留的 backtest_results_*.json 文件
+
+        Args:
+            path: JSON文件路径
+            params: 额外的运行参数（旧文件中没有记录）
+
+        Returns:
+            运行ID
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            results = json.load(f)
+        params = dict(params or results.get("params") or {})
+        daily_values = results.get("daily_values") or []
+        if daily_values:
+            params.setdefault("start_date", daily_values[0].get("date"))
+            params.setdefault("end_date", daily_values[-1].get("date"))
+        transactions = results.get("transactions") or []
+        if transactions:
+            params.setdefault("stock_code", transactions[0].get("stock_code"))
+        run_id = os.path.splitext(os.path.basename(path))[0].replace("backtest_results_", "legacy_")
+        created_at = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec="seconds")
+        return self.record_run(results, params=params, model=results.get("model", "unknown"),
+                               prompt_version=results.get("prompt_version", "unknown"),
+                               run_id=run_id, created_at=created_at, models=results.get("models"))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="回测结果目录工具")
+    subparsers = parser.add_subparsers(dest="command")
+    import_parser = subparsers.add_parser("import", help="导入旧的JSON结果文件")
+    import_parser.add_argument("patterns", nargs="*", default=["backtest_results_*.json"])
+    list_parser = subparsers.add_parser("list", help="列出已登记的回测")
+    list_parser.add_argument("--stock_code")
+    list_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = ResultsCatalog()
+    if args.command == "import":
+        for pattern in args.patterns:
+            for path in sorted(glob.glob(pattern)):
+                print(f"📥 导入 {path} -> {catalog.import_json_file(path)}")
+    else:
+        for run in catalog.list_runs(stock_code=getattr(args, "stock_code", None),
+                                     limit=getattr(args, "limit", 20)):
+            print(f"{run['run_id']}  {run['stock_code']}  {run['frequency']}  "
+                  f"收益率 {run['total_return'] or 0:.2%}  夏普 {run['sharpe_ratio'] or 0:.2f}  "
+                  f"{run['model']}/{run['prompt_version']}")
@@ -0,0 +1,96 @@
+"""
+服务预热与就绪检查
+
+在FastAPI lifespan中后台预热共享MCP工具池、模型客户端和编译好的工作流图，
+并提供 /ready 就绪检查：预热完成前返回503，完成后返回200。
+/health 只表示进程存活，负载均衡和部署脚本应以 /ready 判断服务可用
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 预热失败后的重试间隔（秒）
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "30"))
+
+readiness: Dict[str, Any] = {
+    "ready": False,
+    "stage": "starting",
+    "attempts": 0,
+    "error": None,
+    "started_at": None,
+    "ready_at": None,
+    "warmup_seconds": None,
+}
+
+_warmup_task: Optional[asyncio.Task] = None
+
+
+def warmup_enabled() -> bool:
+    return os.getenv("WARMUP_ENABLED", "1") != "0"
+
+
+async def run_warmup():
+    """预热共享资源，失败时按间隔重试直到成功"""
+    from backtest_service import get_shared_workflow
+
+    readiness["started_at"] = datetime.now().isoformat(timespec="seconds")
+    start = time.perf_counter()
+    while True:
+        readiness["attempts"] += 1
+        readiness["stage"] = "warming"
+        try:
+            # 预热回测共享的工作流实例，工具池和模型由所有工作流共享
+            await get_shared_workflow().warm_up()
+            readiness.update({
+                "ready": True,
+                "stage": "ready",
+                "error": None,
+                "ready_at": datetime.now().isoformat(timespec="seconds"),
+                "warmup_seconds": round(time.perf_counter() - start, 3),
+            })
+            logger.info(f"✅ 服务预热完成，耗时 {readiness['warmup_seconds']} 秒")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            readiness.update({"stage": "retrying", "error": str(e)})
+            logger.warning(f"⚠️ 服务预热失败，{WARMUP_RETRY_SECONDS:.0f}秒后重试: {e}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+
+def start_warmup():
+    """在当前事件循环上启动后台预热"""
+    global _warmup_task
+    if not warmup_enabled():
+        readiness.update({"ready": True, "stage": "disabled"})
+        return
+    if _warmup_task is None:
+        _warmup_task = asyncio.create_task(run_warmup())
+
+
+async def stop_warmup():
+    global _warmup_task
+    if _warmup_task and not _warmup_task.done():
+        _warmup_task.cancel()
+        try:
+            await _warmup_task
+        except asyncio.CancelledError:
+            pass
+    _warmup_task = None
+
+
+@router.get("/ready")
+async def ready_check():
+    """就绪检查，预热完成前返回503"""
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
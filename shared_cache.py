@@ -0,0 +1,369 @@
+"""
+跨进程共享缓存
+
+多worker部署（python app.py --workers N）时，MCP工具结果、专业Agent分析结果和回测决策的缓存
+放在同一个SQLite数据库中（WAL模式，读写互不阻塞），任一worker写入的结果其他worker都能命中；
+单进程运行时默认使用进程内LRU。
+
+- CACHE_BACKEND: memory（默认）或 sqlite，多worker启动时自动设为 sqlite
+- SHARED_CACHE_DB: SQLite数据库路径，默认 data/shared_cache.db
+- TOOL_CACHE_ENABLED / TOOL_CACHE_TTL / TOOL_CACHE_SIZE: 工具结果缓存开关、有效期（秒）和条目上限
+
+各worker按命名空间统计命中率；sqlite后端下统计定期写入共享库，任一worker的
+/api/cache/stats 都能看到所有worker的缓存效果
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cachetools import LRUCache
+
+from tracing import Counter, register_metrics
+
+CACHE_BACKENDS = ("memory", "sqlite")
+
+# worker统计写入共享库的最小间隔（秒）
+STATS_FLUSH_SECONDS = 10.0
+
+# sqlite后端每写入多少条检查一次过期和超额条目
+PRUNE_EVERY = 200
+
+CACHE_REQUESTS = Counter("mcp_agent_cache_requests_total", "缓存读取次数，按命名空间和命中结果区分")
+register_metrics(CACHE_REQUESTS)
+
+
+def worker_id() -> str:
+    return str(os.getpid())
+
+
+class MemoryBackend:
+    """进程内LRU后端"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, LRUCache] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: str, maxsize: int) -> LRUCache:
+        cache = self._data.get(namespace)
+        if cache is None:
+            cache = self._data[namespace] = LRUCache(maxsize=maxsize)
+        return cache
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            cache = self._data.get(namespace)
+            item = cache.get(key) if cache is not None else None
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.time():
+                del cache[key]
+                return None
+            return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float], maxsize: int):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._namespace(namespace, maxsize)[key] = (expires_at, value)
+
+    def clear(self, namespace: str):
+        with self._lock:
+            self._data.pop(namespace, None)
+
+    def size(self, namespace: str) -> int:
+        with self._lock:
+            return len(self._data.get(namespace) or ())
+
+    def write_worker_stats(self, stats: List[Dict[str, Any]]):
+        pass
+
+    def read_worker_stats(self) -> List[Dict[str, Any]]:
+        return []
+
+
+class SQLiteBackend:
+    """
+    SQLite共享后端（WAL模式）
+
+    值以JSON保存；条目数超过上限时按写入时间淘汰最旧的条目
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("SHARED_CACHE_DB", "data/shared_cache.db")
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._local = threading.local()
+        self._writes: Dict[str, int] = {}
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每个线程一个连接，autocommit，读写不需要显式事务
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_created ON cache (namespace, created_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS worker_stats (
+                worker TEXT NOT NULL,
+                namespace TEXT NOT NULL,
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL,
+                sets INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (worker, namespace)
+            )
+        """)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float], maxsize: int):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False, default=str), now, now + ttl if ttl else None)
+        )
+        self._writes[namespace] = self._writes.get(namespace, 0) + 1
+        if self._writes[namespace] % PRUNE_EVERY == 0:
+            self._prune(conn, namespace, maxsize, now)
+
+    @staticmethod
+    def _prune(conn: sqlite3.Connection, namespace: str, maxsize: int, now: float):
+        conn.execute("DELETE FROM cache WHERE namespace = ? AND expires_at < ?", (namespace, now))
+        conn.execute("""
+            DELETE FROM cache WHERE namespace = ? AND key IN (
+                SELECT key FROM cache WHERE namespace = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (namespace, namespace, maxsize))
+
+    def clear(self, namespace: str):
+        self._connect().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+    def size(self, namespace: str) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM cache WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def write_worker_stats(self, stats: List[Dict[str, Any]]):
+        now = time.time()
+        self._connect().executemany(
+            "INSERT OR REPLACE INTO worker_stats (worker, namespace, hits, misses, sets, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(item["worker"], item["namespace"], item["hits"], item["misses"], item["sets"], now) for item in stats]
+        )
+
+    def read_worker_stats(self) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT worker, namespace, hits, misses, sets, updated_at FROM worker_stats ORDER BY worker, namespace"
+        ).fetchall()
+        return [{"worker": worker, "namespace": namespace, "hits": hits, "misses": misses, "sets": sets,
+                 "hit_rate": hits / (hits + misses) if hits + misses else 0.0, "updated_at": updated_at}
+                for worker, namespace, hits, misses, sets, updated_at in rows]
+
+
+class SharedCache:
+    """一个命名空间的缓存视图，统计本worker的命中情况"""
+
+    def __init__(self, namespace: str, backend, maxsize: int = 1000, ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self._last_flush = 0.0
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中返回None"""
+        value = self.backend.get(self.namespace, key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        CACHE_REQUESTS.inc(namespace=self.namespace, result="miss" if value is None else "hit")
+        self._maybe_flush_stats()
+        return value
+
+    def set(self, key: str, value: Any):
+        """写入缓存"""
+        self.backend.set(self.namespace, key, value, self.ttl, self.maxsize)
+        self.sets += 1
+        self._maybe_flush_stats()
+
+    def clear(self):
+        self.backend.clear(self.namespace)
+
+    def worker_stats(self) -> Dict[str, Any]:
+        return {"worker": worker_id(), "namespace": self.namespace,
+                "hits": self.hits, "misses": self.misses, "sets": self.sets}
+
+    def _maybe_flush_stats(self):
+        now = time.monotonic()
+        if now - self._last_flush >= STATS_FLUSH_SECONDS:
+            self._last_flush = now
+            self.backend.write_worker_stats([self.worker_stats()])
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中统计（本worker）"""
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "size": self.backend.size(self.namespace),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "sets": self.sets,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_backend = None
+_caches: Dict[str, SharedCache] = {}
+_stats_sources: Dict[str, Callable[[], Dict[str, int]]] = {}
+_lock = threading.Lock()
+
+
+def cache_backend_name() -> str:
+    name = os.getenv("CACHE_BACKEND", "memory")
+    if name not in CACHE_BACKENDS:
+        raise ValueError(f"未知的缓存后端: {name}，可选 {', '.join(CACHE_BACKENDS)}")
+    return name
+
+
+def get_cache_backend():
+    """获取进程内共享的缓存后端，首次调用时按 CACHE_BACKEND 创建"""
+    global _backend
+    with _lock:
+        if _backend is None:
+            _backend = SQLiteBackend() if cache_backend_name() == "sqlite" else MemoryBackend()
+        return _backend
+
+
+def get_shared_cache(namespace: str, maxsize: int = 1000, ttl: Optional[float] = None) -> SharedCache:
+    """获取命名空间的缓存，同一命名空间在进程内只创建一次"""
+    backend = get_cache_backend()
+    with _lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = _caches[namespace] = SharedCache(namespace, backend, maxsize, ttl)
+        return cache
+
+
+def register_stats_source(namespace: str, counts: Callable[[], Dict[str, int]]):
+    """登记不经过 SharedCache 的缓存（如预热报告），其 hits/misses/sets 计入本worker的统计"""
+    _stats_sources[namespace] = counts
+
+
+def cache_stats() -> Dict[str, Any]:
+    """本worker各命名空间的统计，以及（sqlite后端下）所有worker写入共享库的统计"""
+    backend = get_cache_backend()
+    caches = list(_caches.values())
+    namespaces = {cache.namespace: cache.stats() for cache in caches}
+    worker_stats = [cache.worker_stats() for cache in caches]
+    for namespace, counts in _stats_sources.items():
+        item = counts()
+        total = item["hits"] + item["misses"]
+        namespaces[namespace] = {**item, "hit_rate": item["hits"] / total if total else 0.0}
+        worker_stats.append({"worker": worker_id(), "namespace": namespace, **item})
+    backend.write_worker_stats(worker_stats)
+    return {
+        "backend": backend.name,
+        "worker": worker_id(),
+        "namespaces": namespaces,
+        "workers": backend.read_worker_stats(),
+    }
+
+
+def get_tool_cache() -> Optional[SharedCache]:
+    """MCP工具结果缓存，有效期 TOOL_CACHE_TTL 秒（默认900），TOOL_CACHE_ENABLED=0 时返回None"""
+    if os.getenv("TOOL_CACHE_ENABLED", "1") == "0":
+        return None
+    return get_shared_cache("tool", int(os.getenv("TOOL_CACHE_SIZE", "5000")),
+                            float(os.getenv("TOOL_CACHE_TTL", "900")))
+
+
+def get_decision_cache() -> Optional[SharedCache]:
+    """回测投资决策缓存，与Agent结果缓存共用 AGENT_CACHE_ENABLED 开关"""
+    if os.getenv("AGENT_CACHE_ENABLED", "1") == "0":
+        return None
+    return get_shared_cache("decision", int(os.getenv("AGENT_CACHE_SIZE", "1000")))
+
+
+def get_partial_summary_cache() -> Optional[SharedCache]:
+    """汇总map阶段的要点摘要缓存，与Agent结果缓存共用 AGENT_CACHE_ENABLED 开关"""
+    if os.getenv("AGENT_CACHE_ENABLED", "1") == "0":
+        return None
+    return get_shared_cache("summary_partial", int(os.getenv("AGENT_CACHE_SIZE", "1000")))
+
+
+def tool_cache_key(name: str, args: Dict[str, Any], as_of: Optional[str]) -> str:
+    return f"{name}|{as_of or ''}|{json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)}"
+
+
+def _cacheable(result: Any) -> Tuple[bool, Any]:
+    """工具结果能否缓存：纯文本，或不带附件的 (content, artifact) 二元组"""
+    if isinstance(result, str):
+        return True, result
+    if isinstance(result, tuple) and len(result) == 2 and result[1] is None and isinstance(result[0], (str, list)):
+        return True, {"content": result[0]}
+    return False, None
+
+
+def cache_tool_results(tools: list, cache: SharedCache) -> list:
+    """
+    为工具加上结果缓存：同一工具、同一参数、同一截止日期的调用在有效期内直接复用
+
+    只替换工具的协程函数，名称、描述和参数模式不变
+    """
+    from market_data_store import get_as_of_date
+
+    def wrap(name: str, coroutine):
+        async def call(*args, **kwargs):
+            key = tool_cache_key(name, kwargs, get_as_of_date())
+            cached = cache.get(key)
+            if cached is not None:
+                return (cached["content"], None) if isinstance(cached, dict) else cached
+            result = await coroutine(*args, **kwargs)
+            ok, value = _cacheable(result)
+            if ok:
+                cache.set(key, value)
+            return result
+        return call
+
+    for tool in tools:
+        if getattr(tool, "coroutine", None) is not None:
+            tool.coroutine = wrap(tool.name, tool.coroutine)
+    return tools
@@ -16,8 +16,8 @@ def check_dependencies():
     print("🔍 Checking system dependencies...")
     
     required_packages = [
-        ('flask', 'Flask'),
-        ('flask_cors', 'Flask-CORS'),
+        ('fastapi', 'fastapi'),
+        ('uvicorn', 'uvicorn'),
         ('pandas', 'pandas'),
         ('numpy', 'numpy'),
         ('baostock', 'baostock')
@@ -36,12 +36,12 @@ def check_dependencies():
         try:
             subprocess.check_call([
                 sys.executable, '-m', 'pip', 'install', 
-                'Flask==3.0.0', 'Flask-CORS==4.0.0'
+                'fastapi==0.115.12', 'uvicorn==0.34.2'
             ])
             print("✅ Dependencies installed successfully!")
         except subprocess.CalledProcessError:
             print("❌ Auto-installation failed, please run manually:")
-            print("pip install Flask==3.0.0 Flask-CORS==4.0.0")
+            print("pip install fastapi==0.115.12 uvicorn==0.34.2")
             return False
     else:
         print("✅ All dependencies are ready!")
@@ -54,6 +54,7 @@ def check_files():
     
     required_files = [
         'backtest_api.py',
+        'backtest_service.py',
         'backtest_system.py',
         'multi_agent_workflow.py',
         'frontend/backtest.html',
@@ -75,7 +76,7 @@ def check_files():
     return True
 
 def start_server():
-    """Start Flask server"""
+    """Start backtest API server"""
     print("\n🚀 Starting backtest system web server...")
     print("📱 Access URL: http://localhost:5000")
     print("🛑 Press Ctrl+C to stop the server")
@@ -83,8 +84,9 @@ def start_server():
     
     try:
         # Import and run API server
+        import uvicorn
         import backtest_api
-        backtest_api.app.run(host='0.0.0.0', port=5000, debug=False)
+        uvicorn.run(backtest_api.app, host='0.0.0.0', port=5000, log_level="info")
     except KeyboardInterrupt:
         print("\n👋 Server stopped")
     except Exception as e:
@@ -0,0 +1,334 @@
+"""
+流式技术指标
+
+回测逐日推进时，相邻决策点的K线窗口只差一根，整段重算指标和重新拉取历史价格都是重复劳动。
+这里的指标状态对象每收到一根新K线只做常数时间的更新，推进一天的成本与回看长度无关：
+- EMAState: 指数移动平均
+- MACDState: MACD(12,26,9)
+- RSIState: RSI，涨跌幅按 alpha = 1/N 平滑
+- ATRState: 平均真实波幅，按 alpha = 1/N 平滑
+- RollingStats: 滑动窗口均值和方差（Welford增删）
+- BollingerState: 布林带(20,2)
+- StreamingIndicators: 单只股票的指标组合，同时保留最近的收盘价窗口
+
+指标口径与 technical_indicators.py 的向量化实现一致（指数平均以首个值为初值，方差为总体方差）。
+所有状态都可以通过 snapshot() 导出为JSON兼容的字典，写入回测检查点后用 from_snapshot() 恢复。
+"""
+
+import math
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class EMAState:
+    """指数移动平均 y = alpha * x + (1 - alpha) * y_prev，首个值为初值"""
+
+    def __init__(self, period: Optional[int] = None, alpha: Optional[float] = None):
+        self.alpha = alpha if alpha is not None else 2.0 / (period + 1)
+        self.value: Optional[float] = None
+
+    def update(self, x: float) -> float:
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"alpha": self.alpha, "value": self.value}
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "EMAState":
+        state = cls(alpha=data["alpha"])
+        state.value = data["value"]
+        return state
+
+
+class MACDState:
+    """MACD，柱状线按国内习惯取 2 × (DIF - DEA)"""
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = EMAState(fast)
+        self.slow = EMAState(slow)
+        self.signal = EMAState(signal)
+        self.dif: Optional[float] = None
+        self.dea: Optional[float] = None
+        self.hist: Optional[float] = None
+
+    def update(self, close: float) -> float:
+        self.dif = self.fast.update(close) - self.slow.update(close)
+        self.dea = self.signal.update(self.dif)
+        self.hist = 2 * (self.dif - self.dea)
+        return self.hist
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"fast": self.fast.snapshot(), "slow": self.slow.snapshot(),
+                "signal": self.signal.snapshot(), "dif": self.dif, "dea": self.dea, "hist": self.hist}
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "MACDState":
+        state = cls()
+        state.fast = EMAState.from_snapshot(data["fast"])
+        state.slow = EMAState.from_snapshot(data["slow"])
+        state.signal = EMAState.from_snapshot(data["signal"])
+        state.dif, state.dea, state.hist = data["dif"], data["dea"], data["hist"]
+        return state
+
+
+class RSIState:
+    """RSI，上涨幅度和涨跌幅绝对值分别按 alpha = 1/N 平滑，首根K线没有值"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.gain = EMAState(alpha=1.0 / period)
+        self.total = EMAState(alpha=1.0 / period)
+        self.prev_close: Optional[float] = None
+        self.value: Optional[float] = None
+
+    def update(self, close: float) -> Optional[float]:
+        if self.prev_close is not None:
+            change = close - self.prev_close
+            gain = self.gain.update(max(change, 0.0))
+            total = self.total.update(abs(change))
+            self.value = gain / total * 100 if total > 0 else 50.0
+        self.prev_close = close
+        return self.value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"period": self.period, "gain": self.gain.snapshot(), "total": self.total.snapshot(),
+                "prev_close": self.prev_close, "value": self.value}
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "RSIState":
+        state = cls(data["period"])
+        state.gain = EMAState.from_snapshot(data["gain"])
+        state.total = EMAState.from_snapshot(data["total"])
+        state.prev_close, state.value = data["prev_close"], data["value"]
+        return state
+
+
+class ATRState:
+    """平均真实波幅，真实波幅按 alpha = 1/N 平滑，首根K线取最高价减最低价"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.average = EMAState(alpha=1.0 / period)
+        self.prev_close: Optional[float] = None
+
+    @property
+    def value(self) -> Optional[float]:
+        return self.average.value
+
+    def update(self, high: float, low: float, close: float) -> float:
+        true_range = high - low
+        if self.prev_close is not None:
+            true_range = max(true_range, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        return self.average.update(true_range)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"period": self.period, "average": self.average.snapshot(), "prev_close": self.prev_close}
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "ATRState":
+        state = cls(data["period"])
+        state.average = EMAState.from_snapshot(data["average"])
+        state.prev_close = data["prev_close"]
+        return state
+
+
+class RollingStats:
+    """
+    滑动窗口的均值和总体方差
+
+    窗口未满时按Welford算法加入新值，窗口已满时在同一步中移除最旧的值，
+    均值和二阶中心矩的更新都是常数时间，不需要重新遍历窗口
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values: deque = deque()
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) >= self.window
+
+    @property
+    def variance(self) -> float:
+        return max(self._m2, 0.0) / len(self.values) if self.values else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def update(self, x: float) -> float:
+        if len(self.values) < self.window:
+            self.values.append(x)
+            delta = x - self.mean
+            self.mean += delta / len(self.values)
+            self._m2 += delta * (x - self.mean)
+        else:
+            old = self.values.popleft()
+            self.values.append(x)
+            old_mean = self.mean
+            self.mean += (x - old) / self.window
+            self._m2 += (x - old) * (x - self.mean + old - old_mean)
+        return self.mean
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"window": self.window, "values": list(self.values), "mean": self.mean, "m2": self._m2}
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "RollingStats":
+        state = cls(data["window"])
+        state.values = deque(data["values"])
+        state.mean, state._m2 = data["mean"], data["m2"]
+        return state
+
+
+class BollingerState:
+    """布林带，中轨为N日均线，上下轨为中轨加减K倍总体标准差，窗口未满时没有值"""
+
+    def __init__(self, period: int = 20, width: float = 2.0):
+        self.width = width
+        self.stats = RollingStats(period)
+
+    def bands(self) -> Optional[Dict[str, float]]:
+        if not self.stats.full:
+            return None
+        mid, std = self.stats.mean, self.stats.std
+        return {"mid": mid, "upper": mid + self.width * std, "lower": mid - self.width * std}
+
+    def update(self, close: float) -> Optional[Dict[str, float]]:
+        self.stats.update(close)
+        return self.bands()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"width": self.width, "stats": self.stats.snapshot()}
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "BollingerState":
+        state = cls(width=data["width"])
+        state.stats = RollingStats.from_snapshot(data["stats"])
+        return state
+
+
+class StreamingIndicators:
+    """
+    单只股票的流式指标组合
+
+    按日期升序逐根喂入K线（date/high/low/close），重复或更早的K线会被忽略，
+    因此推进回测时可以直接喂入"上次之后"的新K线。
+    """
+
+    MA_PERIODS = (5, 20, 60)
+
+    def __init__(self, price_window: int = 30):
+        self.price_window = price_window
+        self.closes: deque = deque(maxlen=price_window)
+        self.last_date: Optional[str] = None
+        self.bars = 0
+        self.ma = {period: RollingStats(period) for period in self.MA_PERIODS}
+        self.ema20 = EMAState(20)
+        self.macd = MACDState()
+        self.rsi = RSIState(14)
+        self.atr = ATRState(14)
+        self.bollinger = BollingerState()
+
+    def update(self, bar: Dict[str, Any]) -> bool:
+        """
+        喂入一根K线
+
+        Args:
+            bar: 包含 date、high、low、close 的K线
+
+        Returns:
+            是否为新K线（早于或等于已处理日期的K线返回False）
+        """
+        if self.last_date is not None and bar["date"] <= self.last_date:
+            return False
+        close = float(bar["close"])
+        high = float(bar.get("high") or close)
+        low = float(bar.get("low") or close)
+        self.closes.append(close)
+        for stats in self.ma.values():
+            stats.update(close)
+        self.ema20.update(close)
+        self.macd.update(close)
+        self.rsi.update(close)
+        self.atr.update(high, low, close)
+        self.bollinger.update(close)
+        self.last_date = bar["date"]
+        self.bars += 1
+        return True
+
+    def update_many(self, bars: Iterable[Dict[str, Any]]) -> int:
+        """依次喂入多根K线，返回新K线的数量"""
+        return sum(self.update(bar) for bar in bars)
+
+    def recent_closes(self, count: Optional[int] = None) -> List[float]:
+        """最近的收盘价（不超过 price_window 个）"""
+        closes = list(self.closes)
+        return closes[-count:] if count else closes
+
+    def latest(self) -> Dict[str, Any]:
+        """当前的指标值，窗口未满的指标为None"""
+        def rounded(value, digits=3):
+            return round(value, digits) if value is not None else None
+
+        bands = self.bollinger.bands()
+        latest = {"date": self.last_date, "bars": self.bars}
+        for period, stats in self.ma.items():
+            latest[f"ma{period}"] = rounded(stats.mean) if stats.full else None
+        latest.update({
+            "ema20": rounded(self.ema20.value),
+            "macd_dif": rounded(self.macd.dif),
+            "macd_dea": rounded(self.macd.dea),
+            "macd_hist": rounded(self.macd.hist),
+            "rsi14": rounded(self.rsi.value, 1),
+            "atr14": rounded(self.atr.value),
+            "volatility20": rounded(self.ma[20].std) if self.ma[20].full else None,
+            "boll_upper": rounded(bands["upper"]) if bands else None,
+            "boll_mid": rounded(bands["mid"]) if bands else None,
+            "boll_lower": rounded(bands["lower"]) if bands else None,
+        })
+        return latest
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出全部状态（JSON兼容）"""
+        return {
+            "price_window": self.price_window,
+            "closes": list(self.closes),
+            "last_date": self.last_date,
+            "bars": self.bars,
+            "ma": {str(period): stats.snapshot() for period, stats in self.ma.items()},
+            "ema20": self.ema20.snapshot(),
+            "macd": self.macd.snapshot(),
+            "rsi": self.rsi.snapshot(),
+            "atr": self.atr.snapshot(),
+            "bollinger": self.bollinger.snapshot(),
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: Dict[str, Any]) -> "StreamingIndicators":
+        state = cls(data["price_window"])
+        state.closes.extend(data["closes"])
+        state.last_date, state.bars = data["last_date"], data["bars"]
+        state.ma = {int(period): RollingStats.from_snapshot(stats) for period, stats in data["ma"].items()}
+        state.ema20 = EMAState.from_snapshot(data["ema20"])
+        state.macd = MACDState.from_snapshot(data["macd"])
+        state.rsi = RSIState.from_snapshot(data["rsi"])
+        state.atr = ATRState.from_snapshot(data["atr"])
+        state.bollinger = BollingerState.from_snapshot(data["bollinger"])
+        return state
+
+
+def format_indicator_snapshot(latest: Dict[str, Any]) -> str:
+    """把 latest() 的指标值格式化为一行提示词文本，省略尚无值的指标"""
+    labels = [("ma5", "MA5"), ("ma20", "MA20"), ("ma60", "MA60"), ("macd_dif", "DIF"),
+              ("macd_dea", "DEA"), ("macd_hist", "MACD柱"), ("rsi14", "RSI14"), ("atr14", "ATR14"),
+              ("boll_upper", "布林上轨"), ("boll_lower", "布林下轨")]
+    parts = [f"{label} {latest[key]}" for key, label in labels if latest.get(key) is not None]
+    return "，".join(parts)
@@ -0,0 +1,401 @@
+"""
+本地技术指标引擎
+
+用 NumPy 向量化计算 MA、MACD、RSI、KDJ、布林带等指标，替代技术分析Agent
+通过 get_technical_indicators、get_moving_averages 等工具让模型逐个获取指标的方式。
+
+每只股票的K线只加载一次、整段计算一次，所有指标只依赖当日及之前的数据，
+回测中不同决策日直接按日期截取同一份序列，结果压缩为简短的摘要注入技术分析提示词。
+
+K线来源：
+- 本地数据存储（market_data_store），缺失时从baostock同步到本地后再读取
+- MCP_BACKEND=replay 时只读本地数据，保证回测可复现
+- MCP_BACKEND=stub 时使用离线基准的合成K线
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from tracing import span
+
+# 计算指标所需的回看天数（自然日），覆盖MA60和指数平均的预热期
+LOOKBACK_DAYS = int(os.getenv("INDICATOR_LOOKBACK_DAYS", "400"))
+
+# 回测向后扩展加载范围时多加载的天数，减少逐日扩展的重复加载
+EXTEND_DAYS = 90
+
+# 加载范围到今天的序列（实时分析）的有效秒数，过期后重新加载以补上新发布的K线
+LIVE_SERIES_TTL = float(os.getenv("INDICATOR_LIVE_TTL", "1800"))
+
+# 分块计算指数平均的块长，避免衰减系数的幂次溢出
+_EWM_BLOCK = 128
+
+MA_PERIODS = (5, 10, 20, 60)
+RSI_PERIODS = (6, 12, 24)
+
+
+# ----------------------------------------------------------------------
+# 指标计算（输入为按日期升序的NumPy数组，输出与输入等长，预热期为NaN）
+# ----------------------------------------------------------------------
+
+def sma(values: np.ndarray, period: int) -> np.ndarray:
+    """简单移动平均"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        out[period - 1:] = (cumsum[period:] - cumsum[:-period]) / period
+    return out
+
+
+def ewm(values: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    指数加权平均 y[t] = alpha * x[t] + (1 - alpha) * y[t-1]，y[0] = x[0]
+
+    按块向量化：块内 y[j] = d^(j+1) * y_prev + alpha * d^j * cumsum(x[i] / d^i)，d = 1 - alpha
+    """
+    values = np.asarray(values, dtype=float)
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    prev = values[0]
+    for start in range(0, len(values), _EWM_BLOCK):
+        block = values[start:start + _EWM_BLOCK]
+        powers = decay ** np.arange(len(block))
+        out[start:start + len(block)] = powers * (decay * prev + alpha * np.cumsum(block / powers))
+        prev = out[start + len(block) - 1]
+    return out
+
+
+def ema(values: np.ndarray, period: int) -> np.ndarray:
+    """指数移动平均 EMA(N)，alpha = 2 / (N + 1)"""
+    return ewm(values, 2.0 / (period + 1))
+
+
+def rolling_max(values: np.ndarray, period: int) -> np.ndarray:
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        out[period - 1:] = np.lib.stride_tricks.sliding_window_view(values, period).max(axis=1)
+    return out
+
+
+def rolling_min(values: np.ndarray, period: int) -> np.ndarray:
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        out[period - 1:] = np.lib.stride_tricks.sliding_window_view(values, period).min(axis=1)
+    return out
+
+
+def rolling_std(values: np.ndarray, period: int) -> np.ndarray:
+    """滚动总体标准差"""
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        out[period - 1:] = np.lib.stride_tricks.sliding_window_view(values, period).std(axis=1)
+    return out
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> Dict[str, np.ndarray]:
+    """MACD，柱状线按国内习惯取 2 × (DIF - DEA)"""
+    dif = ema(close, fast) - ema(close, slow)
+    dea = ema(dif, signal)
+    return {"dif": dif, "dea": dea, "hist": 2 * (dif - dea)}
+
+
+def rsi(close: np.ndarray, period: int) -> np.ndarray:
+    """RSI，涨跌幅按 SMA(X, N, 1) 平滑（alpha = 1/N）"""
+    out = np.full(len(close), np.nan)
+    if len(close) < 2:
+        return out
+    change = np.diff(close)
+    gain = ewm(np.maximum(change, 0.0), 1.0 / period)
+    total = ewm(np.abs(change), 1.0 / period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[1:] = np.where(total > 0, gain / total * 100, 50.0)
+    return out
+
+
+def kdj(high: np.ndarray, low: np.ndarray, close: np.ndarray,
+        period: int = 9, k_smooth: int = 3, d_smooth: int = 3) -> Dict[str, np.ndarray]:
+    """KDJ(9,3,3)"""
+    highest = rolling_max(high, period)
+    lowest = rolling_min(low, period)
+    # 预热期用已有数据的最高最低价，与常见行情软件一致
+    for i in range(min(period - 1, len(close))):
+        highest[i] = high[:i + 1].max()
+        lowest[i] = low[:i + 1].min()
+    span_range = highest - lowest
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsv = np.where(span_range > 0, (close - lowest) / span_range * 100, 50.0)
+    k = ewm(rsv, 1.0 / k_smooth)
+    d = ewm(k, 1.0 / d_smooth)
+    return {"k": k, "d": d, "j": 3 * k - 2 * d}
+
+
+def bollinger(close: np.ndarray, period: int = 20, width: float = 2.0) -> Dict[str, np.ndarray]:
+    """布林带(20, 2)"""
+    mid = sma(close, period)
+    std = rolling_std(close, period)
+    return {"mid": mid, "upper": mid + width * std, "lower": mid - width * std}
+
+
+def compute_indicators(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    从日K线计算全部指标序列
+
+    Args:
+        rows: 按日期升序的K线记录，需包含 date、high、low、close、volume
+
+    Returns:
+        指标序列字典，键为 dates、close、ma5、macd_dif、rsi6、kdj_k、boll_upper 等
+    """
+    rows = [row for row in rows if row.get("close") is not None]
+    close = np.array([float(row["close"]) for row in rows])
+    high = np.array([float(row.get("high") or row["close"]) for row in rows])
+    low = np.array([float(row.get("low") or row["close"]) for row in rows])
+    volume = np.array([float(row.get("volume") or 0.0) for row in rows])
+
+    series: Dict[str, Any] = {
+        "dates": [row["date"] for row in rows],
+        "close": close, "high": high, "low": low, "volume": volume,
+        "vol_ma5": sma(volume, 5), "vol_ma20": sma(volume, 20),
+    }
+    for period in MA_PERIODS:
+        series[f"ma{period}"] = sma(close, period)
+    for key, values in macd(close).items():
+        series[f"macd_{key}"] = values
+    for period in RSI_PERIODS:
+        series[f"rsi{period}"] = rsi(close, period)
+    for key, values in kdj(high, low, close).items():
+        series[f"kdj_{key}"] = values
+    for key, values in bollinger(close).items():
+        series[f"boll_{key}"] = values
+    return series
+
+
+# ----------------------------------------------------------------------
+# 摘要
+# ----------------------------------------------------------------------
+
+def _fmt(value: float, digits: int = 2) -> str:
+    return "-" if value is None or np.isnan(value) else f"{value:.{digits}f}"
+
+
+def _pct(close: np.ndarray, days: int) -> str:
+    if len(close) <= days or close[-days - 1] == 0:
+        return "-"
+    return f"{(close[-1] / close[-days - 1] - 1) * 100:+.1f}%"
+
+
+def _last_cross(fast: np.ndarray, slow: np.ndarray, dates: List[str], window: int = 20) -> str:
+    """最近window个交易日内fast与slow的最后一次交叉"""
+    diff = fast[-window - 1:] - slow[-window - 1:]
+    valid = ~np.isnan(diff)
+    sign = np.sign(diff)
+    crosses = np.where(valid[1:] & valid[:-1] & (sign[1:] != sign[:-1]) & (sign[1:] != 0))[0]
+    if not len(crosses):
+        return f"近{window}日无交叉"
+    index = crosses[-1] + 1
+    kind = "金叉" if sign[index] > 0 else "死叉"
+    days_ago = len(diff) - 1 - index
+    return f"{kind}于 {dates[-len(diff) + index]}（{days_ago}个交易日前）"
+
+
+def summarize_indicators(series: Dict[str, Any], end: Optional[int] = None, recent_points: int = 10) -> str:
+    """
+    将指标序列截至第end个交易日（不含）的最新状态压缩为摘要文本
+
+    Args:
+        series: compute_indicators 的结果
+        end: 截取位置，默认使用全部数据
+        recent_points: 附带的最近收盘价个数
+
+    Returns:
+        Markdown格式的指标摘要
+    """
+    end = len(series["dates"]) if end is None else end
+    if end < 2:
+        return ""
+    s = {key: value[:end] for key, value in series.items()}
+    close, dates = s["close"], s["dates"]
+    last = {key: value[-1] for key, value in s.items() if key != "dates"}
+
+    mas = [last[f"ma{p}"] for p in MA_PERIODS]
+    if not any(np.isnan(mas)):
+        if all(a > b for a, b in zip(mas, mas[1:])):
+            arrangement = "多头排列"
+        elif all(a < b for a, b in zip(mas, mas[1:])):
+            arrangement = "空头排列"
+        else:
+            arrangement = "均线交织"
+    else:
+        arrangement = "数据不足"
+    above_ma20 = "上方" if last["close"] >= last["ma20"] else "下方"
+
+    rsi_states = []
+    for period in RSI_PERIODS:
+        value = last[f"rsi{period}"]
+        label = "超买" if value > 80 else "超卖" if value < 20 else ""
+        rsi_states.append(f"RSI{period} {_fmt(value, 1)}{label}")
+
+    band = last["boll_upper"] - last["boll_lower"]
+    percent_b = (last["close"] - last["boll_lower"]) / band if band and not np.isnan(band) else np.nan
+    bandwidth = band / last["boll_mid"] * 100 if last["boll_mid"] else np.nan
+
+    vol_ratio = last["volume"] / last["vol_ma5"] if last["vol_ma5"] else np.nan
+    vol_trend = last["vol_ma5"] / last["vol_ma20"] if last["vol_ma20"] else np.nan
+
+    high20, low20 = s["high"][-20:].max(), s["low"][-20:].min()
+    high60, low60 = s["high"][-60:].max(), s["low"][-60:].min()
+    recent = ", ".join(f"{value:.2f}" for value in close[-recent_points:])
+
+    return "\n".join([
+        f"## 本地计算的技术指标（截至 {dates[-1]}，基于 {len(close)} 个交易日K线）",
+        f"- 收盘价: {_fmt(last['close'])}（5日 {_pct(close, 5)}，20日 {_pct(close, 20)}，60日 {_pct(close, 60)}）",
+        f"- 区间: 20日最高 {_fmt(high20)} / 最低 {_fmt(low20)}；60日最高 {_fmt(high60)} / 最低 {_fmt(low60)}",
+        f"- 均线: " + "，".join(f"MA{p} {_fmt(v)}" for p, v in zip(MA_PERIODS, mas))
+        + f"；{arrangement}，收盘价位于MA20{above_ma20}",
+        f"- MACD(12,26,9): DIF {_fmt(last['macd_dif'], 3)}，DEA {_fmt(last['macd_dea'], 3)}，"
+        f"柱 {_fmt(last['macd_hist'], 3)}；{_last_cross(s['macd_dif'], s['macd_dea'], dates)}",
+        f"- RSI: " + "，".join(rsi_states),
+        f"- KDJ(9,3,3): K {_fmt(last['kdj_k'], 1)}，D {_fmt(last['kdj_d'], 1)}，J {_fmt(last['kdj_j'], 1)}；"
+        f"{_last_cross(s['kdj_k'], s['kdj_d'], dates, window=10)}",
+        f"- 布林带(20,2): 上轨 {_fmt(last['boll_upper'])}，中轨 {_fmt(last['boll_mid'])}，下轨 {_fmt(last['boll_lower'])}；"
+        f"%B {_fmt(percent_b)}，带宽 {_fmt(bandwidth, 1)}%",
+        f"- 成交量: 量比(当日/5日均量) {_fmt(vol_ratio)}，5日/20日均量 {_fmt(vol_trend)}",
+        f"- 最近{min(recent_points, len(close))}日收盘: {recent}",
+    ])
+
+
+# ----------------------------------------------------------------------
+# K线加载与缓存
+# ----------------------------------------------------------------------
+
+def load_k_data(code: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """从本地数据存储读取K线，缺失时从baostock同步（MCP_BACKEND=replay 时只读本地）"""
+    from market_data_store import get_default_store
+
+    store = get_default_store()
+    rows = store.get_k_data(code, start_date, end_date)
+    if os.getenv("MCP_BACKEND", "http") == "replay":
+        return rows
+    # 只补同步缺失的部分：通常是最后一根K线之后到最近交易日的几天
+    sync_start = store.missing_k_data_start(rows, start_date, end_date)
+    if sync_start is None:
+        return rows
+
+    from market_data_store import baostock_session
+
+    with span("data", "baostock.indicator_k_data"), baostock_session() as bs:
+        store.sync_k_data(bs, code, sync_start, end_date)
+    return store.get_k_data(code, start_date, end_date)
+
+
+def _default_loader() -> Callable[[str, str, str], List[Dict[str, Any]]]:
+    if os.getenv("MCP_BACKEND", "http") == "stub":
+        from offline_backend import synthetic_k_data
+        return synthetic_k_data
+    return load_k_data
+
+
+class IndicatorEngine:
+    """
+    按股票缓存指标序列
+
+    每只股票缓存一段已计算的序列，查询日期在范围内时直接截取，
+    超出范围时向后扩展加载并整段重新计算
+    """
+
+    def __init__(self, loader: Optional[Callable[[str, str, str], List[Dict[str, Any]]]] = None,
+                 lookback_days: int = LOOKBACK_DAYS):
+        self.loader = loader or _default_loader()
+        self.lookback_days = lookback_days
+        self._series: Dict[str, Dict[str, Any]] = {}
+        # _lock 只保护字典和计数；加载按股票加锁，不同股票的网络同步可以并行
+        self._lock = threading.Lock()
+        self._code_locks: Dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.hits = 0
+
+    def _lookup(self, code: str, required_start: str, as_of: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._series.get(code)
+            if (entry and entry["start"] <= required_start and as_of <= entry["end"]
+                    and (entry["expires"] is None or time.monotonic() < entry["expires"])):
+                self.hits += 1
+                return entry
+            return None
+
+    def _ensure_series(self, code: str, as_of: str) -> Dict[str, Any]:
+        as_of_dt = datetime.strptime(as_of, "%Y-%m-%d")
+        required_start = (as_of_dt - timedelta(days=self.lookback_days)).strftime("%Y-%m-%d")
+        entry = self._lookup(code, required_start, as_of)
+        if entry:
+            return entry
+
+        with self._lock:
+            code_lock = self._code_locks.setdefault(code, threading.Lock())
+        with code_lock:
+            # 等锁期间其他线程可能已经加载
+            entry = self._lookup(code, required_start, as_of)
+            if entry:
+                return entry
+            with self._lock:
+                previous = self._series.get(code)
+            start = min(previous["start"], required_start) if previous else required_start
+            # 历史日期向后多加载一段，回测逐日推进时无需每次重新加载
+            today = datetime.now().strftime("%Y-%m-%d")
+            end = min((as_of_dt + timedelta(days=EXTEND_DAYS)).strftime("%Y-%m-%d"), today)
+            end = max(end, as_of)
+            with span("data", "indicators.load"):
+                rows = self.loader(code, start, end)
+            with span("data", "indicators.compute"):
+                series = compute_indicators(rows)
+            # 加载到今天的序列之后可能发布新K线，只在 LIVE_SERIES_TTL 内复用
+            expires = time.monotonic() + LIVE_SERIES_TTL if end >= today else None
+            entry = {"start": start, "end": end, "expires": expires, "series": series}
+            with self._lock:
+                self._series[code] = entry
+                self.loads += 1
+            return entry
+
+    def get_summary(self, code: str, as_of: str) -> Optional[str]:
+        """
+        获取截至as_of（含）的指标摘要
+
+        Args:
+            code: 股票代码
+            as_of: 截止日期 YYYY-MM-DD
+
+        Returns:
+            摘要文本，K线不足时返回None
+        """
+        series = self._ensure_series(code, as_of)["series"]
+        end = int(np.searchsorted(np.array(series["dates"]), as_of, side="right"))
+        if end < max(MA_PERIODS):
+            return None
+        return summarize_indicators(series, end)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"stocks": len(self._series), "loads": self.loads, "hits": self.hits}
+
+
+_shared_engine: Optional[IndicatorEngine] = None
+
+
+def local_indicators_enabled() -> bool:
+    return os.getenv("LOCAL_INDICATORS_ENABLED", "1") != "0"
+
+
+def get_shared_indicator_engine() -> Optional[IndicatorEngine]:
+    """获取进程内共享的指标引擎，LOCAL_INDICATORS_ENABLED=0 时返回None"""
+    global _shared_engine
+    if not local_indicators_enabled():
+        return None
+    if _shared_engine is None:
+        _shared_engine = IndicatorEngine()
+    return _shared_engine
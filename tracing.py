@@ -0,0 +1,318 @@
+"""
+链路追踪与指标
+
+为工作流节点、Agent、LLM调用（含token数）、MCP工具调用和行情取数记录耗时span，
+每次分析/回测决策携带独立的 trace_id，span汇总为延迟直方图和计数器，
+以 Prometheus 文本格式在 /metrics 暴露
+"""
+
+import functools
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# 当前运行的trace_id，asyncio任务和gather子任务自动继承
+TRACE_ID: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+# 延迟直方图的桶边界（秒），覆盖从毫秒级取数到数分钟的完整分析
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Counter:
+    """Prometheus计数器"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Prometheus直方图"""
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._values: Dict[LabelKey, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.setdefault(
+                key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': f'{bound:g}'})} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class Gauge:
+    """Prometheus仪表，导出时调用 collect 读取当前值"""
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.collect():g}"]
+
+
+# 指标定义
+SPAN_DURATION = Histogram("mcp_agent_span_duration_seconds", "各阶段耗时（节点/Agent/LLM/工具/取数）")
+SPAN_TOTAL = Counter("mcp_agent_span_total", "各阶段执行次数，按结果状态区分")
+LLM_TOKENS = Counter("mcp_agent_llm_tokens_total", "LLM调用的token数，按Agent和模型区分")
+LLM_CALL_DURATION = Histogram("mcp_agent_llm_call_seconds", "单次LLM调用耗时，按Agent和模型区分")
+TRACES_TOTAL = Counter("mcp_agent_traces_total", "分析运行次数")
+
+METRICS = [SPAN_DURATION, SPAN_TOTAL, LLM_TOKENS, LLM_CALL_DURATION, TRACES_TOTAL]
+
+# 最近的span记录，便于按trace_id排查单次运行
+RECENT_SPANS: Deque[Dict[str, Any]] = deque(maxlen=2000)
+
+
+def get_trace_id() -> Optional[str]:
+    return TRACE_ID.get()
+
+
+@contextmanager
+def start_trace(kind: str, trace_id: Optional[str] = None) -> Iterator[str]:
+    """
+    开始一次运行的追踪，已在追踪中时复用外层trace_id
+
+    Args:
+        kind: 运行类型，如 "analysis"、"backtest_decision"
+        trace_id: 指定的trace_id，默认生成
+    """
+    if TRACE_ID.get() is not None and trace_id is None:
+        yield TRACE_ID.get()
+        return
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    token = TRACE_ID.set(trace_id)
+    TRACES_TOTAL.inc(kind=kind)
+    try:
+        with span("run", kind):
+            yield trace_id
+    finally:
+        TRACE_ID.reset(token)
+
+
+def record_span(kind: str, name: str, duration: float, status: str = "ok",
+                trace_id: Optional[str] = None, **attributes):
+    """记录一个已结束的span"""
+    SPAN_DURATION.observe(duration, kind=kind, name=name)
+    SPAN_TOTAL.inc(kind=kind, name=name, status=status)
+    RECENT_SPANS.append({
+        "trace_id": trace_id or TRACE_ID.get(),
+        "kind": kind,
+        "name": name,
+        "status": status,
+        "duration": round(duration, 6),
+        "end_time": time.time(),
+        **attributes,
+    })
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes) -> Iterator[None]:
+    """
+    记录代码块耗时，同步和异步代码均可使用
+
+    Args:
+        kind: span类型，如 "node"、"agent"、"llm"、"tool"、"data"
+        name: span名称
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record_span(kind, name, time.perf_counter() - start, status, **attributes)
+
+
+def traced_node(name: str, func):
+    """包装工作流节点，每次执行记录一个 node span"""
+    @functools.wraps(func)
+    async def wrapper(state):
+        with span("node", name):
+            return await func(state)
+    return wrapper
+
+
+def record_llm_tokens(model: str, input_tokens: int = 0, output_tokens: int = 0, agent: str = "-"):
+    if input_tokens:
+        LLM_TOKENS.inc(input_tokens, agent=agent, model=model, type="input")
+    if output_tokens:
+        LLM_TOKENS.inc(output_tokens, agent=agent, model=model, type="output")
+
+
+def llm_usage_summary() -> List[Dict[str, Any]]:
+    """按 (Agent, 模型) 汇总LLM调用次数、平均耗时和token数，用于比较模型路由配置"""
+    usage: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def entry(labels: Dict[str, str]) -> Dict[str, Any]:
+        key = (labels.get("agent", "-"), labels.get("model", "llm"))
+        return usage.setdefault(key, {"agent": key[0], "model": key[1], "calls": 0, "seconds": 0.0,
+                                      "input_tokens": 0, "output_tokens": 0})
+
+    with LLM_CALL_DURATION._lock:
+        for key, series in LLM_CALL_DURATION._values.items():
+            item = entry(dict(key))
+            item["calls"] += series["count"]
+            item["seconds"] += series["sum"]
+    with LLM_TOKENS._lock:
+        for key, value in LLM_TOKENS._values.items():
+            labels = dict(key)
+            entry(labels)[f"{labels.get('type')}_tokens"] += int(value)
+
+    result = []
+    for item in usage.values():
+        calls = item["calls"] or 1
+        item["seconds"] = round(item["seconds"], 3)
+        item["avg_seconds"] = round(item["seconds"] / calls, 3)
+        item["avg_input_tokens"] = round(item["input_tokens"] / calls, 1)
+        item["avg_output_tokens"] = round(item["output_tokens"] / calls, 1)
+        result.append(item)
+    return sorted(result, key=lambda item: (item["agent"], item["model"]))
+
+
+def get_trace_spans(trace_id: str) -> List[Dict[str, Any]]:
+    return [item for item in RECENT_SPANS if item["trace_id"] == trace_id]
+
+
+def register_metrics(*metrics):
+    """注册其他模块定义的指标，随 /metrics 一起导出"""
+    for metric in metrics:
+        if metric not in METRICS:
+            METRICS.append(metric)
+
+
+def render_metrics() -> str:
+    """以Prometheus文本格式导出全部指标"""
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_callback_handler = None
+
+
+def get_tracing_callbacks() -> list:
+    """获取记录LLM和工具调用span的LangChain回调（首次调用时创建）"""
+    global _callback_handler
+    if _callback_handler is None:
+        from langchain_core.callbacks import AsyncCallbackHandler
+
+        class TracingCallbackHandler(AsyncCallbackHandler):
+            """按run_id计时LLM调用和工具调用"""
+
+            def __init__(self):
+                self._starts: Dict[Any, Tuple[float, str, Optional[str]]] = {}
+                self._agents: Dict[Any, str] = {}
+
+            async def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+                model = (metadata or {}).get("ls_model_name") or "llm"
+                self._starts[run_id] = (time.perf_counter(), model, TRACE_ID.get())
+                # Agent在执行配置的 metadata 中标注，随子运行传递
+                self._agents[run_id] = (metadata or {}).get("agent") or "-"
+
+            async def on_llm_end(self, response, *, run_id, **kwargs):
+                started = self._starts.pop(run_id, None)
+                agent = self._agents.pop(run_id, "-")
+                if started is None:
+                    return
+                start, model, trace_id = started
+                duration = time.perf_counter() - start
+                input_tokens, output_tokens = _usage_from_response(response)
+                record_llm_tokens(model, input_tokens, output_tokens, agent=agent)
+                LLM_CALL_DURATION.observe(duration, agent=agent, model=model)
+                record_span("llm", model, duration, trace_id=trace_id, agent=agent,
+                            input_tokens=input_tokens, output_tokens=output_tokens)
+
+            async def on_llm_error(self, error, *, run_id, **kwargs):
+                self._agents.pop(run_id, None)
+                started = self._starts.pop(run_id, None)
+                if started:
+                    record_span("llm", started[1], time.perf_counter() - started[0], "error",
+                                trace_id=started[2])
+
+            async def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+                name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+                self._starts[run_id] = (time.perf_counter(), name, TRACE_ID.get())
+
+            async def on_tool_end(self, output, *, run_id, **kwargs):
+                started = self._starts.pop(run_id, None)
+                if started:
+                    record_span("tool", started[1], time.perf_counter() - started[0], trace_id=started[2])
+
+            async def on_tool_error(self, error, *, run_id, **kwargs):
+                started = self._starts.pop(run_id, None)
+                if started:
+                    record_span("tool", started[1], time.perf_counter() - started[0], "error",
+                                trace_id=started[2])
+
+        _callback_handler = TracingCallbackHandler()
+    return [_callback_handler]
+
+
+def _usage_from_response(response) -> Tuple[int, int]:
+    """从LLM响应中提取输入/输出token数"""
+    try:
+        message = response.generations[0][0].message
+        usage = getattr(message, "usage_metadata", None) or {}
+        if usage:
+            return int(usage.get("input_tokens", 0)), int(usage.get("output_tokens", 0))
+    except (AttributeError, IndexError):
+        pass
+    usage = (getattr(response, "llm_output", None) or {}).get("usage_metadata") or {}
+    return int(usage.get("prompt_token_count", 0)), int(usage.get("candidates_token_count", 0))
@@ -0,0 +1,379 @@
+"""
+估值历史预计算
+
+从本地数据存储批量读取日K线中的估值字段（peTTM、pbMRQ、psTTM、pcfNcfTTM，
+即 query_history_k_data_plus 提供的估值指标）的完整历史，用 NumPy 一次性计算：
+- 滚动历史分位：当日估值在近3年、近10年估值中的分位
+- 分位带：近3年估值的10%/50%/90%分位值，以及对应的股价区间
+- 行业横截面分位：同一行业（本地数据存储中的行业分类）股票当日估值中的分位和行业中位数
+
+每只股票只加载计算一次，估值分析Agent运行时按分析日期二分查找取出当日快照注入提示词，
+替代通过 get_valuation_metrics 获取一段历史再让模型在文本中推断区间的方式。
+
+数据来源与技术指标引擎一致：本地数据存储，缺失时从baostock同步（MCP_BACKEND=replay 只读本地，
+MCP_BACKEND=stub 使用合成数据）。同行业股票只使用本地已有的数据，可以用命令行预先同步：
+    python valuation_history.py sh.600519 --peers
+"""
+
+import bisect
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tracing import span
+
+# 估值字段 -> 名称
+METRICS = [("peTTM", "市盈率TTM"), ("pbMRQ", "市净率MRQ"), ("psTTM", "市销率TTM"), ("pcfNcfTTM", "市现率TTM")]
+
+# 滚动分位窗口（交易日）
+WINDOWS = {"3y": 750, "10y": 2500}
+
+# 计算分位带的窗口和分位点
+BAND_WINDOW = "3y"
+BAND_QUANTILES = (0.1, 0.5, 0.9)
+
+# 窗口内有效数据少于该数量时不计算分位
+MIN_PERIODS = 250
+
+# 行业横截面分位所需的最少同行数量
+MIN_PEERS = 5
+
+# 估值历史的起始日期
+HISTORY_START = os.getenv("VALUATION_HISTORY_START", "2010-01-01")
+
+# 回测向后扩展加载范围时多加载的天数
+EXTEND_DAYS = 180
+
+# 分块计算滚动窗口，限制 (行数 × 窗口) 的临时数组大小
+_CHUNK_ROWS = 512
+
+
+# ----------------------------------------------------------------------
+# 向量化计算
+# ----------------------------------------------------------------------
+
+def _valid(values: np.ndarray) -> np.ndarray:
+    """估值为负（亏损、净资产为负）或缺失时没有可比性，视为无效"""
+    return np.where(np.isfinite(values) & (values > 0), values, np.nan)
+
+
+def rolling_percentiles(values: np.ndarray, window: int, quantiles: Tuple[float, ...] = (),
+                        min_periods: int = MIN_PERIODS) -> Dict[str, np.ndarray]:
+    """
+    滚动历史分位和分位值
+
+    Args:
+        values: 按日期升序的估值序列
+        window: 窗口长度（交易日），历史不足一个窗口时使用全部已有数据
+        quantiles: 需要计算分位值的分位点
+        min_periods: 窗口内最少有效数据数
+
+    Returns:
+        {"percentile": 当日估值的分位(0-1), "q10": 10%分位值, ...}，无法计算处为NaN
+    """
+    x = _valid(np.asarray(values, dtype=float))
+    n = len(x)
+    out = {"percentile": np.full(n, np.nan)}
+    out.update({f"q{int(q * 100)}": np.full(n, np.nan) for q in quantiles})
+    if not n:
+        return out
+    padded = np.concatenate([np.full(window - 1, np.nan), x])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    for start in range(0, n, _CHUNK_ROWS):
+        block = windows[start:start + _CHUNK_ROWS]
+        current = x[start:start + len(block)]
+        count = np.sum(~np.isnan(block), axis=1)
+        enough = (count >= min_periods) & ~np.isnan(current)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            percentile = np.sum(block <= current[:, None], axis=1) / count
+        out["percentile"][start:start + len(block)] = np.where(enough, percentile, np.nan)
+        if not quantiles:
+            continue
+        # NaN 排在每行末尾，前 count 个为有效值，按线性插值取分位值
+        ordered = np.sort(block, axis=1)
+        rows = np.arange(len(block))
+        for q in quantiles:
+            position = q * np.maximum(count - 1, 0)
+            lower = np.floor(position).astype(int)
+            upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+            fraction = position - lower
+            value = ordered[rows, lower] * (1 - fraction) + ordered[rows, upper] * fraction
+            out[f"q{int(q * 100)}"][start:start + len(block)] = np.where(enough, value, np.nan)
+    return out
+
+
+def cross_section_percentiles(target: np.ndarray, peers: np.ndarray,
+                              min_peers: int = MIN_PEERS) -> Dict[str, np.ndarray]:
+    """
+    横截面分位
+
+    Args:
+        target: 目标股票的估值序列，形状 (日期数,)
+        peers: 同行的估值矩阵，形状 (日期数, 同行数)，缺失为NaN
+
+    Returns:
+        {"percentile": 目标在同行中的分位, "median": 同行中位数, "count": 有效同行数}
+    """
+    target = _valid(np.asarray(target, dtype=float))
+    peers = _valid(np.asarray(peers, dtype=float))
+    count = np.sum(~np.isnan(peers), axis=1)
+    enough = (count >= min_peers) & ~np.isnan(target)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        percentile = np.sum(peers <= target[:, None], axis=1) / count
+    median = np.full(len(target), np.nan)
+    if peers.shape[1]:
+        rows = count > 0
+        median[rows] = np.nanmedian(peers[rows], axis=1)
+    return {
+        "percentile": np.where(enough, percentile, np.nan),
+        "median": np.where(count >= min_peers, median, np.nan),
+        "count": count,
+    }
+
+
+def compute_valuation_history(rows: List[Dict[str, Any]],
+                              peer_rows: Optional[Dict[str, List[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+    """
+    计算估值历史分位、分位带和行业横截面分位
+
+    Args:
+        rows: 目标股票按日期升序的日K线（含估值字段）
+        peer_rows: 同行股票代码 -> 日K线
+
+    Returns:
+        各序列与 dates 等长的字典
+    """
+    dates = [row["date"] for row in rows]
+    series: Dict[str, Any] = {
+        "dates": dates,
+        "close": np.array([row.get("close") or np.nan for row in rows], dtype=float),
+        "peers": 0,
+    }
+    index = {date: i for i, date in enumerate(dates)}
+    peer_matrices = {}
+    if peer_rows:
+        series["peers"] = len(peer_rows)
+        for metric, _ in METRICS:
+            matrix = np.full((len(dates), len(peer_rows)), np.nan)
+            for column, peer in enumerate(peer_rows.values()):
+                for row in peer:
+                    i = index.get(row["date"])
+                    if i is not None and row.get(metric) is not None:
+                        matrix[i, column] = row[metric]
+            peer_matrices[metric] = matrix
+
+    for metric, _ in METRICS:
+        values = np.array([row.get(metric) if row.get(metric) is not None else np.nan for row in rows],
+                          dtype=float)
+        series[metric] = values
+        for name, window in WINDOWS.items():
+            quantiles = BAND_QUANTILES if name == BAND_WINDOW else ()
+            result = rolling_percentiles(values, window, quantiles)
+            series[f"{metric}_pct_{name}"] = result.pop("percentile")
+            for key, value in result.items():
+                series[f"{metric}_{key}"] = value
+        if metric in peer_matrices:
+            result = cross_section_percentiles(values, peer_matrices[metric])
+            series[f"{metric}_industry_pct"] = result["percentile"]
+            series[f"{metric}_industry_median"] = result["median"]
+            series[f"{metric}_industry_count"] = result["count"]
+    return series
+
+
+def _fmt(value: float, digits: int = 2) -> str:
+    return "-" if value is None or np.isnan(value) else f"{value:.{digits}f}"
+
+
+def _pct(value: float) -> str:
+    return "-" if value is None or np.isnan(value) else f"{value * 100:.0f}%"
+
+
+def summarize_valuation(series: Dict[str, Any], i: int, industry: Optional[str] = None) -> str:
+    """
+    第i个交易日的估值快照
+
+    Returns:
+        Markdown表格
+    """
+    close = series["close"][i]
+    has_industry = f"{METRICS[0][0]}_industry_pct" in series
+    header = ["指标", "当前值", "近3年分位", "近10年分位", "近3年10%/50%/90%分位值", "对应股价区间"]
+    if has_industry:
+        header += ["行业分位", "行业中位数"]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for metric, label in METRICS:
+        value = series[metric][i]
+        bands = [series[f"{metric}_q{int(q * 100)}"][i] for q in BAND_QUANTILES]
+        band_values = " / ".join(_fmt(b) for b in bands)
+        if value > 0 and not np.isnan(close):
+            # 估值回到分位值时的股价：价格 × 分位值 / 当前估值
+            band_prices = " / ".join(_fmt(close * b / value) for b in bands)
+        else:
+            band_prices = "-"
+        cells = [label, _fmt(value), _pct(series[f"{metric}_pct_3y"][i]), _pct(series[f"{metric}_pct_10y"][i]),
+                 band_values, band_prices]
+        if has_industry:
+            cells += [_pct(series[f"{metric}_industry_pct"][i]), _fmt(series[f"{metric}_industry_median"][i])]
+        lines.append("| " + " | ".join(cells) + " |")
+
+    history_days = i + 1
+    title = f"## 估值历史分位（截至 {series['dates'][i]}，基于 {history_days} 个交易日估值历史，收盘价 {_fmt(close)}）"
+    notes = ["分位表示当前估值在历史（或同行）中的位置，越低越便宜；负值估值（亏损等）不参与分位计算。"]
+    if has_industry:
+        peers = int(max(series[f"{metric}_industry_count"][i] for metric, _ in METRICS))
+        notes.append(f"行业: {industry or '未知'}，当日有估值数据的同行 {peers} 只（本地数据存储）。")
+    return "\n".join([title, *lines, "", *notes])
+
+
+# ----------------------------------------------------------------------
+# 数据加载与缓存
+# ----------------------------------------------------------------------
+
+def load_valuation_rows(code: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """从本地数据存储读取日K线，历史不完整时从baostock同步（MCP_BACKEND=replay 时只读本地）"""
+    from market_data_store import get_default_store
+
+    store = get_default_store()
+    rows = store.get_k_data(code, start_date, end_date)
+    if os.getenv("MCP_BACKEND", "http") == "replay":
+        return rows
+    # 估值历史起点可能早于上市日，开头允许缺一个月
+    sync_start = store.missing_k_data_start(rows, start_date, end_date, head_tolerance_days=31)
+    if sync_start is None:
+        return rows
+
+    from market_data_store import baostock_session
+
+    with span("data", "baostock.valuation_history"), baostock_session() as bs:
+        store.sync_k_data(bs, code, sync_start, end_date)
+    return store.get_k_data(code, start_date, end_date)
+
+
+def load_industry_peers(code: str, start_date: str, end_date: str) -> Tuple[Optional[str], Dict[str, List[Dict[str, Any]]]]:
+    """同一行业中本地已有数据的股票的日K线"""
+    from market_data_store import get_default_store
+
+    store = get_default_store()
+    industry_rows = store.get_stock_industry(code)
+    industry = industry_rows[0]["industry"] if industry_rows else None
+    if not industry:
+        return None, {}
+    peers = [c for c in store.get_industry_codes(industry) if c != code]
+    return industry, store.get_k_data_many(peers, start_date, end_date)
+
+
+def _default_loaders():
+    if os.getenv("MCP_BACKEND", "http") == "stub":
+        from offline_backend import synthetic_k_data
+        return synthetic_k_data, lambda code, start, end: (None, {})
+    return load_valuation_rows, load_industry_peers
+
+
+class ValuationEngine:
+    """
+    按股票缓存估值历史序列
+
+    每只股票加载一次完整历史并计算全部分位序列，查询时二分查找分析日期所在的交易日；
+    分析日期超出已加载范围时向后扩展并重新计算
+    """
+
+    def __init__(self, loader: Optional[Callable[[str, str, str], List[Dict[str, Any]]]] = None,
+                 peer_loader: Optional[Callable[[str, str, str], Tuple[Optional[str], Dict[str, Any]]]] = None,
+                 history_start: str = HISTORY_START):
+        default_loader, default_peer_loader = _default_loaders()
+        self.loader = loader or default_loader
+        self.peer_loader = peer_loader or default_peer_loader
+        self.history_start = history_start
+        self._series: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+
+    def _ensure_series(self, code: str, as_of: str) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._series.get(code)
+            if entry and as_of <= entry["end"]:
+                self.hits += 1
+                return entry
+
+            today = datetime.now().strftime("%Y-%m-%d")
+            end = min((datetime.strptime(as_of, "%Y-%m-%d") + timedelta(days=EXTEND_DAYS)).strftime("%Y-%m-%d"), today)
+            end = max(end, as_of)
+            start = min(self.history_start, as_of)
+            with span("data", "valuation.load"):
+                rows = self.loader(code, start, end)
+                industry, peer_rows = self.peer_loader(code, start, end)
+            with span("data", "valuation.compute"):
+                series = compute_valuation_history(rows, peer_rows)
+            entry = {"end": end, "series": series, "industry": industry}
+            self._series[code] = entry
+            self.loads += 1
+            return entry
+
+    def get_summary(self, code: str, as_of: str) -> Optional[str]:
+        """
+        获取截至as_of（含）最近一个交易日的估值快照
+
+        Args:
+            code: 股票代码
+            as_of: 分析日期 YYYY-MM-DD
+
+        Returns:
+            Markdown表格，没有估值数据时返回None
+        """
+        entry = self._ensure_series(code, as_of)
+        series = entry["series"]
+        i = bisect.bisect_right(series["dates"], as_of) - 1
+        if i < 0 or all(np.isnan(series[metric][i]) for metric, _ in METRICS):
+            return None
+        return summarize_valuation(series, i, entry["industry"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"stocks": len(self._series), "loads": self.loads, "hits": self.hits}
+
+
+_shared_engine: Optional[ValuationEngine] = None
+
+
+def valuation_history_enabled() -> bool:
+    return os.getenv("VALUATION_HISTORY_ENABLED", "1") != "0"
+
+
+def get_shared_valuation_engine() -> Optional[ValuationEngine]:
+    """获取进程内共享的估值引擎，VALUATION_HISTORY_ENABLED=0 时返回None"""
+    global _shared_engine
+    if not valuation_history_enabled():
+        return None
+    if _shared_engine is None:
+        _shared_engine = ValuationEngine()
+    return _shared_engine
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from market_data_store import get_default_store
+
+    parser = argparse.ArgumentParser(description="同步估值历史到本地数据存储")
+    parser.add_argument("codes", nargs="+", help="股票代码，如 sh.600519")
+    parser.add_argument("--peers", action="store_true", help="同时同步同行业全部股票")
+    parser.add_argument("--start", default=HISTORY_START, help="开始日期 YYYY-MM-DD")
+    parser.add_argument("--end", default=datetime.now().strftime("%Y-%m-%d"), help="结束日期 YYYY-MM-DD")
+    args = parser.parse_args()
+
+    store = get_default_store()
+    with store.baostock_session() as session:
+        store.sync_industry(session)
+        codes = list(args.codes)
+        if args.peers:
+            for code in args.codes:
+                industry_rows = store.get_stock_industry(code)
+                if industry_rows and industry_rows[0]["industry"]:
+                    codes += [c for c in store.get_industry_codes(industry_rows[0]["industry"]) if c not in codes]
+        for index, code in enumerate(codes, 1):
+            count = store.sync_k_data(session, code, args.start, args.end)
+            print(f"📥 [{index}/{len(codes)}] {code} K线 {count} 条")
+    print(f"✅ 同步完成: {len(codes)} 只股票")
@@ -0,0 +1,343 @@
+"""
+WebSocket广播扇出
+
+每个连接有一个有界发送队列和独立的写任务，广播只把消息放入各连接的队列，
+耗时取决于入队而不是最慢的客户端网络。连接按 id(websocket) 登记，注册和移除均为O(1)。
+
+发送队列写满时按慢消费者策略处理（WS_SLOW_CONSUMER_POLICY）：
+- drop: 丢弃队列中最旧的消息
+- coalesce: 带合并键的消息替换队列中同键的未发送消息（只保留最新状态），队满时丢弃最旧的消息
+- disconnect: 断开跟不上的客户端（关闭码1008）
+
+队列长度由 WS_BROADCAST_QUEUE_SIZE 调整，默认256。广播耗时和各连接的处理结果在 /metrics 导出
+
+单个连接的消息（分析日志、报告产物、心跳应答）经 channel(websocket) 进入同一个发送队列，
+与广播保持顺序；队满时等待写任务腾出空间而不是丢弃，慢消费者策略只作用于广播
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import WebSocket
+
+from tracing import Counter, Gauge, Histogram, register_metrics
+
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+BROADCAST_QUEUE_SIZE = int(os.getenv("WS_BROADCAST_QUEUE_SIZE", "256"))
+SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+
+# 慢消费者被断开时使用的关闭码（policy violation）
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+# 广播只是入队，耗时在微秒到毫秒级
+FANOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+BROADCAST_MESSAGES = Counter("mcp_agent_ws_broadcast_messages_total",
+                             "广播消息按连接的处理结果（queued/coalesced/dropped/evicted/sent/failed）")
+BROADCAST_DURATION = Histogram("mcp_agent_ws_broadcast_seconds", "一次广播写入全部连接发送队列的耗时",
+                               buckets=FANOUT_BUCKETS)
+
+
+class OutboundQueue:
+    """
+    单个连接的有界发送队列
+
+    带合并键的消息在 coalesce 策略下替换队列中同键的未发送消息，保持原来的排队位置
+    """
+
+    def __init__(self, maxsize: int, policy: str):
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items: Deque[list] = deque()
+        self._keyed: Dict[str, list] = {}
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, message: str, key: Optional[str] = None) -> str:
+        """
+        放入消息
+
+        Returns:
+            处理结果: queued / coalesced / dropped（丢弃了最旧的消息后入队）/ overflow（队满，需断开）
+        """
+        if key is not None and self.policy == "coalesce" and key in self._keyed:
+            self._keyed[key][1] = message
+            return "coalesced"
+        outcome = "queued"
+        if len(self._items) >= self.maxsize:
+            if self.policy == "disconnect":
+                return "overflow"
+            oldest = self._items.popleft()
+            if oldest[0] is not None and self._keyed.get(oldest[0]) is oldest:
+                del self._keyed[oldest[0]]
+            outcome = "dropped"
+        entry = [key, message]
+        self._items.append(entry)
+        if key is not None:
+            self._keyed[key] = entry
+        self._ready.set()
+        return outcome
+
+    async def put_wait(self, message: str) -> bool:
+        """队满时等待空间再放入（背压），队列已关闭时返回False"""
+        while len(self._items) >= self.maxsize and not self.closed:
+            self._space.clear()
+            await self._space.wait()
+        if self.closed:
+            return False
+        self.put(message)
+        return True
+
+    def close(self):
+        """写任务退出后关闭队列，唤醒等待空间的发送方"""
+        self.closed = True
+        self._space.set()
+
+    async def get(self) -> str:
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        entry = self._items.popleft()
+        if entry[0] is not None and self._keyed.get(entry[0]) is entry:
+            del self._keyed[entry[0]]
+        self._space.set()
+        return entry[1]
+
+
+class ClientConnection:
+    """一个客户端连接：发送队列 + 写任务"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int, policy: str):
+        self.websocket = websocket
+        self.queue = OutboundQueue(queue_size, policy)
+        self.writer: Optional[asyncio.Task] = None
+        self.close_code: Optional[int] = None
+        # 队列清空且没有正在发送的消息时置位，drain 据此等待已入队消息发送完毕
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def offer(self, message: str, key: Optional[str] = None) -> str:
+        outcome = self.queue.put(message, key)
+        if outcome != "overflow":
+            self.idle.clear()
+        if outcome == "dropped":
+            self.dropped += 1
+        elif outcome == "coalesced":
+            self.coalesced += 1
+        return outcome
+
+    async def send(self, message: str) -> bool:
+        """放入队列，队满时等待写任务发送（不丢弃），连接已关闭时返回False"""
+        if not await self.queue.put_wait(message):
+            return False
+        self.idle.clear()
+        return True
+
+    async def run(self, on_exit):
+        """按顺序发送队列中的消息，发送失败或被关闭时退出"""
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_text(message)
+                self.sent += 1
+                BROADCAST_MESSAGES.inc(outcome="sent")
+                if not len(self.queue):
+                    self.idle.set()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[广播] 发送消息失败: {e}")
+            BROADCAST_MESSAGES.inc(outcome="failed")
+        finally:
+            self.idle.set()
+            self.queue.close()
+            if self.close_code is not None:
+                try:
+                    await self.websocket.close(code=self.close_code)
+                except Exception:
+                    pass
+            on_exit(self)
+
+    async def drain(self, timeout: float) -> bool:
+        """等待已入队的消息发送完毕，返回是否在超时前完成"""
+        if self.writer is None or self.writer.done():
+            return True
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def describe(self) -> Dict[str, Any]:
+        websocket = self.websocket
+        return {
+            "id": id(websocket),
+            "state": websocket.client_state.name if hasattr(websocket, 'client_state') else "unknown",
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+class ConnectionManager:
+    """WebSocket连接管理和广播扇出"""
+
+    def __init__(self, queue_size: Optional[int] = None, policy: Optional[str] = None):
+        self.queue_size = queue_size or BROADCAST_QUEUE_SIZE
+        self.policy = policy or SLOW_CONSUMER_POLICY
+        if self.policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"未知的慢消费者策略: {self.policy}，可选 {', '.join(SLOW_CONSUMER_POLICIES)}")
+        self.connections: Dict[int, ClientConnection] = {}
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        self.register(websocket)
+        print(f"客户端 <{websocket.client.host}:{websocket.client.port}> 已连接. 当前连接数: {len(self.connections)}")
+
+    def register(self, websocket: WebSocket) -> ClientConnection:
+        """登记已接受的连接并启动写任务"""
+        connection = ClientConnection(websocket, self.queue_size, self.policy)
+        self.connections[id(websocket)] = connection
+        connection.writer = asyncio.create_task(connection.run(self._on_writer_exit))
+        return connection
+
+    def disconnect(self, websocket: WebSocket):
+        connection = self.connections.pop(id(websocket), None)
+        if connection is None:
+            return
+        # 写任务可能尚未开始运行，这里直接关闭队列，唤醒等待空间的发送方
+        connection.queue.close()
+        if connection.writer:
+            connection.writer.cancel()
+        print(f"客户端 <{websocket.client.host}:{websocket.client.port}> 已断开.  当前连接数: {len(self.connections)}")
+
+    def _on_writer_exit(self, connection: ClientConnection):
+        # 写任务因发送失败退出时移除连接（已移除时为空操作）
+        if self.connections.get(id(connection.websocket)) is connection:
+            self.disconnect(connection.websocket)
+
+    def _evict(self, connection: ClientConnection):
+        """断开跟不上的慢消费者"""
+        connection.close_code = SLOW_CONSUMER_CLOSE_CODE
+        self.evicted += 1
+        print(f"[广播] 连接 {id(connection.websocket)} 发送队列已满（{self.queue_size}），断开慢消费者")
+        self.disconnect(connection.websocket)
+
+    async def send_personal_message(self, message: str, websocket: WebSocket) -> bool:
+        """
+        经发送队列发给单个连接，与广播消息保持顺序
+
+        队满时等待写任务腾出空间，不按慢消费者策略丢弃；返回是否已入队
+        """
+        connection = self.connections.get(id(websocket))
+        if connection is None or not await connection.send(message):
+            print("发送消息失败: 连接未登记或已断开")
+            return False
+        return True
+
+    def channel(self, websocket: WebSocket) -> "QueuedWebSocket":
+        """连接的发送通道，供分析任务像WebSocket一样调用 send_text"""
+        return QueuedWebSocket(self, websocket)
+
+    async def broadcast(self, message: str, key: Optional[str] = None) -> int:
+        """
+        广播消息：只放入各连接的发送队列，不等待网络发送
+
+        Args:
+            message: 消息文本
+            key: 合并键，coalesce 策略下同键的未发送消息只保留最新一条（如进度、行情快照）
+
+        Returns:
+            接收消息的连接数
+        """
+        start = time.perf_counter()
+        outcomes: Dict[str, int] = {}
+        overflowed: List[ClientConnection] = []
+        for connection in list(self.connections.values()):
+            outcome = connection.offer(message, key)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == "overflow":
+                overflowed.append(connection)
+        for connection in overflowed:
+            self._evict(connection)
+        BROADCAST_DURATION.observe(time.perf_counter() - start)
+        for outcome, count in outcomes.items():
+            BROADCAST_MESSAGES.inc(count, outcome="evicted" if outcome == "overflow" else outcome)
+        return len(self.connections)
+
+    def queued_messages(self) -> int:
+        return sum(len(connection.queue) for connection in self.connections.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_connections": len(self.connections),
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "queued": self.queued_messages(),
+            "evicted": self.evicted,
+            "connections": [connection.describe() for connection in self.connections.values()],
+        }
+
+    async def shutdown(self):
+        """取消全部写任务"""
+        writers = [connection.writer for connection in self.connections.values() if connection.writer]
+        self.connections.clear()
+        for writer in writers:
+            writer.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+
+
+class QueuedWebSocket:
+    """
+    经 ConnectionManager 发送队列写出的WebSocket
+
+    分析任务、合并分析的观看者队列和心跳应答都通过它发送，
+    网络写入只发生在连接的写任务中
+    """
+
+    def __init__(self, manager: ConnectionManager, websocket: WebSocket):
+        self.manager = manager
+        self.websocket = websocket
+
+    @property
+    def client_state(self):
+        return self.websocket.client_state
+
+    async def send_text(self, text: str):
+        await self.manager.send_personal_message(text, self.websocket)
+
+    async def close(self, code: int = 1000):
+        """断开连接，写任务退出时以 code 关闭WebSocket（如合并分析断开慢观看者）"""
+        connection = self.manager.connections.get(id(self.websocket))
+        if connection is None:
+            return
+        connection.close_code = code
+        self.manager.disconnect(self.websocket)
+
+
+# 进程内共享的连接管理器
+connection_manager = ConnectionManager()
+
+register_metrics(
+    BROADCAST_MESSAGES,
+    BROADCAST_DURATION,
+    Gauge("mcp_agent_ws_connections", "当前WebSocket连接数", lambda: len(connection_manager)),
+    Gauge("mcp_agent_ws_queued_messages", "各连接发送队列中待发送的消息总数",
+          connection_manager.queued_messages),
+)